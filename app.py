@@ -6,7 +6,7 @@ import streamlit.components.v1 as components
 import os
 import json
 from pathlib import Path
-from backend import QAAgentBackend
+from backend import QAAgentBackend, DocumentSource, DEFAULT_KNOWLEDGE_BASE, get_ingestion_job_manager
 
 # Page configuration
 st.set_page_config(
@@ -662,6 +662,77 @@ if 'knowledge_base_built' not in st.session_state:
 if 'generated_test_cases' not in st.session_state:
     st.session_state.generated_test_cases = []
 
+def describe_ingest_progress(event, progress):
+    """
+    Turn an ingestion progress event into a progress-bar fraction and label.
+    
+    ``progress`` carries state across events: the number of changed sources,
+    how many were parsed, and the per-source "indexed" events seen so far.
+    """
+    stage = event["stage"]
+    elapsed = f"{event['elapsed']:.1f}s"
+    total = max(progress["total"], 1)
+    indexed = len(progress["indexed"])
+    if stage == "hashed":
+        progress["total"] = event["changed"]
+        return 0.05, (
+            f"{event['changed']} changed, {event['unchanged']} unchanged, "
+            f"{event['removed']} removed document(s) ({elapsed})"
+        )
+    if stage == "parsed":
+        progress["parsed"] += 1
+        status = "cached" if event.get("cache_hit") else ("parsed" if event["ok"] else "failed to parse")
+        fraction = 0.05 + 0.25 * min(progress["parsed"] / total, 1.0)
+        return fraction, f"{event['source']} {status} ({progress['parsed']}/{total}, {elapsed})"
+    if stage == "embedded":
+        fraction = 0.3 + 0.7 * indexed / total
+        return fraction, (
+            f"Embedding {event['source']}: {event['embedded']} new of "
+            f"{event['chunks']} chunks ({indexed}/{total} documents indexed, {elapsed})"
+        )
+    if stage == "chunked":
+        fraction = 0.3 + 0.7 * indexed / total
+        return fraction, (
+            f"Split {event['source']} into {event['chunks']} chunks, {event['deduplicated']} duplicate(s) "
+            f"({event['files_done']}/{event['files_total']} files done, {elapsed})"
+        )
+    if stage == "indexed":
+        progress["indexed"].append(event)
+        fraction = 0.3 + 0.7 * event["done"] / total
+        return fraction, (
+            f"Indexed {event['source']} in {event['duration']:.1f}s "
+            f"({event['done']}/{event['total']}, {elapsed})"
+        )
+    if stage == "done":
+        return 1.0, f"Finished in {elapsed}"
+    return 0.0, f"Starting knowledge base build... ({elapsed})"
+
+
+@st.fragment(run_every=1)
+def show_build_progress(job_id):
+    """
+    Show the progress bar and Cancel button of a running background build.
+    
+    Runs as a fragment that refreshes itself every second, so polling the
+    build reruns only this widget; once the build is over, the whole page
+    reruns to show its outcome.
+    """
+    job_manager = get_ingestion_job_manager()
+    job = job_manager.status(job_id)
+    if job is None or job["status"] not in ("queued", "running"):
+        st.rerun()
+    build_progress = {"total": 0, "parsed": 0, "indexed": []}
+    fraction, text = 0.0, "Waiting for the build to start..."
+    for event in job["events"]:
+        fraction, text = describe_ingest_progress(event, build_progress)
+    if job["cancel_requested"]:
+        text = f"Cancelling after the current step... {text}"
+    st.progress(fraction, text=text)
+    if st.button("Cancel Build", use_container_width=True, disabled=job["cancel_requested"]):
+        job_manager.cancel(job_id)
+        st.rerun(scope="fragment")
+
+
 # Custom Header
 st.markdown("""
 <div class="main-header">
@@ -734,6 +805,65 @@ st.markdown("""
 </div>
 """, unsafe_allow_html=True)
 
+job_manager = get_ingestion_job_manager()
+ingest_job = job_manager.status(st.session_state.ingest_job_id) if st.session_state.get('ingest_job_id') else None
+build_running = ingest_job is not None and ingest_job["status"] in ("queued", "running")
+
+def switch_knowledge_base(result):
+    """Reset the per-knowledge-base session state after selecting another knowledge base."""
+    st.session_state.knowledge_base_built = result.get("built", False)
+    st.session_state.generated_test_cases = []
+    st.session_state.last_build_report = None
+    st.session_state.pop('retrieval_sources', None)
+
+# Knowledge base selection: every project keeps its own index, and knowledge
+# bases stay loaded, so switching does not rebuild anything
+st.subheader("Knowledge Base")
+knowledge_bases = backend.list_knowledge_bases()
+kb_names = [kb["name"] for kb in knowledge_bases]
+kb_col1, kb_col2, kb_col3 = st.columns([2, 2, 1])
+with kb_col1:
+    selected_kb = st.selectbox(
+        "Active knowledge base",
+        options=kb_names,
+        index=kb_names.index(backend.knowledge_base) if backend.knowledge_base in kb_names else 0,
+        format_func=lambda name: next(
+            f"{name} ({len(kb['sources'])} document(s))" if kb["built"] else f"{name} (not built)"
+            for kb in knowledge_bases if kb["name"] == name
+        ),
+        disabled=build_running,
+        help="Test cases and scripts are generated from the selected knowledge base"
+    )
+    if selected_kb != backend.knowledge_base:
+        result = backend.select_knowledge_base(selected_kb)
+        if result["status"] == "success":
+            switch_knowledge_base(result)
+            st.rerun()
+        st.error(result["message"])
+with kb_col2:
+    new_kb_name = st.text_input(
+        "New knowledge base",
+        placeholder="e.g. checkout-v2",
+        disabled=build_running,
+        help="Letters, digits, '-' and '_'"
+    )
+    if st.button("Create", disabled=build_running or not new_kb_name):
+        result = backend.create_knowledge_base(new_kb_name)
+        if result["status"] == "success":
+            switch_knowledge_base(backend.select_knowledge_base(new_kb_name.strip()))
+            st.rerun()
+        st.error(result["message"])
+with kb_col3:
+    st.markdown("<br>", unsafe_allow_html=True)
+    if st.button("Delete", use_container_width=True,
+                 disabled=build_running or backend.knowledge_base == DEFAULT_KNOWLEDGE_BASE,
+                 help="Delete the selected knowledge base and its index"):
+        result = backend.delete_knowledge_base(backend.knowledge_base)
+        if result["status"] == "success":
+            switch_knowledge_base(backend.select_knowledge_base(backend.knowledge_base))
+            st.rerun()
+        st.error(result["message"])
+
 # Support Documents Upload
 col1, col2 = st.columns([2, 1])
 with col1:
@@ -814,83 +944,123 @@ else:
 st.markdown("<br>", unsafe_allow_html=True)
 col1, col2, col3 = st.columns([1, 2, 1])
 with col2:
-    if st.button("Build Knowledge Base", type="primary", use_container_width=True):
+    if st.button("Build Knowledge Base", type="primary", use_container_width=True, disabled=build_running):
             if not uploaded_files and not html_content:
                 st.error("Please upload at least one support document or provide HTML content.")
             else:
                 try:
-                    with st.spinner("Building knowledge base... This may take a moment."):
-                        # Save uploaded files temporarily
-                        support_docs_paths = []
-                        temp_dir = Path("./temp_uploads")
-                        temp_dir.mkdir(exist_ok=True)
-                        
-                        for uploaded_file in uploaded_files:
-                            file_path = temp_dir / uploaded_file.name
-                            with open(file_path, "wb") as f:
-                                f.write(uploaded_file.getbuffer())
-                            support_docs_paths.append(str(file_path))
-                        
-                        # Use HTML content from session state if available
-                        html_to_ingest = html_content if html_content else st.session_state.get('html_content', '')
-                        
-                        # If no files uploaded but HTML provided, still proceed
-                        if not support_docs_paths and html_to_ingest:
-                            st.warning("No support documents uploaded. Only HTML content will be stored.")
-                        
-                        # Validate that we have at least HTML content or documents
-                        if not support_docs_paths and not html_to_ingest:
-                            st.error("Please upload at least one support document or provide HTML content.")
-                        else:
-                            # Call backend ingestion with error handling
-                            try:
-                                result = backend.ingest_documents(support_docs_paths, html_to_ingest)
-                                
-                                # Display result
-                                if result["status"] == "success":
-                                    st.balloons()  # Celebration animation
-                                    st.session_state.knowledge_base_built = True
-                                    
-                                    # Show success message
-                                    st.success(f"{result['message']}")
-                                    
-                                    # Show statistics in columns
-                                    stat_col1, stat_col2 = st.columns(2)
-                                    if support_docs_paths:
-                                        with stat_col1:
-                                            st.metric("Documents Processed", len(support_docs_paths))
-                                    if html_to_ingest:
-                                        with stat_col2:
-                                            st.metric("HTML Content Size", f"{len(html_to_ingest):,} chars")
-                                    
-                                    # Success message banner
-                                    st.markdown("<br>", unsafe_allow_html=True)
-                                    st.markdown("""
-                                    <div style="background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%); padding: 2rem; border-radius: 15px; color: white; text-align: center; margin: 2rem 0; box-shadow: 0 10px 30px rgba(240, 147, 251, 0.3);">
-                                        <h2 style="color: white; margin-bottom: 1rem;">Knowledge Base Ready!</h2>
-                                        <p style="color: rgba(255, 255, 255, 0.95); font-size: 1.1rem; margin-bottom: 0;">
-                                            Your knowledge base has been successfully built. You can now proceed to Phase 2 below!
-                                        </p>
-                                    </div>
-                                    """, unsafe_allow_html=True)
-                                    st.rerun()
-                                else:
-                                    st.error(f"{result['message']}")
-                                    st.session_state.knowledge_base_built = False
-                            except Exception as e:
-                                st.error(f"Error building knowledge base: {str(e)}")
-                                st.session_state.knowledge_base_built = False
-                                st.exception(e)  # Show full traceback for debugging
-                        
-                        # Clean up temporary files
-                        for file_path in support_docs_paths:
-                            try:
-                                os.remove(file_path)
-                            except:
-                                pass
+                    # Hand the uploads to the backend in memory; their buffers are not copied
+                    support_docs_paths = [
+                        DocumentSource(uploaded_file.name, uploaded_file)
+                        for uploaded_file in uploaded_files
+                    ]
+                    
+                    # Use HTML content from session state if available
+                    html_to_ingest = html_content if html_content else st.session_state.get('html_content', '')
+                    
+                    # If no files uploaded but HTML provided, still proceed
+                    if not support_docs_paths and html_to_ingest:
+                        st.warning("No support documents uploaded. Only HTML content will be stored.")
+                    
+                    # Validate that we have at least HTML content or documents
+                    if not support_docs_paths and not html_to_ingest:
+                        st.error("Please upload at least one support document or provide HTML content.")
+                    else:
+                        # Run the build in the background so the page stays responsive
+                        st.session_state.ingest_job_id = job_manager.submit(
+                            backend,
+                            support_docs_paths,
+                            html_to_ingest
+                        )
+                        st.session_state.ingest_job_inputs = {
+                            "documents": len(support_docs_paths),
+                            "html_chars": len(html_to_ingest),
+                        }
+                        st.rerun()
                 except Exception as e:
                     st.error(f"Unexpected error: {str(e)}")
                     st.exception(e)
+    
+    # Progress or outcome of the background build
+    if ingest_job is not None:
+        if build_running:
+            show_build_progress(ingest_job["job_id"])
+        else:
+            build_progress = {"total": 0, "parsed": 0, "indexed": []}
+            for event in ingest_job["events"]:
+                describe_ingest_progress(event, build_progress)
+            result = ingest_job["result"]
+            inputs = st.session_state.get('ingest_job_inputs', {})
+            st.session_state.ingest_job_id = None
+            st.session_state.last_build_report = {
+                "result": result,
+                "sources": build_progress["indexed"],
+            }
+            
+            # Display result
+            if ingest_job["status"] == "succeeded":
+                st.balloons()  # Celebration animation
+                st.session_state.knowledge_base_built = True
+                
+                # Show success message
+                st.success(f"{result['message']}")
+                
+                # Show statistics in columns
+                stat_col1, stat_col2 = st.columns(2)
+                if inputs.get("documents"):
+                    with stat_col1:
+                        st.metric("Documents Processed", inputs["documents"])
+                if inputs.get("html_chars"):
+                    with stat_col2:
+                        st.metric("HTML Content Size", f"{inputs['html_chars']:,} chars")
+                
+                # Success message banner
+                st.markdown("<br>", unsafe_allow_html=True)
+                st.markdown("""
+                <div style="background: linear-gradient(135deg, #f093fb 0%, #f5576c 100%); padding: 2rem; border-radius: 15px; color: white; text-align: center; margin: 2rem 0; box-shadow: 0 10px 30px rgba(240, 147, 251, 0.3);">
+                    <h2 style="color: white; margin-bottom: 1rem;">Knowledge Base Ready!</h2>
+                    <p style="color: rgba(255, 255, 255, 0.95); font-size: 1.1rem; margin-bottom: 0;">
+                        Your knowledge base has been successfully built. You can now proceed to Phase 2 below!
+                    </p>
+                </div>
+                """, unsafe_allow_html=True)
+            elif ingest_job["status"] == "cancelled":
+                # Documents indexed before the cancel are kept; the next build (the next
+                # full build, for a rebuild) skips them
+                st.warning(f"{result['message']}")
+            else:
+                st.error(f"{result['message']}")
+                st.session_state.knowledge_base_built = False
+
+# Details of the most recent build
+if st.session_state.get('last_build_report'):
+    report = st.session_state.last_build_report
+    with st.expander("Last build details", expanded=False):
+        stats = report["result"].get("stats", {})
+        if stats:
+            stat_cols = st.columns(5)
+            stat_cols[0].metric("Chunks Embedded", stats.get("chunks_embedded", 0))
+            stat_cols[1].metric("Chunks Removed", stats.get("chunks_deleted", 0))
+            stat_cols[2].metric("Duplicates Skipped", stats.get("chunks_deduplicated", 0))
+            stat_cols[3].metric("Unchanged Documents", stats.get("sources_unchanged", 0))
+            stat_cols[4].metric(
+                "Embedding Throughput", f"{stats.get('embedding_tokens_per_second', 0):,.0f} tok/s",
+                help=f"{stats.get('embedding_rate_limited', 0)} rate-limited request(s)",
+            )
+        if report["sources"]:
+            st.dataframe(
+                [
+                    {
+                        "Document": event["source"],
+                        "Chunks": event["chunks"],
+                        "Embedded": event["embedded"],
+                        "Duplicates": event["deduplicated"],
+                        "Time (s)": event["duration"],
+                    }
+                    for event in report["sources"]
+                ],
+                use_container_width=True,
+            )
 
 # Guidance text after button
 st.markdown("<br>", unsafe_allow_html=True)
@@ -961,6 +1131,16 @@ if st.session_state.knowledge_base_built:
                 help="Describe what test cases you want to generate based on the knowledge base"
             )
         
+        # Optional source scoping for retrieval
+        indexed_sources = backend.list_sources()
+        if len(indexed_sources) > 1:
+            st.multiselect(
+                "Restrict retrieval to documents (optional)",
+                options=indexed_sources,
+                key="retrieval_sources",
+                help="Only retrieve context from the selected documents. Leave empty to search all documents."
+            )
+        
         # HTML Preview Section
         if backend.html_content:
             st.markdown("<br>", unsafe_allow_html=True)
@@ -985,11 +1165,15 @@ if st.session_state.knowledge_base_built:
             else:
                 try:
                     with st.spinner("Generating test cases using RAG pipeline... This may take a moment."):
-                        result = backend.generate_test_cases(user_prompt)
+                        result = backend.generate_test_cases(
+                            user_prompt,
+                            sources=st.session_state.get('retrieval_sources') or None
+                        )
                         
                         if result["status"] == "success":
                             st.balloons()  # Celebration animation
                             st.success(f"{result['message']}")
+                            st.caption(f"Prompt size: {result['prompt_tokens']:,} tokens")
                             
                             # Display test cases
                             test_cases = result.get("test_cases", [])
@@ -1166,11 +1350,15 @@ if st.session_state.generated_test_cases:
     if st.button("Generate Selenium Script", type="primary", use_container_width=True):
         try:
             with st.spinner("Generating Selenium script... This may take a moment."):
-                result = backend.generate_selenium_script(selected_test_case)
+                result = backend.generate_selenium_script(
+                    selected_test_case,
+                    sources=st.session_state.get('retrieval_sources') or None
+                )
                 
                 if result["status"] == "success":
                     st.balloons()  # Celebration animation
                     st.success(f"{result['message']}")
+                    st.caption(f"Prompt size: {result['prompt_tokens']:,} tokens")
                     
                     # Display the generated script
                     st.subheader("Generated Selenium Script")
@@ -1,23 +1,2232 @@
 """
 Backend module for Autonomous QA Agent - Knowledge Base Ingestion Logic
+
+Heavy dependencies (LangChain integrations, Chroma, PyMuPDF, unstructured and
+the OpenAI clients) are imported in the code paths that use them, so importing
+this module and constructing QAAgentBackend stays fast.
 """
 import os
 import json
+import math
 import re
-from typing import List, Dict, Any, Optional
+import hashlib
+import heapq
+import io
+import multiprocessing
+import random
+import shutil
+import signal
+import sqlite3
+import tempfile
+import threading
+import time
+from array import array
+from contextlib import contextmanager, nullcontext
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed, TimeoutError as FuturesTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import List, Dict, Any, Optional, Iterator, Iterable, Callable, Union, BinaryIO, Set, ContextManager
 from pathlib import Path
 from dotenv import load_dotenv
 
-# Load environment variables from .env file
-load_dotenv()
-from langchain_text_splitters import RecursiveCharacterTextSplitter
-from langchain_community.vectorstores import Chroma
-from langchain_core.documents import Document
-from langchain_core.prompts import PromptTemplate
-from pydantic import BaseModel, Field
-import fitz  # PyMuPDF
-from unstructured.partition.auto import partition
-from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+# Load environment variables from .env file
+load_dotenv()
+from pydantic import BaseModel, Field
+
+
+# Name of the ingestion manifest stored next to the vector store
+MANIFEST_FILENAME = "ingest_manifest.json"
+
+# Bump when the manifest layout changes; older manifests trigger a full rebuild
+MANIFEST_VERSION = 1
+
+# Bump when parser output changes so previously indexed sources get re-chunked
+PARSER_VERSION = 5
+
+# Markdown ATX heading, e.g. "## Shipping Options"
+MARKDOWN_HEADING_RE = re.compile(r'^(#{1,6})\s+(.+?)\s*#*\s*$')
+
+# Default text splitter settings
+CHUNK_SIZE = 1000
+CHUNK_OVERLAP = 200
+
+# Overlap per file type. Markdown sections and JSON subtrees are already
+# split at structural boundaries and PDF segments are single pages, so they
+# need little or no overlap; everything else keeps the default.
+CHUNK_OVERLAP_BY_TYPE = {
+    '.md': 0,
+    '.json': 0,
+    '.pdf': 50,
+    '.html': 100,
+    '.htm': 100,
+}
+
+# The HTML of the page under test is indexed as a source of its own, split
+# into DOM segments; prompts get its most relevant fragments
+HTML_SOURCE = "page-under-test.html"
+
+# Default prompt token budget of each LLM request (QA_CONTEXT_TOKENS).
+# Documentation passages and HTML fragments are packed, best first, into what
+# the instructions and the test case leave of it
+CONTEXT_TOKEN_BUDGET = 8000
+
+# Chunks' worth of documentation passages, and of HTML fragments, retrieved as
+# packing candidates for each prompt
+CONTEXT_CANDIDATE_K = 12
+
+# Tokens of a packed passage's label and separator ("Document 3:", "Source:"),
+# and the least worth sending of a passage that has to be truncated to fit
+PASSAGE_OVERHEAD_TOKENS = 8
+MIN_TRUNCATED_PASSAGE_TOKENS = 64
+
+# Retrieval: chunks per prompt, and candidates taken from each of the vector
+# and BM25 keyword rankings before they are fused with reciprocal rank fusion
+RETRIEVAL_K = 4
+HYBRID_CANDIDATES = 12
+RRF_K = 60
+
+# Entries in each of the process-wide LRU caches of query embeddings and
+# retrieval results; QA_RETRIEVAL_CACHE_SIZE=0 disables them
+RETRIEVAL_CACHE_SIZE = int(os.getenv("QA_RETRIEVAL_CACHE_SIZE", "256"))
+
+# Retrieved chunks are diversified with maximal marginal relevance (MMR):
+# 1.0 ranks by relevance only, lower values penalize passages similar to
+# ones already selected
+MMR_LAMBDA = 0.7
+
+# Metadata that must match for neighbouring chunks to be merged into one passage
+PASSAGE_LOCATION_KEYS = ("source", "page", "heading", "json_path", "element")
+
+# BM25 keyword index stored next to the vector store; bump the version when
+# tokenization changes so existing knowledge bases are re-indexed
+KEYWORD_INDEX_FILENAME = "keyword_index.sqlite3"
+
+# Fingerprints of the stored chunks and the duplicates dropped in their favour
+DEDUP_INDEX_FILENAME = "dedup_index.sqlite3"
+
+# Full rebuilds write to a new collection and record their progress here
+# until they replace the live collection
+STAGING_MANIFEST_FILENAME = "ingest_manifest.staging.json"
+
+# Chroma stores each collection's vector index in a directory named after its segment ID
+CHROMA_SEGMENT_DIR_RE = re.compile(r'[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}')
+KEYWORD_INDEX_VERSION = 2
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+# Identifiers such as "full-name", "SAVE15" or "checkout.total" are indexed
+# whole as well as by their parts; frequent English words are not indexed
+KEYWORD_TOKEN_RE = re.compile(r'\w+(?:[-.]\w+)*')
+KEYWORD_STOPWORDS = frozenset(
+    "a an and are as at be by for from has have if in into is it its of on or that the their "
+    "then there these this to was were will with".split()
+)
+
+# Elements that become their own HTML segment, besides elements with a
+# "section"-like class or a landmark role
+HTML_SEGMENT_TAGS = {"form", "section", "article", "aside", "nav", "header", "footer", "main", "fieldset", "dialog", "table"}
+HTML_SEGMENT_ROLES = {"form", "region", "dialog", "navigation", "search", "tabpanel"}
+HTML_INTERACTIVE_TAGS = ["input", "button", "select", "textarea", "a"]
+
+# JSON subtrees to leave out of the index, as comma-separated path patterns
+# where * matches anything, e.g. "$.paths.*.examples,*.x-codeSamples"
+JSON_SKIP_PATHS = tuple(
+    pattern.strip() for pattern in os.getenv("QA_JSON_SKIP_PATHS", "").split(",") if pattern.strip()
+)
+
+# Longer JSON strings (e.g. embedded base64 blobs) are truncated while parsing
+JSON_MAX_STRING_CHARS = 20000
+
+# Supported QA_VECTOR_STORE values and the directory each one persists to
+VECTOR_STORE_DIRECTORIES = {"chroma": "./chroma_db", "numpy": "./numpy_index"}
+
+# Named knowledge bases live in their own directory under QA_KNOWLEDGE_BASE_DIR;
+# the default one keeps the directory above, so existing builds stay usable
+DEFAULT_KNOWLEDGE_BASE = "default"
+KNOWLEDGE_BASE_NAME_RE = re.compile(r'[A-Za-z0-9][A-Za-z0-9_-]{0,63}')
+
+# Supported QA_EMBEDDINGS_PROVIDER values and the default local vector size
+EMBEDDINGS_PROVIDERS = ("openai", "local")
+LOCAL_EMBED_DIM = 1024
+
+# Near-duplicate detection: SimHash over word 3-gram shingles. Chunks whose
+# 64-bit fingerprints differ in at most SIMHASH_MAX_DISTANCE bits are
+# candidates, dropped only if every shingle of theirs is already in the
+# candidate; chunks with fewer shingles only get exact-match dedup.
+SIMHASH_SHINGLE_SIZE = 3
+SIMHASH_MIN_SHINGLES = 8
+SIMHASH_MAX_DISTANCE = 3
+
+# Number of chunks sent to the vector store (and embeddings API) per upsert
+UPSERT_BATCH_SIZE = 128
+
+# Embedding scheduler: tokens per embeddings request, concurrent requests, and
+# the request latency (seconds) above which concurrency is reduced
+EMBED_BATCH_TOKENS = 8192
+EMBED_BATCH_MAX_TEXTS = 1024
+EMBED_MAX_CONCURRENCY = 8
+EMBED_TARGET_LATENCY = 10.0
+EMBED_MAX_RETRIES = 6
+
+# Texts looked up or stored per statement in the embedding cache (below SQLite's variable limit)
+EMBED_CACHE_BATCH_SIZE = 500
+
+# In-memory uploads larger than this reach the parser processes through a
+# private temp file; smaller ones are sent to them as bytes
+UPLOAD_SPOOL_THRESHOLD_MB = 32
+
+
+def _sha256_file(file_path: str, block_size: int = 1024 * 1024) -> str:
+    """Return the hex sha256 digest of a file, read in blocks."""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _sha256_bytes(data: memoryview) -> str:
+    """Return the hex sha256 digest of an in-memory document."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def _sha256_text(text: str) -> str:
+    """Return the hex sha256 digest of a text chunk."""
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _parser_signature() -> str:
+    """Identify the parser output format: the parser version plus any settings that change it."""
+    if not JSON_SKIP_PATHS:
+        return f"p{PARSER_VERSION}"
+    return f"p{PARSER_VERSION}-{_sha256_text(','.join(JSON_SKIP_PATHS))[:8]}"
+
+
+def _chunk_id(source: str, chunk_hash: str, occurrence: int) -> str:
+    """
+    Build a deterministic vector store ID for a chunk.
+
+    The ID depends only on the source name, the chunk content and how many
+    identical chunks precede it in the same source, so unchanged chunks keep
+    their ID across rebuilds and never need to be re-embedded.
+    """
+    key = f"{source}\x00{chunk_hash}\x00{occurrence}"
+    return hashlib.sha256(key.encode('utf-8')).hexdigest()[:32]
+
+
+def _shingle_hashes(text: str) -> "np.ndarray":
+    """Sorted, distinct 64-bit hashes of the lowercased word ``SIMHASH_SHINGLE_SIZE``-grams of a chunk."""
+    import numpy as np
+    
+    words = re.findall(r'\w+', text.lower())
+    shingles = {
+        " ".join(words[i:i + SIMHASH_SHINGLE_SIZE])
+        for i in range(len(words) - SIMHASH_SHINGLE_SIZE + 1)
+    }
+    return np.unique(np.fromiter(
+        (int.from_bytes(hashlib.blake2b(s.encode('utf-8'), digest_size=8).digest(), 'little') for s in shingles),
+        dtype='<u8',
+        count=len(shingles),
+    ))
+
+
+def _simhash(shingle_hashes: "np.ndarray") -> Optional[int]:
+    """
+    Compute a 64-bit SimHash fingerprint of a chunk from its shingle hashes.
+    
+    Returns:
+        The fingerprint, or None if the text is too short for a stable one
+    """
+    import numpy as np
+    
+    if len(shingle_hashes) < SIMHASH_MIN_SHINGLES:
+        return None
+    # One row of 64 bits per shingle; a fingerprint bit is set when the
+    # majority of shingle hashes have it set
+    bits = np.unpackbits(shingle_hashes.view(np.uint8).reshape(-1, 8), axis=1, bitorder='little')
+    majority = bits.sum(axis=0) * 2 > len(shingle_hashes)
+    return int(np.packbits(majority, bitorder='little').view('<u8')[0])
+
+
+def _metadata_filter_sql(where: Dict[str, Any], columns: Dict[str, str]) -> tuple:
+    """
+    Translate a vector store metadata filter into an SQL condition.
+    
+    Supports the filters the backend builds (see ``_source_filter`` and
+    ``_scope_filter``): equality, ``$ne`` and ``$in`` on the metadata keys
+    in ``columns``, and ``$or`` of such filters.
+    
+    Returns:
+        ``(condition, parameters)``
+    """
+    if set(where) == {"$or"}:
+        parts = [_metadata_filter_sql(clause, columns) for clause in where["$or"]]
+        return "(" + " OR ".join(sql for sql, _ in parts) + ")", [value for _, values in parts for value in values]
+    if len(where) != 1 or next(iter(where)) not in columns:
+        raise ValueError(f"Unsupported metadata filter: {where}")
+    key, condition = next(iter(where.items()))
+    column = columns[key]
+    if not isinstance(condition, dict):
+        return f"{column} = ?", [condition]
+    if set(condition) == {"$ne"}:
+        return f"{column} != ?", [condition["$ne"]]
+    if set(condition) == {"$in"}:
+        values = list(condition["$in"])
+        return f"{column} IN ({','.join('?' * len(values))})", values
+    raise ValueError(f"Unsupported metadata filter: {where}")
+
+
+class NearDuplicateIndex:
+    """
+    Fingerprints of the stored chunks of a collection, and the chunks dropped
+    as their duplicates, stored in SQLite next to the vector store.
+    
+    Every stored chunk is recorded with its content hash, its SimHash
+    fingerprint in four 16-bit bands and its shingle hashes. Two fingerprints
+    within SIMHASH_MAX_DISTANCE bits of each other must agree on at least one
+    band, so only chunks sharing a band are compared. A fingerprint match is
+    only a candidate: a chunk is a near duplicate if all of its shingles
+    occur in the candidate, so a copy that adds anything (a discount code, a
+    limit) is never dropped. Nothing is held in memory between calls, so a
+    build's memory does not grow with the corpus.
+    
+    A dropped chunk is recorded as an alias of the stored chunk holding its
+    content, with its own text and metadata: retrieval scoped to its source
+    can reach the stored chunk (see ``aliased_hashes``), and once the stored
+    chunk is deleted the alias is stored in its place (see ``remove``).
+    """
+    
+    BANDS = 4
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._initialized = False
+    
+    def _connect(self) -> sqlite3.Connection:
+        # One short-lived connection per call, like KeywordIndex
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            connection.execute("PRAGMA journal_mode=WAL")
+            bands = ", ".join(f"band{band} INTEGER" for band in range(self.BANDS))
+            connection.executescript(
+                "CREATE TABLE IF NOT EXISTS fingerprints ("
+                "chunk_id TEXT PRIMARY KEY, source TEXT NOT NULL, chunk_hash TEXT NOT NULL, "
+                f"simhash INTEGER, {bands}, shingles BLOB);"
+                "CREATE INDEX IF NOT EXISTS fingerprints_source ON fingerprints (source);"
+                "CREATE INDEX IF NOT EXISTS fingerprints_hash ON fingerprints (chunk_hash);"
+                + "".join(
+                    f"CREATE INDEX IF NOT EXISTS fingerprints_band{band} ON fingerprints (band{band});"
+                    for band in range(self.BANDS)
+                )
+                + "CREATE TABLE IF NOT EXISTS aliases ("
+                "chunk_id TEXT PRIMARY KEY, source TEXT NOT NULL, kept_id TEXT NOT NULL, "
+                "kept_source TEXT NOT NULL, kept_hash TEXT NOT NULL, text TEXT NOT NULL, metadata TEXT NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS aliases_source ON aliases (source);"
+                "CREATE INDEX IF NOT EXISTS aliases_kept ON aliases (kept_id);"
+            )
+            connection.commit()
+            self._initialized = True
+        return connection
+    
+    def _bands(self, simhash: int) -> List[int]:
+        return [(simhash >> (16 * band)) & 0xFFFF for band in range(self.BANDS)]
+    
+    def _find_container(self, connection: sqlite3.Connection, source: str, chunk_hash: str,
+                        simhash: Optional[int], shingle_hashes: "np.ndarray",
+                        seen_ids: Optional[Set[str]]) -> Optional[tuple]:
+        """Return ``(chunk_id, source, chunk_hash)`` of a stored chunk holding all of this chunk's content."""
+        import numpy as np
+        
+        def eligible(chunk_id: str, chunk_source: str) -> bool:
+            return chunk_source != source or seen_ids is None or chunk_id in seen_ids
+        
+        for chunk_id, chunk_source in connection.execute(
+                "SELECT chunk_id, source FROM fingerprints WHERE chunk_hash = ?", (chunk_hash,)):
+            if eligible(chunk_id, chunk_source):
+                return chunk_id, chunk_source, chunk_hash
+        if simhash is None:
+            return None
+        rows = connection.execute(
+            "SELECT chunk_id, source, chunk_hash, simhash, shingles FROM fingerprints WHERE "
+            + " OR ".join(f"band{band} = ?" for band in range(self.BANDS)),
+            self._bands(simhash),
+        )
+        for chunk_id, chunk_source, candidate_hash, candidate, shingles in rows:
+            # Fingerprints are stored as signed 64-bit integers
+            if (eligible(chunk_id, chunk_source)
+                    and bin((candidate ^ simhash) & 0xFFFFFFFFFFFFFFFF).count("1") <= SIMHASH_MAX_DISTANCE
+                    and np.isin(shingle_hashes, np.frombuffer(shingles, dtype='<u8'), assume_unique=True).all()):
+                return chunk_id, chunk_source, candidate_hash
+        return None
+    
+    def deduplicate(self, source: str, chunks: List["Document"], stored_ids: Set[str],
+                    seen_ids: Optional[Set[str]] = None) -> List["Document"]:
+        """
+        Drop the chunks of a batch whose content a stored chunk already holds.
+        
+        Chunks in ``stored_ids`` (already in the vector store) are kept
+        without a check. Other chunks are compared with the stored chunks of
+        other sources and, of their own source, with those in ``seen_ids``
+        (the chunks kept so far while the source is re-synced; None allows
+        all). Kept chunks are fingerprinted and added to ``seen_ids``; dropped
+        ones are recorded as aliases.
+        
+        Returns:
+            The kept chunks, in order
+        """
+        kept: List["Document"] = []
+        with self._connect() as connection:
+            for doc in chunks:
+                shingle_hashes = _shingle_hashes(doc.page_content)
+                simhash = _simhash(shingle_hashes)
+                container = None
+                if doc.id not in stored_ids:
+                    container = self._find_container(
+                        connection, source, doc.metadata["chunk_hash"], simhash, shingle_hashes, seen_ids
+                    )
+                if container:
+                    connection.execute(
+                        "INSERT OR REPLACE INTO aliases VALUES (?, ?, ?, ?, ?, ?, ?)",
+                        (doc.id, source, *container, doc.page_content, json.dumps(doc.metadata)),
+                    )
+                    continue
+                if simhash is None:
+                    row = [None] * (self.BANDS + 2)
+                else:
+                    signed = simhash - (1 << 64) if simhash >= 1 << 63 else simhash
+                    row = [signed, *self._bands(simhash), shingle_hashes.tobytes()]
+                connection.execute(
+                    f"INSERT OR REPLACE INTO fingerprints VALUES (?, ?, ?, {', '.join('?' * len(row))})",
+                    (doc.id, source, doc.metadata["chunk_hash"], *row),
+                )
+                if seen_ids is not None:
+                    seen_ids.add(doc.id)
+                kept.append(doc)
+        return kept
+    
+    def chunk_ids(self, source: str) -> List[str]:
+        """IDs of the fingerprinted chunks of a source."""
+        if not os.path.exists(self.path):
+            return []
+        with self._connect() as connection:
+            return [row[0] for row in connection.execute("SELECT chunk_id FROM fingerprints WHERE source = ?", (source,))]
+    
+    def drop_aliases(self, source: str) -> None:
+        """Forget the duplicates dropped from a source, before it is deduplicated again."""
+        if not os.path.exists(self.path):
+            return
+        with self._connect() as connection:
+            connection.execute("DELETE FROM aliases WHERE source = ?", (source,))
+    
+    def remove(self, chunk_ids: List[str]) -> List["Document"]:
+        """
+        Forget deleted chunks.
+        
+        Returns:
+            The chunks dropped as duplicates of the deleted ones, whose content
+            is no longer stored; they must be deduplicated and stored again
+        """
+        from langchain_core.documents import Document
+        
+        if not chunk_ids or not os.path.exists(self.path):
+            return []
+        orphans: List["Document"] = []
+        with self._connect() as connection:
+            for start in range(0, len(chunk_ids), EMBED_CACHE_BATCH_SIZE):
+                batch = chunk_ids[start:start + EMBED_CACHE_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                orphans.extend(
+                    Document(id=chunk_id, page_content=text, metadata=json.loads(metadata))
+                    for chunk_id, text, metadata in connection.execute(
+                        f"SELECT chunk_id, text, metadata FROM aliases WHERE kept_id IN ({placeholders})", batch
+                    )
+                )
+                connection.execute(f"DELETE FROM aliases WHERE kept_id IN ({placeholders})", batch)
+                connection.execute(f"DELETE FROM fingerprints WHERE chunk_id IN ({placeholders})", batch)
+        return orphans
+    
+    def aliased_hashes(self, where: Dict[str, Any]) -> List[str]:
+        """
+        Content hashes of the stored chunks outside a ``source`` filter that
+        hold the content of chunks dropped from sources inside it.
+        """
+        if not where or not os.path.exists(self.path):
+            return []
+        inside, inside_values = _metadata_filter_sql(where, {"source": "source"})
+        outside, outside_values = _metadata_filter_sql(where, {"source": "kept_source"})
+        with self._connect() as connection:
+            return [row[0] for row in connection.execute(
+                f"SELECT DISTINCT kept_hash FROM aliases WHERE {inside} AND NOT ({outside})",
+                [*inside_values, *outside_values],
+            )]
+    
+    def clear(self) -> None:
+        """Delete the whole index."""
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(self.path + suffix)
+            except OSError:
+                pass
+        self._initialized = False
+
+
+def _progress_event(stage: str, started: float, **fields: Any) -> Dict[str, Any]:
+    """Build an ingestion progress event stamped with seconds since ``started``."""
+    return {"stage": stage, "elapsed": round(time.perf_counter() - started, 3), **fields}
+
+
+class DocumentSource:
+    """
+    A support document held in memory, such as a Streamlit upload.
+    
+    The content is kept as a ``memoryview``: buffers and ``io.BytesIO``
+    objects (Streamlit's ``UploadedFile`` is one) are wrapped without copying.
+    Other file-like objects are read once. Pickling copies the content, which
+    is how small uploads reach the parser processes.
+    """
+    
+    def __init__(self, name: str, data: Union[bytes, bytearray, memoryview, BinaryIO]):
+        self.name = name
+        if hasattr(data, "getbuffer"):
+            data = data.getbuffer()
+        elif hasattr(data, "read"):
+            data = data.read()
+        self.data = memoryview(data)
+    
+    def __reduce__(self):
+        return (DocumentSource, (self.name, self.data.tobytes()))
+    
+    @property
+    def size(self) -> int:
+        return self.data.nbytes
+    
+    def __str__(self) -> str:
+        return self.name
+    
+    def write_to(self, directory: str) -> str:
+        """
+        Write the document to a new file in ``directory``, keeping its extension.
+        
+        Returns:
+            Path of the written file
+        """
+        fd, file_path = tempfile.mkstemp(suffix=Path(self.name).suffix, dir=directory)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(self.data)
+        return file_path
+
+
+# A support document: a path on disk or an in-memory DocumentSource
+SupportDocument = Union[str, DocumentSource]
+
+# Documents to ingest, as a list or keyed by source name
+SupportDocuments = Union[List[SupportDocument], Dict[str, SupportDocument]]
+
+
+class ParseTimeoutError(BaseException):
+    """
+    Raised inside a parse worker when a document exceeds its time budget.
+
+    Derives from BaseException so the generic error handling in the parsers
+    cannot swallow it and fall back to reading the file as text.
+    """
+
+
+class IngestionCancelled(Exception):
+    """Raised inside a knowledge base build whose cancel event has been set."""
+
+
+def _read_document_text(document: SupportDocument, errors: str = 'strict') -> str:
+    """Decode a document as UTF-8 text, from disk or straight from memory."""
+    if isinstance(document, DocumentSource):
+        return str(document.data, 'utf-8', errors)
+    with open(document, 'r', encoding='utf-8', errors=errors) as f:
+        return f.read()
+
+
+def _iter_segments_by_type(document: SupportDocument) -> Iterator[Dict[str, Any]]:
+    """Yield text segments of a document using the parser for its file type."""
+    in_memory = isinstance(document, DocumentSource)
+    file_ext = Path(str(document)).suffix.lower()
+    
+    if file_ext == '.pdf':
+        # Use PyMuPDF for PDF parsing, one segment per page so memory stays
+        # bounded by the largest page rather than the whole document
+        import fitz  # PyMuPDF
+        doc = fitz.open(stream=document.data, filetype="pdf") if in_memory else fitz.open(document)
+        try:
+            for page_number, page in enumerate(doc, start=1):
+                text = page.get_text()
+                if text.strip():
+                    yield {"text": text, "page": page_number}
+        finally:
+            doc.close()
+    elif file_ext == '.md':
+        # Split Markdown into heading sections so chunks carry their heading
+        yield from _iter_markdown_sections(_read_document_text(document))
+    elif file_ext in ('.html', '.htm'):
+        # Split HTML into forms, sections and widget groups keyed by element
+        yield from _iter_html_segments(_read_document_text(document))
+    elif file_ext == '.json':
+        # Stream JSON as subtrees keyed by their JSON path, without loading the file
+        yield from _iter_json_segments(_iter_text_blocks(document), CHUNK_SIZE, JSON_SKIP_PATHS)
+    elif file_ext == '.txt':
+        # Read text files directly
+        yield {"text": _read_document_text(document)}
+    else:
+        # Use unstructured for other file types, starting a new segment on
+        # every page break or title element
+        from unstructured.partition.auto import partition
+        if in_memory:
+            elements = partition(file=io.BytesIO(document.data), metadata_filename=document.name)
+        else:
+            elements = partition(filename=document)
+        page_number = None
+        heading = None
+        texts: List[str] = []
+        for el in elements:
+            el_page = getattr(el.metadata, "page_number", None)
+            is_title = getattr(el, "category", None) == "Title"
+            if texts and (el_page != page_number or is_title):
+                yield _make_segment("\n\n".join(texts), page_number, heading)
+                texts = []
+            page_number = el_page
+            if is_title:
+                heading = str(el).strip()
+            texts.append(str(el))
+        if texts:
+            yield _make_segment("\n\n".join(texts), page_number, heading)
+
+
+def _iter_markdown_sections(text: str) -> Iterator[Dict[str, Any]]:
+    """
+    Split Markdown text at ATX headings.
+    
+    Each section keeps its heading line(s) and records the heading path, e.g.
+    "Discount Codes > SAVE15 Discount Code". Headings inside fenced code
+    blocks are ignored.
+    """
+    heading_stack: List[tuple] = []
+    lines: List[str] = []
+    in_fence = False
+    
+    def section():
+        body = "".join(lines)
+        if body.strip():
+            path = " > ".join(title for _, title in heading_stack) or None
+            return _make_segment(body, None, path)
+        return None
+    
+    for line in text.splitlines(keepends=True):
+        if line.lstrip().startswith(("```", "~~~")):
+            in_fence = not in_fence
+        match = None if in_fence else MARKDOWN_HEADING_RE.match(line)
+        if match:
+            # A heading directly followed by a sub-heading is kept with it
+            # instead of becoming a chunk of its own
+            has_body = any(
+                l.strip() and not MARKDOWN_HEADING_RE.match(l) for l in lines
+            )
+            if has_body:
+                yield section()
+                lines = []
+            level = len(match.group(1))
+            while heading_stack and heading_stack[-1][0] >= level:
+                heading_stack.pop()
+            heading_stack.append((level, match.group(2)))
+        lines.append(line)
+    segment = section()
+    if segment:
+        yield segment
+
+
+def _json_child_path(path: str, key: Any) -> str:
+    """Extend a JSON path with an object key or array index."""
+    if isinstance(key, int):
+        return f"{path}[{key}]"
+    if re.fullmatch(r'[A-Za-z_][A-Za-z0-9_]*', key):
+        return f"{path}.{key}"
+    return f"{path}[{json.dumps(key, ensure_ascii=False)}]"
+
+
+def _is_html_segment_root(tag) -> bool:
+    """Whether a DOM element starts an HTML segment of its own."""
+    if tag.name in HTML_SEGMENT_TAGS or tag.get("role") in HTML_SEGMENT_ROLES:
+        return True
+    return any("section" in cls for cls in tag.get("class") or [])
+
+
+def _html_element_label(tag) -> str:
+    """Describe an element as a short CSS-like selector, e.g. "form#checkout-form"."""
+    if tag.get("id"):
+        return f"{tag.name}#{tag['id']}"
+    classes = tag.get("class") or []
+    return tag.name + "".join(f".{cls}" for cls in classes[:2])
+
+
+def _html_heading(tag) -> Optional[str]:
+    """
+    Return the heading, legend, caption or ARIA label that names an element,
+    falling back to the heading of the closest enclosing element that has one.
+    """
+    heading_tags = ["h1", "h2", "h3", "h4", "h5", "h6", "legend", "caption"]
+    heading = tag.find(heading_tags)
+    if heading and heading.get_text(strip=True):
+        return heading.get_text(" ", strip=True)
+    if tag.get("aria-label"):
+        return tag["aria-label"]
+    for ancestor in tag.parents:
+        heading = ancestor.find(heading_tags, recursive=False)
+        if heading and heading.get_text(strip=True):
+            return heading.get_text(" ", strip=True)
+    return None
+
+
+def _minify_html(markup: str) -> str:
+    """Collapse whitespace in serialized HTML."""
+    return re.sub(r'>\s+<', '><', re.sub(r'\s+', ' ', markup)).strip()
+
+
+def _iter_html_segments(html: str) -> Iterator[Dict[str, Any]]:
+    """
+    Split an HTML page into DOM segments.
+    
+    Forms, landmark sections and section-like containers each become a
+    segment with their markup (minus inline styles), innermost first so a
+    nested form is not repeated inside its section; the nested element is
+    replaced by a ``<!-- see ... -->`` marker in its parent. Whatever is left
+    of the body and every inline script form segments of their own.
+    """
+    from bs4 import BeautifulSoup, Comment
+    soup = BeautifulSoup(html, "html.parser")
+    title = soup.title.get_text(strip=True) if soup.title else None
+    for tag in soup(["head", "style", "noscript", "svg", "meta", "link"]):
+        tag.decompose()
+    for comment in soup.find_all(string=lambda text: isinstance(text, Comment)):
+        comment.extract()
+    scripts = [script.extract() for script in soup("script")]
+    for tag in soup.find_all(True):
+        tag.attrs.pop("style", None)
+    
+    body = soup.body or soup
+    segments = []
+    # find_all returns elements in document order, so reversing it visits
+    # nested segments before the segments that contain them
+    for tag in reversed(body.find_all(_is_html_segment_root)):
+        label = _html_element_label(tag)
+        heading = _html_heading(tag)
+        # Skip containers left with nothing but their heading once nested segments are gone
+        text = tag.get_text(" ", strip=True)
+        if tag.find(HTML_INTERACTIVE_TAGS) or (text and text != heading):
+            segment = {"text": _minify_html(str(tag)), "element": label}
+            if heading:
+                segment["heading"] = heading
+            segments.append(segment)
+        tag.replace_with(Comment(f" see {label} "))
+    for segment in reversed(segments):
+        yield segment
+    
+    if body.get_text(strip=True) or body.find(HTML_INTERACTIVE_TAGS):
+        segment = {"text": _minify_html(str(body)), "element": "body"}
+        if title:
+            segment["heading"] = title
+        yield segment
+    for number, script in enumerate(scripts, start=1):
+        code = script.get_text().strip()
+        if code:
+            yield {"text": code, "element": f"script[{number}]"}
+
+
+class _JsonTokenizer:
+    """
+    Pull tokenizer for JSON text arriving in blocks.
+    
+    Only the current block (plus a token cut by a block boundary) is held in
+    memory. Strings longer than ``max_string_chars`` are truncated while they
+    are read, so a single huge value (e.g. an embedded blob) cannot exhaust
+    memory either.
+    """
+    _WHITESPACE_RE = re.compile(r'[ \t\n\r]*')
+    _SCALAR_RE = re.compile(r'-?(?:0|[1-9]\d*)(?:\.\d+)?(?:[eE][+-]?\d+)?|true|false|null')
+    _DELIMITER_RE = re.compile(r'[ \t\n\r,:\]}]')
+    _STRING_BODY_RE = re.compile(r'[^"\\]*(?:\\.[^"\\]*)*', re.S)
+    _decoder = json.JSONDecoder()
+    
+    def __init__(self, blocks: Iterable[str], max_string_chars: int = JSON_MAX_STRING_CHARS):
+        self._blocks = iter(blocks)
+        self._buffer = ""
+        self._pos = 0
+        self._max_string_chars = max_string_chars
+    
+    def _fill(self) -> bool:
+        """Append the next block to the unread part of the buffer; False at end of input."""
+        for block in self._blocks:
+            if block:
+                self._buffer = self._buffer[self._pos:] + block
+                self._pos = 0
+                return True
+        return False
+    
+    def peek(self) -> str:
+        """Skip whitespace and return the next character without consuming it ("" at end of input)."""
+        while True:
+            self._pos = self._WHITESPACE_RE.match(self._buffer, self._pos).end()
+            if self._pos < len(self._buffer):
+                return self._buffer[self._pos]
+            if not self._fill():
+                return ""
+    
+    def next(self) -> tuple:
+        """
+        Return the next token as ``(kind, value)``.
+        
+        ``kind`` is one of ``{ } [ ] : ,``, ``"str"`` or ``"scalar"`` (with the
+        decoded ``value``), or ``""`` at the end of the input.
+        """
+        char = self.peek()
+        if not char:
+            return "", None
+        if char in '{}[]:,':
+            self._pos += 1
+            return char, None
+        if char == '"':
+            return "str", self._read_string()
+        # Numbers and literals may be cut by the block boundary, so only accept
+        # one that is followed by a delimiter (or ends the input)
+        while True:
+            match = self._SCALAR_RE.match(self._buffer, self._pos)
+            if (match and self._DELIMITER_RE.match(self._buffer, match.end())) or not self._fill():
+                break
+        if not match:
+            raise ValueError(f"Invalid JSON near {self._buffer[self._pos:self._pos + 20]!r}")
+        self._pos = match.end()
+        return "scalar", json.loads(match.group())
+    
+    def read_compact(self, max_chars: int) -> tuple:
+        """
+        Decode the next object or array in one step if its text is at most
+        ``max_chars`` characters long.
+        
+        Most values in large documents are small, and decoding them with the
+        C JSON decoder instead of token by token is what makes streaming fast.
+        
+        Returns:
+            ``(True, value)``, or ``(False, None)`` with nothing consumed
+        """
+        if self.peek() not in ('{', '['):
+            return False, None
+        while len(self._buffer) - self._pos < max_chars and self._fill():
+            pass
+        try:
+            value, end = self._decoder.raw_decode(self._buffer[self._pos:self._pos + max_chars])
+        except ValueError:
+            return False, None
+        self._pos += end
+        return True, value
+    
+    def _read_string(self) -> str:
+        self._pos += 1
+        parts: List[str] = []
+        kept = 0
+        dropped = 0
+        while True:
+            end = self._STRING_BODY_RE.match(self._buffer, self._pos).end()
+            piece = self._buffer[self._pos:end]
+            if kept < self._max_string_chars:
+                piece, rest = piece[:self._max_string_chars - kept], piece[self._max_string_chars - kept:]
+                parts.append(piece)
+                kept += len(piece)
+                dropped += len(rest)
+            else:
+                dropped += len(piece)
+            self._pos = end
+            if end < len(self._buffer) and self._buffer[end] == '"':
+                self._pos += 1
+                break
+            if not self._fill():
+                raise ValueError("Unterminated JSON string")
+        raw = "".join(parts)
+        # A truncated string may end inside an escape sequence; drop it
+        for cut in range(7):
+            try:
+                text = json.loads(f'"{raw[:len(raw) - cut]}"')
+                break
+            except ValueError:
+                continue
+        else:
+            text = raw
+        return f"{text}... [{dropped} more characters]" if dropped else text
+    
+    def skip_value(self, kind: str) -> None:
+        """Consume the rest of a value whose first token was ``kind`` without building it."""
+        depth = 1 if kind in '{[' else 0
+        while depth:
+            kind, _ = self.next()
+            if not kind:
+                raise ValueError("Unexpected end of JSON input")
+            if kind in '{[':
+                depth += 1
+            elif kind in '}]':
+                depth -= 1
+
+
+def _iter_text_blocks(document: SupportDocument, block_size: int = 1024 * 1024) -> Iterator[str]:
+    """Decode a document as UTF-8 text in blocks, from disk or straight from memory."""
+    if isinstance(document, DocumentSource):
+        import codecs
+        decoder = codecs.getincrementaldecoder('utf-8-sig')()
+        for start in range(0, document.size, block_size):
+            yield decoder.decode(document.data[start:start + block_size])
+        yield decoder.decode(b"", final=True)
+    else:
+        with open(document, 'r', encoding='utf-8-sig') as f:
+            for block in iter(lambda: f.read(block_size), ''):
+                yield block
+
+
+def _json_skip_matcher(patterns: Iterable[str]) -> Optional[Callable[[str], bool]]:
+    """
+    Build a predicate for JSON paths matching any of ``patterns``, where
+    ``*`` matches any run of characters, e.g. ``$.paths.*.examples``.
+    
+    Quoted keys are matched in dotted form, so ``$.paths["/users"].get``
+    matches ``$.paths./users.get``.
+    
+    Returns:
+        The predicate, or None if there are no patterns
+    """
+    regexes = [".*".join(re.escape(part) for part in pattern.split("*")) for pattern in patterns]
+    if not regexes:
+        return None
+    compiled = re.compile("|".join(f"(?:{regex})" for regex in regexes))
+    quoted_key = re.compile(r'\["((?:[^"\\]|\\.)*)"\]')
+    return lambda path: compiled.fullmatch(quoted_key.sub(r'.\1', path)) is not None
+
+
+def _prune_json_paths(value: Any, path: str, skipped: Callable[[str], bool]) -> Any:
+    """Drop the children of an in-memory JSON value whose paths match ``skipped``."""
+    if isinstance(value, dict):
+        return {
+            key: _prune_json_paths(child, _json_child_path(path, key), skipped)
+            for key, child in value.items() if not skipped(_json_child_path(path, key))
+        }
+    if isinstance(value, list):
+        return [
+            _prune_json_paths(child, _json_child_path(path, index), skipped)
+            for index, child in enumerate(value) if not skipped(_json_child_path(path, index))
+        ]
+    return value
+
+
+def _iter_json_segments(blocks: Iterable[str], max_chars: int,
+                        skip_paths: Iterable[str] = ()) -> Iterator[Dict[str, Any]]:
+    """
+    Stream a JSON document as segments of about ``max_chars`` characters.
+    
+    The document is tokenized incrementally. A subtree that fits is emitted
+    whole; larger objects and arrays are descended into, and consecutive small
+    children are packed together under their parent's path, so each segment
+    is a self-contained piece of JSON labelled with where it lives in the
+    document. At most one segment's worth of values is held per nesting
+    level. Subtrees whose path matches ``skip_paths`` are skipped unparsed.
+    """
+    tokens = _JsonTokenizer(blocks)
+    kind, value = tokens.next()
+    if not kind:
+        return
+    fits, value = yield from _walk_json_value(tokens, kind, value, "$", max_chars, _json_skip_matcher(skip_paths))
+    if fits:
+        yield {"text": f"$: {json.dumps(value, ensure_ascii=False)}", "json_path": "$"}
+    if tokens.next()[0]:
+        raise ValueError("Unexpected data after the JSON document")
+
+
+def _walk_json_value(tokens: _JsonTokenizer, kind: str, value: Any, path: str, max_chars: int,
+                     skipped: Optional[Callable[[str], bool]]):
+    """
+    Read the value starting with token ``kind`` at ``path``.
+    
+    Generator: yields the segments of values too large to return, and
+    returns ``(True, value)`` when the value fits in a segment (the caller
+    packs it) or ``(False, None)`` when it has been emitted as segments.
+    """
+    budget = max_chars - min(len(path) + 16, max_chars // 2)
+    if kind not in '{[':
+        if kind not in ("str", "scalar"):
+            raise ValueError(f"Unexpected {kind!r} in JSON at {path}")
+        serialized = json.dumps(value, ensure_ascii=False)
+        if len(serialized) <= budget:
+            return True, value
+        yield {"text": f"{path}: {serialized}", "json_path": path}
+        return False, None
+    
+    is_object = kind == '{'
+    close = '}' if is_object else ']'
+    group: List[tuple] = []
+    group_chars = 2
+    overflowed = False
+    
+    def flush():
+        if is_object:
+            packed = json.dumps(dict(group), ensure_ascii=False)
+            group_path = path
+        else:
+            packed = json.dumps([child for _, child in group], ensure_ascii=False)
+            group_path = f"{path}[{group[0][0]}:{group[-1][0] + 1}]"
+        return {"text": f"{group_path}: {packed}", "json_path": group_path}
+    
+    index = 0
+    kind = tokens.next()[0] if tokens.peek() == close else None
+    while kind != close:
+        if is_object:
+            kind, key = tokens.next()
+            if kind != "str" or tokens.next()[0] != ':':
+                raise ValueError(f"Malformed JSON object at {path}")
+        else:
+            key = index
+            index += 1
+        child_path = _json_child_path(path, key)
+        if skipped and skipped(child_path):
+            tokens.skip_value(tokens.next()[0])
+        else:
+            fits, child = tokens.read_compact(budget)
+            if fits and skipped:
+                child = _prune_json_paths(child, child_path, skipped)
+            if fits and len(json.dumps(child, ensure_ascii=False)) > budget:
+                # Compact source text can serialize longer than it was read; walk the serialized form instead
+                fits, source = False, _JsonTokenizer([json.dumps(child, ensure_ascii=False)])
+            else:
+                source = tokens
+            if not fits:
+                fits, child = yield from _walk_json_value(source, *source.next(), child_path, max_chars, skipped)
+            if not fits:
+                # The child was emitted on its own, so this value no longer fits either
+                overflowed = True
+                if group:
+                    yield flush()
+                    group, group_chars = [], 2
+            else:
+                child_chars = len(json.dumps(child, ensure_ascii=False)) + len(str(key)) + 4
+                if group_chars + child_chars > budget:
+                    overflowed = True
+                    if group:
+                        yield flush()
+                        group, group_chars = [], 2
+                group.append((key, child))
+                group_chars += child_chars
+        kind = tokens.next()[0]
+        if kind not in (',', close):
+            raise ValueError(f"Malformed JSON at {path}")
+    
+    if not overflowed:
+        return True, dict(group) if is_object else [child for _, child in group]
+    if group:
+        yield flush()
+    return False, None
+
+
+def _make_segment(text: str, page: Optional[int], heading: Optional[str] = None) -> Dict[str, Any]:
+    segment: Dict[str, Any] = {"text": text}
+    if page is not None:
+        segment["page"] = page
+    if heading:
+        segment["heading"] = heading
+    return segment
+
+
+def _format_source(metadata: Dict[str, Any]) -> str:
+    """Describe where a chunk came from, e.g. "specs.pdf (page 3, section: Shipping)"."""
+    details = []
+    if metadata.get("page") is not None:
+        details.append(f"page {metadata['page']}")
+    if metadata.get("heading"):
+        details.append(f"section: {metadata['heading']}")
+    if metadata.get("json_path"):
+        details.append(f"path: {metadata['json_path']}")
+    if metadata.get("element"):
+        details.append(f"element: {metadata['element']}")
+    source = metadata.get("source", "unknown")
+    return f"{source} ({', '.join(details)})" if details else source
+
+
+def _source_filter(sources: Optional[List[str]]) -> Dict[str, Any]:
+    """
+    Build a vector store metadata filter restricting results to the support
+    documents in ``sources`` (default: all). The page HTML is retrieved separately.
+    """
+    sources = [source for source in sources or [] if source != HTML_SOURCE]
+    if not sources:
+        return {"source": {"$ne": HTML_SOURCE}}
+    if len(sources) == 1:
+        return {"source": sources[0]}
+    return {"source": {"$in": list(sources)}}
+
+
+def _remove_orphaned_chroma_segments(persist_directory: str) -> None:
+    """
+    Delete the vector index directories of dropped Chroma collections.
+    
+    Chroma keeps a directory named after each segment ID and leaves it behind
+    when the collection is deleted, so every full rebuild would leak one.
+    """
+    try:
+        with sqlite3.connect(os.path.join(persist_directory, "chroma.sqlite3"), timeout=30) as connection:
+            live = {row[0] for row in connection.execute("SELECT id FROM segments")}
+    except sqlite3.Error:
+        return
+    for entry in os.scandir(persist_directory):
+        if entry.is_dir() and CHROMA_SEGMENT_DIR_RE.fullmatch(entry.name) and entry.name not in live:
+            shutil.rmtree(entry.path, ignore_errors=True)
+
+
+def _read_manifest(path: str) -> Optional[Dict[str, Any]]:
+    """Read an ingestion manifest; None if it is missing, unreadable or of an older layout."""
+    try:
+        with open(path, 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+class TokenCounter:
+    """
+    Counts and truncates text in the tokens of an OpenAI model.
+    
+    Uses the model's tiktoken encoding; if tiktoken or its encoding files are
+    unavailable, estimates four characters per token.
+    """
+    
+    def __init__(self, model: str, fallback_encoding: str = "cl100k_base"):
+        self.model = model
+        self.encoding = None
+        try:
+            import tiktoken
+            try:
+                self.encoding = tiktoken.encoding_for_model(model)
+            except KeyError:
+                self.encoding = tiktoken.get_encoding(fallback_encoding)
+        except Exception as e:
+            print(f"Warning: tiktoken unavailable, estimating tokens for {model}: {str(e)}")
+    
+    def count(self, text: str) -> int:
+        if self.encoding is None:
+            return len(text) // 4 + 1
+        return len(self.encoding.encode(text, disallowed_special=()))
+    
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Cut ``text`` down to its first ``max_tokens`` tokens."""
+        if self.encoding is None:
+            return text[:max(max_tokens - 1, 0) * 4]
+        tokens = self.encoding.encode(text, disallowed_special=())
+        return text if len(tokens) <= max_tokens else self.encoding.decode(tokens[:max_tokens])
+
+
+_token_counters: Dict[tuple, TokenCounter] = {}
+_token_counters_lock = threading.Lock()
+
+
+def _token_counter(model: str, fallback_encoding: str = "cl100k_base") -> TokenCounter:
+    """Return the process-wide token counter of a model; loading an encoding can take seconds."""
+    with _token_counters_lock:
+        counter = _token_counters.get((model, fallback_encoding))
+        if counter is None:
+            counter = _token_counters[(model, fallback_encoding)] = TokenCounter(model, fallback_encoding)
+        return counter
+
+
+def _pack_context(sections: List[List["Document"]], budget: int,
+                  counter: TokenCounter) -> List[List["Document"]]:
+    """
+    Choose the passages of each prompt section that fit a token budget.
+    
+    Candidates are taken by rank, interleaving the sections (the first
+    section wins ties), as long as they fit; a passage that does not fit is
+    skipped so shorter, lower ranked ones can use the rest of the budget. A
+    section whose best passage does not fit while nothing of it has been
+    taken gets that passage truncated to its share of the remaining budget,
+    so a large page whose HTML could not be split still reaches the prompt.
+    
+    Args:
+        sections: Candidate passages of each section, best first
+        budget: Tokens available to all sections together
+        counter: Token counter of the model the prompt is sent to
+        
+    Returns:
+        The packed passages of each section, best first; truncated ones are
+        copies with ``truncated`` set in their metadata
+    """
+    from langchain_core.documents import Document
+    
+    packed: List[List["Document"]] = [[] for _ in sections]
+    truncated: Dict[int, tuple] = {}
+    remaining = budget
+    for rank in range(max((len(section) for section in sections), default=0)):
+        for index, section in enumerate(sections):
+            if rank >= len(section):
+                continue
+            doc = section[rank]
+            overhead = PASSAGE_OVERHEAD_TOKENS + counter.count(_format_source(doc.metadata))
+            tokens = overhead + counter.count(doc.page_content)
+            if tokens <= remaining:
+                packed[index].append(doc)
+                remaining -= tokens
+            elif not packed[index]:
+                competing = sum(1 for other in sections if len(other) > rank)
+                share = remaining // competing - overhead
+                if share >= MIN_TRUNCATED_PASSAGE_TOKENS:
+                    text = counter.truncate(doc.page_content, share)
+                    packed[index].append(Document(page_content=text, metadata={**doc.metadata, "truncated": True}))
+                    truncated[index] = (doc, share)
+                    remaining -= overhead + counter.count(text)
+    # Budget that no other candidate could use goes to the truncated passages
+    for index, (doc, share) in truncated.items():
+        if remaining <= 0:
+            break
+        tokens = counter.count(packed[index][0].page_content)
+        text = counter.truncate(doc.page_content, share + remaining)
+        packed[index][0] = Document(page_content=text, metadata={**doc.metadata, "truncated": True})
+        remaining -= counter.count(text) - tokens
+    return packed
+
+
+def _format_html_fragments(fragments: List["Document"]) -> str:
+    """Format HTML fragments for a prompt, in page order."""
+    fragments = sorted(fragments, key=lambda doc: doc.metadata.get("chunk_index", 0))
+    return "\n\n".join(
+        f"Fragment {i+1} ({_format_source(doc.metadata)}):\n{doc.page_content}"
+        for i, doc in enumerate(fragments)
+    )
+
+
+def _close_vector_store(vector_store) -> None:
+    """
+    Close a vector store handle that is no longer used.
+    
+    Chroma keeps one system per persist directory for as long as any client
+    on it is open; closing every handle lets a deleted knowledge base that is
+    created again under the same name start from its new files. NumPy stores
+    release their memory-mapped vectors.
+    """
+    if vector_store is None:
+        return
+    try:
+        vector_store.close()
+    except Exception as e:
+        print(f"Warning: Could not close vector store: {str(e)}")
+
+
+def _similarity_search_many(vector_store, vectors: List[List[float]], k: int,
+                            search_filter: Optional[Dict[str, Any]] = None) -> List[List["Document"]]:
+    """Find the ``k`` chunks most similar to each vector, in one batched query where the store supports it."""
+    if not vectors:
+        return []
+    if hasattr(vector_store, "similarity_search_by_vectors"):
+        return vector_store.similarity_search_by_vectors(vectors, k=k, filter=search_filter)
+    return [vector_store.similarity_search_by_vector(vector, k=k, filter=search_filter) for vector in vectors]
+
+
+def _iter_document_segments(file_path: SupportDocument) -> Iterator[Dict[str, Any]]:
+    """
+    Stream the text of a document as segments.
+    
+    Each segment is a dictionary with the segment ``text`` and, for paged
+    formats, the 1-based ``page`` it came from.
+    
+    Args:
+        file_path: Path to the document file, or an in-memory DocumentSource
+        
+    Yields:
+        Text segments in document order
+    """
+    yielded = False
+    try:
+        for segment in _iter_segments_by_type(file_path):
+            yielded = True
+            yield segment
+    except Exception as e:
+        print(f"Error parsing {file_path}: {str(e)}")
+        if yielded:
+            return
+        # Fallback: try reading as text
+        try:
+            text_content = _read_document_text(file_path, errors='ignore')
+        except Exception:
+            text_content = ""
+        if text_content:
+            yield {"text": text_content}
+
+
+def _parse_document_file(file_path: SupportDocument) -> str:
+    """
+    Parse a document based on its file extension.
+    
+    Args:
+        file_path: Path to the document file, or an in-memory DocumentSource
+        
+    Returns:
+        Extracted text content from the document
+    """
+    return "".join(segment["text"] for segment in _iter_document_segments(file_path))
+
+
+def _report_worker_pid(worker_pids) -> None:
+    """Process pool initializer: send the worker's PID to the parent, which kills workers that hang."""
+    worker_pids.put(os.getpid())
+
+
+def _parse_document_worker(file_path: SupportDocument, timeout: float, spool_path: str) -> int:
+    """
+    Process pool entry point: parse one document, on disk or sent as bytes, under a time budget.
+    
+    Segments are streamed to ``spool_path`` as JSON lines instead of being
+    returned, so neither the worker nor the parent holds the whole document.
+    The budget is enforced with SIGALRM where available; the parent process
+    keeps an overall deadline as a backstop.
+    
+    Returns:
+        Number of segments written
+    """
+    use_alarm = (
+        timeout > 0
+        and hasattr(signal, "SIGALRM")
+        and threading.current_thread() is threading.main_thread()
+    )
+    if use_alarm:
+        def _on_alarm(signum, frame):
+            raise ParseTimeoutError(f"timed out after {timeout:g}s")
+        previous_handler = signal.signal(signal.SIGALRM, _on_alarm)
+        signal.setitimer(signal.ITIMER_REAL, timeout)
+    try:
+        count = 0
+        with open(spool_path, 'w', encoding='utf-8') as spool:
+            for segment in _iter_document_segments(file_path):
+                spool.write(json.dumps(segment) + "\n")
+                count += 1
+        return count
+    finally:
+        if use_alarm:
+            signal.setitimer(signal.ITIMER_REAL, 0)
+            signal.signal(signal.SIGALRM, previous_handler)
+
+
+def _iter_spooled_segments(spool: io.TextIOBase) -> Iterator[Dict[str, Any]]:
+    """Read back the segments written by ``_parse_document_worker`` and close the spool."""
+    with spool:
+        for line in spool:
+            yield json.loads(line)
+
+
+def _lock_file(lock_file: BinaryIO, shared: bool, blocking: bool = True) -> bool:
+    """
+    Take an advisory lock on an open file; it is released when the file is closed.
+    
+    Returns:
+        False if ``blocking`` is off and the lock is held elsewhere; True
+        otherwise, including where file locks are unavailable (Windows)
+    """
+    try:
+        import fcntl
+    except ImportError:
+        return True
+    operation = fcntl.LOCK_SH if shared else fcntl.LOCK_EX
+    if not blocking:
+        operation |= fcntl.LOCK_NB
+    try:
+        fcntl.flock(lock_file.fileno(), operation)
+    except BlockingIOError:
+        return False
+    return True
+
+
+class ParsedDocumentCache:
+    """
+    On-disk cache of parser output keyed by file content hash and parser version.
+    
+    Entries are the JSON-lines segment spools written by the parsers, so a
+    cache hit can be streamed straight into chunking. Recency is tracked with
+    file modification times and the least recently used entries are evicted
+    once the cache grows beyond ``max_bytes``. Builds read entries under
+    ``reading()``, and eviction waits until no build, in this or another
+    process, is reading.
+    """
+    
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+    
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+    
+    def _entry_path(self, file_hash: str) -> str:
+        return os.path.join(self.directory, f"{file_hash}-{_parser_signature()}.jsonl")
+    
+    def get(self, file_hash: str) -> Optional[str]:
+        """Return the cached spool for ``file_hash`` and mark it as recently used."""
+        if not self.enabled:
+            return None
+        path = self._entry_path(file_hash)
+        try:
+            os.utime(path)
+        except OSError:
+            return None
+        return path
+    
+    def put(self, file_hash: str, spool_path: str) -> str:
+        """
+        Move a completed spool into the cache.
+        
+        Returns:
+            Path of the cached entry (``spool_path`` unchanged if caching is disabled)
+        """
+        if not self.enabled:
+            return spool_path
+        path = self._entry_path(file_hash)
+        try:
+            os.replace(spool_path, path)
+        except OSError as e:
+            print(f"Warning: Could not cache parsed document: {str(e)}")
+            return spool_path
+        return path
+    
+    @contextmanager
+    def reading(self):
+        """Keep the entries handed out by ``get`` on disk until the block exits."""
+        if not self.enabled:
+            yield
+            return
+        os.makedirs(self.directory, exist_ok=True)
+        with open(os.path.join(self.directory, ".lock"), "ab") as lock_file:
+            _lock_file(lock_file, shared=True)
+            yield
+    
+    def make_spool_dir(self) -> str:
+        """Create a private directory for in-progress spools, on the cache filesystem if possible."""
+        if self.enabled:
+            os.makedirs(self.directory, exist_ok=True)
+            return tempfile.mkdtemp(prefix=".spool-", dir=self.directory)
+        return tempfile.mkdtemp(prefix="qa_parse_")
+    
+    def evict(self) -> int:
+        """
+        Delete least recently used entries until the cache fits in ``max_bytes``.
+        
+        Returns:
+            Number of entries removed
+        """
+        if not self.enabled or not os.path.isdir(self.directory):
+            return 0
+        with open(os.path.join(self.directory, ".lock"), "ab") as lock_file:
+            # A build still reading cache hits holds the shared lock; the last
+            # build to finish evicts instead
+            if not _lock_file(lock_file, shared=False, blocking=False):
+                return 0
+            entries = []
+            for entry in os.scandir(self.directory):
+                if entry.is_file() and entry.name.endswith(".jsonl"):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for _, size, path in sorted(entries):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                total -= size
+                removed += 1
+            return removed
+
+
+class EmbeddingCache:
+    """
+    SQLite cache of embedding vectors keyed by embedding model and text hash.
+    
+    Vectors are stored as float32 blobs. The cache lives outside the vector
+    store, so it survives rebuilds and re-embedding after a reset costs no
+    API calls. Rows carry a last-used timestamp and the least recently used
+    ones are evicted once the cache grows beyond ``max_bytes``.
+    """
+    
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.path = os.path.join(directory, "embeddings.sqlite3")
+        self._initialized = False
+    
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+    
+    def _connect(self) -> sqlite3.Connection:
+        # One short-lived connection per call keeps the cache safe to use from
+        # background ingestion jobs and Streamlit threads at the same time
+        if not self._initialized:
+            os.makedirs(self.directory, exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings ("
+                "model TEXT NOT NULL, text_hash TEXT NOT NULL, dims INTEGER NOT NULL, "
+                "vector BLOB NOT NULL, last_used REAL NOT NULL, PRIMARY KEY (model, text_hash))"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+            connection.commit()
+            self._initialized = True
+        return connection
+    
+    def get_many(self, model: str, text_hashes: List[str]) -> Dict[str, List[float]]:
+        """
+        Look up cached vectors and mark them as recently used.
+        
+        Returns:
+            Dictionary of text hash to vector for the hashes found
+        """
+        found: Dict[str, List[float]] = {}
+        if not self.enabled or not text_hashes:
+            return found
+        now = time.time()
+        with self._connect() as connection:
+            for start in range(0, len(text_hashes), EMBED_CACHE_BATCH_SIZE):
+                batch = text_hashes[start:start + EMBED_CACHE_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                rows = connection.execute(
+                    f"SELECT text_hash, vector FROM embeddings WHERE model = ? AND text_hash IN ({placeholders})",
+                    [model, *batch],
+                ).fetchall()
+                for text_hash, blob in rows:
+                    vector = array('f')
+                    vector.frombytes(blob)
+                    found[text_hash] = vector.tolist()
+                if rows:
+                    connection.execute(
+                        f"UPDATE embeddings SET last_used = ? WHERE model = ? AND text_hash IN ({placeholders})",
+                        [now, model, *batch],
+                    )
+        return found
+    
+    def put_many(self, model: str, vectors: Dict[str, List[float]]) -> None:
+        """Store vectors by text hash."""
+        if not self.enabled or not vectors:
+            return
+        now = time.time()
+        rows = [
+            (model, text_hash, len(vector), array('f', vector).tobytes(), now)
+            for text_hash, vector in vectors.items()
+        ]
+        with self._connect() as connection:
+            connection.executemany(
+                "INSERT OR REPLACE INTO embeddings (model, text_hash, dims, vector, last_used) VALUES (?, ?, ?, ?, ?)",
+                rows,
+            )
+    
+    def evict(self) -> int:
+        """
+        Delete least recently used vectors until the stored vectors fit in ``max_bytes``.
+        
+        Returns:
+            Number of vectors removed
+        """
+        if not self.enabled or not os.path.exists(self.path):
+            return 0
+        with self._connect() as connection:
+            count, total = connection.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+            ).fetchone()
+            if total <= self.max_bytes:
+                return 0
+            # Evict down to 90% so the next build does not immediately evict again
+            excess = total - int(self.max_bytes * 0.9)
+            remove = min(count, -(-excess * count // total))
+            connection.execute(
+                "DELETE FROM embeddings WHERE rowid IN "
+                "(SELECT rowid FROM embeddings ORDER BY last_used LIMIT ?)",
+                (remove,),
+            )
+        return remove
+
+
+def _is_rate_limit_error(exc: BaseException) -> bool:
+    return getattr(exc, "status_code", None) == 429 or type(exc).__name__ == "RateLimitError"
+
+
+def _is_retryable_embedding_error(exc: BaseException) -> bool:
+    """Rate limits, server errors and timeouts are retried; anything else is a real failure."""
+    status = getattr(exc, "status_code", None)
+    return (
+        _is_rate_limit_error(exc)
+        or (isinstance(status, int) and status >= 500)
+        or type(exc).__name__ in ("APIConnectionError", "APITimeoutError", "InternalServerError")
+    )
+
+
+def _retry_after_seconds(exc: BaseException) -> Optional[float]:
+    """The server's Retry-After hint of an API error, if any."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        return float(headers.get("retry-after"))
+    except (TypeError, ValueError):
+        return None
+
+
+class EmbeddingScheduler:
+    """
+    Embeddings wrapper that sends documents in token-sized batches, several at a time.
+    
+    Batches hold at most ``batch_tokens`` tokens. Up to ``max_concurrency``
+    batches are in flight, and the actual limit adapts AIMD-style: it grows
+    by one per round of successful requests and is halved when a request is
+    rate limited (429) or slower than ``target_latency``, so builds speed up
+    until they reach the organisation's rate limits and then back off
+    instead of hammering the API. Rate-limited and failed requests are
+    retried with backoff, honouring Retry-After.
+    
+    Token counts and time spent embedding are accumulated for throughput
+    reporting. Calls made under ``cancellable`` stop between requests and
+    during retry waits once their cancel event is set.
+    """
+    
+    def __init__(self, embeddings, count_tokens: Callable[[str], int], batch_tokens: int = EMBED_BATCH_TOKENS,
+                 max_concurrency: int = EMBED_MAX_CONCURRENCY, target_latency: float = EMBED_TARGET_LATENCY):
+        self.embeddings = embeddings
+        self.count_tokens = count_tokens
+        self.batch_tokens = batch_tokens
+        self.max_concurrency = max(1, max_concurrency)
+        self.target_latency = target_latency
+        self.limit = float(min(2, self.max_concurrency))
+        self.tokens = 0
+        self.seconds = 0.0
+        self.rate_limited = 0
+        self._in_flight = 0
+        self._decreased_at = 0.0
+        self._condition = threading.Condition()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # Cancel event of the build running on each thread
+        self._local = threading.local()
+    
+    def _make_batches(self, texts: List[str]) -> List[tuple]:
+        """Split texts into ``(start, texts, tokens)`` batches of at most ``batch_tokens`` tokens."""
+        batches = []
+        start, tokens = 0, 0
+        for index, text in enumerate(texts):
+            text_tokens = self.count_tokens(text)
+            if index > start and (tokens + text_tokens > self.batch_tokens or index - start >= EMBED_BATCH_MAX_TEXTS):
+                batches.append((start, texts[start:index], tokens))
+                start, tokens = index, 0
+            tokens += text_tokens
+        if start < len(texts):
+            batches.append((start, texts[start:], tokens))
+        return batches
+    
+    def _acquire(self) -> None:
+        with self._condition:
+            while self._in_flight >= int(self.limit):
+                self._condition.wait()
+            self._in_flight += 1
+    
+    def _release(self, started: float, congested: bool) -> None:
+        """Free a request slot and adapt the limit: additive increase, multiplicative decrease."""
+        with self._condition:
+            if congested:
+                # Requests sent before the last decrease report the same congestion; decrease once
+                if started >= self._decreased_at:
+                    self.limit = max(1.0, self.limit / 2)
+                    self._decreased_at = time.monotonic()
+            elif self._in_flight >= int(self.limit):
+                # Only grow while the current limit is actually used: +1 per round of requests
+                self.limit = min(float(self.max_concurrency), self.limit + 1.0 / self.limit)
+            self._in_flight -= 1
+            self._condition.notify_all()
+    
+    @contextmanager
+    def cancellable(self, cancel: Optional[threading.Event]):
+        """Make embedding calls from this thread raise ``IngestionCancelled`` once ``cancel`` is set."""
+        previous = getattr(self._local, "cancel", None)
+        self._local.cancel = cancel
+        try:
+            yield
+        finally:
+            self._local.cancel = previous
+    
+    def _embed_batch(self, texts: List[str], tokens: int, cancel: Optional[threading.Event] = None) -> List[List[float]]:
+        for attempt in range(EMBED_MAX_RETRIES + 1):
+            if cancel is not None and cancel.is_set():
+                raise IngestionCancelled("Knowledge base build was cancelled.")
+            self._acquire()
+            started = time.monotonic()
+            try:
+                vectors = self.embeddings.embed_documents(texts)
+            except Exception as exc:
+                self._release(started, congested=True)
+                if attempt == EMBED_MAX_RETRIES or not _is_retryable_embedding_error(exc):
+                    raise
+                if _is_rate_limit_error(exc):
+                    self.rate_limited += 1
+                delay = _retry_after_seconds(exc) or min(60.0, 2 ** attempt) * (0.5 + random.random() / 2)
+                print(f"Embedding request failed ({type(exc).__name__}), retrying in {delay:.1f}s "
+                      f"with concurrency {int(self.limit)}")
+                if cancel is not None:
+                    cancel.wait(delay)
+                else:
+                    time.sleep(delay)
+                continue
+            self._release(started, congested=time.monotonic() - started > self.target_latency)
+            with self._condition:
+                self.tokens += tokens
+            return vectors
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed documents in concurrent token-sized batches.
+        
+        Args:
+            texts: Texts to embed
+        
+        Returns:
+            One vector per text, in order
+        """
+        batches = self._make_batches(texts)
+        started = time.perf_counter()
+        vectors: List[List[float]] = [None] * len(texts)
+        # Worker threads do not see this thread's cancel event; pass it along
+        cancel = getattr(self._local, "cancel", None)
+        try:
+            if len(batches) <= 1 or self.max_concurrency == 1:
+                for start, batch, tokens in batches:
+                    vectors[start:start + len(batch)] = self._embed_batch(batch, tokens, cancel)
+            else:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(
+                        max_workers=self.max_concurrency, thread_name_prefix="qa-embed"
+                    )
+                futures = {
+                    self._executor.submit(self._embed_batch, batch, tokens, cancel): (start, len(batch))
+                    for start, batch, tokens in batches
+                }
+                try:
+                    for future in as_completed(futures):
+                        start, size = futures[future]
+                        vectors[start:start + size] = future.result()
+                finally:
+                    # After a failure or cancellation, batches not started yet are dropped
+                    for future in futures:
+                        future.cancel()
+        finally:
+            self.seconds += time.perf_counter() - started
+        return vectors
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a search query (a single request, sent directly)."""
+        return self.embeddings.embed_query(text)
+    
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed several search queries in batched requests.
+        
+        Both supported providers embed queries and documents identically, so
+        the queries go through ``embed_documents``.
+        """
+        return self.embed_documents(texts)
+    
+    @property
+    def tokens_per_second(self) -> float:
+        return self.tokens / self.seconds if self.seconds else 0.0
+
+
+class CachedEmbeddings:
+    """
+    Embeddings wrapper that serves repeated texts from an ``EmbeddingCache``.
+    
+    Only texts missing from the cache are sent to the wrapped embeddings, in
+    one call per batch. Query embeddings are cached separately from document
+    embeddings, since some models embed the two differently.
+    """
+    
+    def __init__(self, embeddings, cache: EmbeddingCache, model: str):
+        self.embeddings = embeddings
+        self.cache = cache
+        self.model = model
+        self.hits = 0
+        self.misses = 0
+    
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed documents, reusing cached vectors.
+        
+        Args:
+            texts: Texts to embed
+        
+        Returns:
+            One vector per text
+        """
+        text_hashes = [_sha256_text(text) for text in texts]
+        vectors = self.cache.get_many(self.model, sorted(set(text_hashes)))
+        missing: Dict[str, str] = {}
+        for text_hash, text in zip(text_hashes, texts):
+            if text_hash not in vectors:
+                missing.setdefault(text_hash, text)
+        if missing:
+            embedded = self.embeddings.embed_documents(list(missing.values()))
+            new_vectors = dict(zip(missing, embedded))
+            self.cache.put_many(self.model, new_vectors)
+            vectors.update(new_vectors)
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        return [vectors[text_hash] for text_hash in text_hashes]
+    
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a search query, reusing a cached vector."""
+        model = f"{self.model}#query"
+        text_hash = _sha256_text(text)
+        vector = self.cache.get_many(model, [text_hash]).get(text_hash)
+        if vector is None:
+            vector = self.embeddings.embed_query(text)
+            self.cache.put_many(model, {text_hash: vector})
+            self.misses += 1
+        else:
+            self.hits += 1
+        return vector
+    
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several search queries, reusing cached vectors and embedding the rest in one call."""
+        model = f"{self.model}#query"
+        text_hashes = [_sha256_text(text) for text in texts]
+        vectors = self.cache.get_many(model, sorted(set(text_hashes)))
+        missing: Dict[str, str] = {}
+        for text_hash, text in zip(text_hashes, texts):
+            if text_hash not in vectors:
+                missing.setdefault(text_hash, text)
+        if missing:
+            new_vectors = dict(zip(missing, self.embeddings.embed_queries(list(missing.values()))))
+            self.cache.put_many(model, new_vectors)
+            vectors.update(new_vectors)
+        self.misses += len(missing)
+        self.hits += len(texts) - len(missing)
+        return [vectors[text_hash] for text_hash in text_hashes]
+
+
+class LRUCache:
+    """
+    Thread-safe in-memory LRU cache.
+    
+    Shared by every QAAgentBackend in the process (Streamlit creates one per
+    session), so keys must identify everything the value depends on.
+    """
+    
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Any, Any]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+    
+    def get(self, key) -> Any:
+        """Return the cached value for ``key`` (marking it recently used), or None."""
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+    
+    def put(self, key, value) -> None:
+        """Cache a value, evicting the least recently used entries beyond ``max_entries``."""
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+
+
+# Query vectors keyed by (embedding signature, query), and retrieval results
+# keyed by (knowledge base directory and version, query, k, filter)
+QUERY_EMBEDDING_CACHE = LRUCache(RETRIEVAL_CACHE_SIZE)
+RETRIEVAL_CACHE = LRUCache(RETRIEVAL_CACHE_SIZE)
+
+
+class ReadWriteLock:
+    """
+    Lock held by any number of readers or by one writer.
+    
+    Writers are preferred: once a writer waits, new readers queue behind it,
+    so a steady stream of queries cannot starve a rebuild. Not reentrant.
+    """
+    
+    def __init__(self):
+        self._condition = threading.Condition()
+        self._readers = 0
+        self._writer = False
+        self._writers_waiting = 0
+    
+    @contextmanager
+    def read(self):
+        with self._condition:
+            while self._writer or self._writers_waiting:
+                self._condition.wait()
+            self._readers += 1
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+    
+    @contextmanager
+    def write(self):
+        with self._condition:
+            self._writers_waiting += 1
+            try:
+                while self._writer or self._readers:
+                    self._condition.wait()
+            finally:
+                self._writers_waiting -= 1
+            self._writer = True
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+
+
+class SharedKnowledgeBase:
+    """
+    Process-wide state of one persisted knowledge base.
+    
+    Every QAAgentBackend using the same directory (Streamlit creates one per
+    session) queries through the same long-lived vector store handle and
+    keyword index. Queries hold ``lock`` for reading; it is held for writing
+    while handles are opened or swapped and while collections are dropped,
+    so a query never runs against a deleted collection. ``build_lock``
+    serializes builds of the knowledge base within the process.
+    """
+    
+    def __init__(self, directory: str):
+        self.directory = directory
+        self.lock = ReadWriteLock()
+        self.build_lock = threading.Lock()
+        self.vector_store = None
+        self.keyword_index: Optional[KeywordIndex] = None
+        # Collection the handles point to (None is the default collection)
+        # and the manifest version they were opened for
+        self.collection: Optional[str] = None
+        self.version: Optional[tuple] = None
+
+
+_shared_knowledge_bases: Dict[str, SharedKnowledgeBase] = {}
+_shared_knowledge_bases_lock = threading.Lock()
+
+
+def _shared_knowledge_base(directory: str) -> SharedKnowledgeBase:
+    """Return the process-wide state of the knowledge base stored in ``directory``."""
+    directory = os.path.abspath(directory)
+    with _shared_knowledge_bases_lock:
+        shared = _shared_knowledge_bases.get(directory)
+        if shared is None:
+            shared = _shared_knowledge_bases[directory] = SharedKnowledgeBase(directory)
+        return shared
+
+
+def _keyword_terms(text: str) -> List[str]:
+    """Lowercased BM25 terms of a text: words, plus compound identifiers and their parts."""
+    terms: List[str] = []
+    for token in KEYWORD_TOKEN_RE.findall(text.lower()):
+        parts = re.split(r'[-.]', token)
+        if len(parts) > 1:
+            terms.append(token)
+        terms.extend(part for part in parts if part and part not in KEYWORD_STOPWORDS)
+    return terms
+
+
+class KeywordIndex:
+    """
+    BM25 inverted index of the indexed chunks, stored in SQLite.
+    
+    Postings (term, chunk, term frequency) are written at ingest time next to
+    the vector store, so a query only reads the postings of its own terms.
+    Chunk text is not duplicated: matches are returned as chunk IDs and the
+    documents are read from the vector store.
+    """
+    
+    def __init__(self, path: str):
+        self.path = path
+        self._initialized = False
+    
+    def _connect(self) -> sqlite3.Connection:
+        # One short-lived connection per call, like EmbeddingCache
+        if not self._initialized:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        connection = sqlite3.connect(self.path, timeout=30)
+        if not self._initialized:
+            connection.execute("PRAGMA journal_mode=WAL")
+            (version,) = connection.execute("PRAGMA user_version").fetchone()
+            if version != KEYWORD_INDEX_VERSION:
+                # An index of an older layout is rebuilt: the version is part
+                # of the chunking signature, so the next build re-adds every chunk
+                connection.executescript(
+                    "DROP TABLE IF EXISTS postings; DROP TABLE IF EXISTS terms; DROP TABLE IF EXISTS chunks;"
+                    f"PRAGMA user_version = {KEYWORD_INDEX_VERSION};"
+                )
+            connection.executescript(
+                "CREATE TABLE IF NOT EXISTS chunks ("
+                "id INTEGER PRIMARY KEY, chunk_id TEXT UNIQUE NOT NULL, source TEXT NOT NULL, "
+                "chunk_hash TEXT NOT NULL, length INTEGER NOT NULL);"
+                "CREATE INDEX IF NOT EXISTS chunks_source ON chunks (source);"
+                "CREATE INDEX IF NOT EXISTS chunks_hash ON chunks (chunk_hash);"
+                "CREATE TABLE IF NOT EXISTS terms (id INTEGER PRIMARY KEY, term TEXT UNIQUE NOT NULL);"
+                "CREATE TABLE IF NOT EXISTS postings ("
+                "term_id INTEGER NOT NULL, doc_id INTEGER NOT NULL, tf INTEGER NOT NULL, "
+                "PRIMARY KEY (term_id, doc_id)) WITHOUT ROWID;"
+                "CREATE INDEX IF NOT EXISTS postings_doc ON postings (doc_id);"
+            )
+            connection.commit()
+            self._initialized = True
+        return connection
+    
+    def add(self, source: str, chunks: Iterable["Document"]) -> int:
+        """
+        Index chunks of a source; chunks already in the index are skipped.
+        
+        Returns:
+            Number of chunks added
+        """
+        chunks = list(chunks)
+        if not chunks:
+            return 0
+        added = 0
+        with self._connect() as connection:
+            known = set()
+            ids = [doc.id for doc in chunks]
+            for start in range(0, len(ids), EMBED_CACHE_BATCH_SIZE):
+                batch = ids[start:start + EMBED_CACHE_BATCH_SIZE]
+                known.update(row[0] for row in connection.execute(
+                    f"SELECT chunk_id FROM chunks WHERE chunk_id IN ({','.join('?' * len(batch))})", batch
+                ))
+            for doc in chunks:
+                if doc.id in known:
+                    continue
+                known.add(doc.id)
+                terms = _keyword_terms(doc.page_content)
+                counts: Dict[str, int] = {}
+                for term in terms:
+                    counts[term] = counts.get(term, 0) + 1
+                doc_id = connection.execute(
+                    "INSERT INTO chunks (chunk_id, source, chunk_hash, length) VALUES (?, ?, ?, ?)",
+                    (doc.id, source, doc.metadata.get("chunk_hash", ""), len(terms)),
+                ).lastrowid
+                connection.executemany("INSERT OR IGNORE INTO terms (term) VALUES (?)", [(term,) for term in counts])
+                term_ids = self._term_ids(connection, list(counts))
+                connection.executemany(
+                    "INSERT INTO postings (term_id, doc_id, tf) VALUES (?, ?, ?)",
+                    [(term_ids[term], doc_id, count) for term, count in counts.items()],
+                )
+                added += 1
+        return added
+    
+    @staticmethod
+    def _term_ids(connection: sqlite3.Connection, terms: List[str]) -> Dict[str, int]:
+        term_ids: Dict[str, int] = {}
+        for start in range(0, len(terms), EMBED_CACHE_BATCH_SIZE):
+            batch = terms[start:start + EMBED_CACHE_BATCH_SIZE]
+            term_ids.update(connection.execute(
+                f"SELECT term, id FROM terms WHERE term IN ({','.join('?' * len(batch))})", batch
+            ).fetchall())
+        return term_ids
+    
+    def remove(self, chunk_ids: List[str]) -> None:
+        """Remove chunks from the index."""
+        if not chunk_ids or not os.path.exists(self.path):
+            return
+        with self._connect() as connection:
+            for start in range(0, len(chunk_ids), EMBED_CACHE_BATCH_SIZE):
+                batch = chunk_ids[start:start + EMBED_CACHE_BATCH_SIZE]
+                placeholders = ",".join("?" * len(batch))
+                connection.execute(
+                    f"DELETE FROM postings WHERE doc_id IN (SELECT id FROM chunks WHERE chunk_id IN ({placeholders}))",
+                    batch,
+                )
+                connection.execute(f"DELETE FROM chunks WHERE chunk_id IN ({placeholders})", batch)
+    
+    def clear(self) -> None:
+        """Delete the whole index."""
+        for suffix in ("", "-wal", "-shm"):
+            try:
+                os.remove(self.path + suffix)
+            except OSError:
+                pass
+        self._initialized = False
+    
+    @staticmethod
+    def _where_sql(where: Optional[Dict[str, Any]]) -> tuple:
+        """Translate a vector store filter on ``source`` and ``chunk_hash`` into SQL."""
+        if not where:
+            return "", []
+        condition, values = _metadata_filter_sql(where, {"source": "c.source", "chunk_hash": "c.chunk_hash"})
+        return f" AND {condition}", values
+    
+    def search(self, query: str, k: int, where: Optional[Dict[str, Any]] = None) -> List[tuple]:
+        """
+        Rank chunks against a query with BM25.
+        
+        Args:
+            query: Query text
+            k: Number of chunks to return
+            where: Optional ``source`` filter in vector store syntax (see ``_where_sql``)
+            
+        Returns:
+            ``(chunk_id, score)`` pairs, best first
+        """
+        terms = sorted(set(_keyword_terms(query)))
+        if not terms or not os.path.exists(self.path):
+            return []
+        where_sql, where_params = self._where_sql(where)
+        with self._connect() as connection:
+            total, average_length = connection.execute("SELECT COUNT(*), AVG(length) FROM chunks").fetchone()
+            if not total:
+                return []
+            term_ids = self._term_ids(connection, terms)
+            scores: Dict[str, float] = {}
+            for term_id in term_ids.values():
+                (frequency,) = connection.execute(
+                    "SELECT COUNT(*) FROM postings WHERE term_id = ?", (term_id,)
+                ).fetchone()
+                idf = math.log(1 + (total - frequency + 0.5) / (frequency + 0.5))
+                rows = connection.execute(
+                    "SELECT c.chunk_id, p.tf, c.length FROM postings p JOIN chunks c ON c.id = p.doc_id "
+                    f"WHERE p.term_id = ?{where_sql}",
+                    [term_id, *where_params],
+                )
+                for chunk_id, tf, length in rows:
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * length / (average_length or 1))
+                    scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+
+def _reciprocal_rank_fusion(rankings: List[List[str]]) -> List[tuple]:
+    """
+    Fuse rankings of chunk IDs: each ID scores ``sum(1 / (RRF_K + rank))`` over the rankings it appears in.
+    
+    Returns:
+        ``(chunk_id, score)`` pairs, best first
+    """
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (RRF_K + rank)
+    return sorted(scores.items(), key=lambda item: -item[1])
+
+
+def _join_overlapping(first: str, second: str, max_overlap: int) -> str:
+    """Concatenate neighbouring chunks, dropping the text the splitter repeated at the start of ``second``."""
+    for size in range(min(max_overlap, len(first), len(second)), 0, -1):
+        if first.endswith(second[:size]):
+            return first + second[size:]
+    return f"{first}\n{second}"
+
+
+def _merge_adjacent_chunks(docs: List["Document"], scores: List[float], max_overlap: int, max_chunks: int) -> tuple:
+    """
+    Merge retrieved chunks that are neighbours in the same section into passages.
+    
+    Chunks with consecutive ``chunk_index`` values and the same location
+    (see ``PASSAGE_LOCATION_KEYS``) are joined without their overlap, up
+    to ``max_chunks`` chunks per passage. A passage keeps the metadata of its first chunk, its best score, and the
+    number of chunks it holds as ``chunk_count``.
+    
+    Returns:
+        ``(passages, scores, members)``, where ``members[i]`` lists the
+        indexes in ``docs`` merged into passage ``i``
+    """
+    from langchain_core.documents import Document
+    
+    def location(doc):
+        return tuple(doc.metadata.get(key) for key in PASSAGE_LOCATION_KEYS)
+    
+    order = sorted(range(len(docs)), key=lambda i: (str(location(docs[i])), docs[i].metadata.get("chunk_index", 0)))
+    groups: List[List[int]] = []
+    for i in order:
+        previous = groups[-1][-1] if groups else None
+        if (previous is not None and len(groups[-1]) < max_chunks
+                and location(docs[previous]) == location(docs[i])
+                and docs[i].metadata.get("chunk_index") == docs[previous].metadata.get("chunk_index", -2) + 1):
+            groups[-1].append(i)
+        else:
+            groups.append([i])
+    # Keep the passages in retrieval order
+    groups.sort(key=lambda group: min(group))
+    
+    passages, passage_scores = [], []
+    for group in groups:
+        text = docs[group[0]].page_content
+        for i in group[1:]:
+            text = _join_overlapping(text, docs[i].page_content, max_overlap)
+        passages.append(Document(page_content=text, metadata={**docs[group[0]].metadata, "chunk_count": len(group)}))
+        passage_scores.append(max(scores[i] for i in group))
+    return passages, passage_scores, groups
+
+
+def _mmr_select(relevance: List[float], vectors, sizes: List[int], budget: int,
+                lambda_mult: float = MMR_LAMBDA) -> List[int]:
+    """
+    Select passages by maximal marginal relevance within a chunk budget.
+    
+    Each step picks the passage maximizing ``lambda * relevance - (1 - lambda)
+    * max cosine similarity to the passages already selected``; a passage
+    costs ``sizes[i]`` chunks of the budget.
+    
+    Args:
+        relevance: Relevance of each passage, higher is better
+        vectors: Unit-length embedding of each passage, one row per passage
+        sizes: Number of chunks in each passage
+        budget: Number of chunks to select
+        lambda_mult: Trade-off between relevance and diversity
+        
+    Returns:
+        Indexes of the selected passages, in selection order
+    """
+    import numpy as np
+    
+    relevance = np.asarray(relevance, dtype=np.float32)
+    if not len(relevance):
+        return []
+    relevance = relevance / (relevance.max() or 1.0)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    similarity = vectors @ vectors.T
+    sizes = np.asarray(sizes)
+    
+    selected: List[int] = []
+    redundancy = np.zeros(len(relevance), dtype=np.float32)
+    available = np.ones(len(relevance), dtype=bool)
+    remaining = budget
+    while remaining > 0:
+        candidates = available & (sizes <= remaining)
+        if not candidates.any():
+            break
+        scores = np.where(candidates, lambda_mult * relevance - (1 - lambda_mult) * redundancy, -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        remaining -= int(sizes[best])
+        redundancy = np.maximum(redundancy, similarity[best])
+    return selected
 
 
 class TestCase(BaseModel):
@@ -40,45 +2249,410 @@ class QAAgentBackend:
     
     def __init__(self):
         """Initialize the backend with vector store and embeddings."""
-        self.vector_store = None
         self.html_content = None
-        self.text_splitter = RecursiveCharacterTextSplitter(
-            chunk_size=1000,
-            chunk_overlap=200,
-            length_function=len,
-        )
+        self._text_splitters: Dict[str, Any] = {}
+        self._embeddings = None
+        self._embedding_scheduler: Optional[EmbeddingScheduler] = None
+        self._cached_embeddings = None
+        self._llm = None
+        
+        # Embedding provider: "openai" or "local" (CPU-only hashed n-gram vectors)
+        self.embeddings_provider = os.getenv("QA_EMBEDDINGS_PROVIDER", "openai").strip().lower()
+        if self.embeddings_provider not in EMBEDDINGS_PROVIDERS:
+            raise ValueError(
+                f"QA_EMBEDDINGS_PROVIDER must be one of {', '.join(EMBEDDINGS_PROVIDERS)}, "
+                f"got {self.embeddings_provider!r}."
+            )
+        self.local_embed_dim = int(os.getenv("QA_LOCAL_EMBED_DIM", str(LOCAL_EMBED_DIM)))
         
-        # Configure OpenAI API
+        # Embedding requests: tokens per batch, concurrent batches (local embeddings
+        # are CPU-bound, so they run one batch at a time) and target request latency
+        self.embed_batch_tokens = int(os.getenv("QA_EMBED_BATCH_TOKENS", str(EMBED_BATCH_TOKENS)))
+        self.embed_max_concurrency = int(os.getenv(
+            "QA_EMBED_MAX_CONCURRENCY", "1" if self.embeddings_provider == "local" else str(EMBED_MAX_CONCURRENCY)
+        ))
+        self.embed_target_latency = float(os.getenv("QA_EMBED_TARGET_LATENCY", str(EMBED_TARGET_LATENCY)))
+        
+        # Configure OpenAI API; builds with local embeddings do not need it
         openai_api_key = os.getenv("OPENAI_API_KEY")
-        if not openai_api_key:
+        if not openai_api_key and self.embeddings_provider == "openai":
             raise ValueError(
                 "OPENAI_API_KEY environment variable is required for OpenAI integration."
             )
+        self._openai_api_key = openai_api_key
 
-        embed_model = os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small")
-        llm_model = os.getenv("OPENAI_LLM_MODEL", "gpt-4o-mini")
-        self.persist_directory = "./chroma_db"
-
-        # Initialize OpenAI embeddings
-        try:
-            self.embeddings = OpenAIEmbeddings(
-                model=embed_model,
-                openai_api_key=openai_api_key,
+        self.embed_model = os.getenv("OPENAI_EMBED_MODEL", "text-embedding-3-small")
+        self.llm_model = os.getenv("OPENAI_LLM_MODEL", "gpt-4o-mini")
+        # Prompt tokens of each generation request, retrieved context included
+        self.context_token_budget = int(os.getenv("QA_CONTEXT_TOKENS", str(CONTEXT_TOKEN_BUDGET)))
+        
+        # Vector store: "chroma" or "numpy" (brute-force search over a memory-mapped matrix)
+        self.vector_store_kind = os.getenv("QA_VECTOR_STORE", "chroma").strip().lower()
+        if self.vector_store_kind not in VECTOR_STORE_DIRECTORIES:
+            raise ValueError(
+                f"QA_VECTOR_STORE must be one of {', '.join(VECTOR_STORE_DIRECTORIES)}, "
+                f"got {self.vector_store_kind!r}."
             )
-            print(f"Using OpenAI embeddings ({embed_model})")
-        except Exception as exc:
-            raise RuntimeError("Failed to initialize OpenAI embeddings.") from exc
         
-        # Initialize OpenAI LLM
+        # Knowledge bases: named ones are stored under QA_KNOWLEDGE_BASE_DIR;
+        # QA_KNOWLEDGE_BASE selects the one sessions start with
+        self.knowledge_base_root = os.getenv("QA_KNOWLEDGE_BASE_DIR", "./knowledge_bases")
+        self.knowledge_base = os.getenv("QA_KNOWLEDGE_BASE", DEFAULT_KNOWLEDGE_BASE).strip() or DEFAULT_KNOWLEDGE_BASE
+        if not KNOWLEDGE_BASE_NAME_RE.fullmatch(self.knowledge_base):
+            raise ValueError(
+                "QA_KNOWLEDGE_BASE must start with a letter or digit and contain only letters, "
+                f"digits, '-' and '_' (at most 64 characters), got {self.knowledge_base!r}."
+            )
+        self.persist_directory = self._knowledge_base_directory(self.knowledge_base)
+        
+        # Parallel parsing: number of worker processes (1 parses inline) and per-file timeout
+        self.parse_workers = int(os.getenv("QA_PARSE_WORKERS", "0")) or (os.cpu_count() or 1)
+        self.parse_timeout = float(os.getenv("QA_PARSE_TIMEOUT", "120"))
+        
+        # Parsed-document cache; QA_PARSE_CACHE_MB=0 disables it
+        self.parse_cache = ParsedDocumentCache(
+            os.getenv("QA_PARSE_CACHE_DIR", "./parse_cache"),
+            int(float(os.getenv("QA_PARSE_CACHE_MB", "512")) * 1024 * 1024),
+        )
+        
+        # Embedding cache shared by ingestion and queries; QA_EMBED_CACHE_MB=0 disables it
+        self.embedding_cache = EmbeddingCache(
+            os.getenv("QA_EMBED_CACHE_DIR", "./embedding_cache"),
+            int(float(os.getenv("QA_EMBED_CACHE_MB", "1024")) * 1024 * 1024),
+        )
+        
+        # In-memory uploads above this size reach the process pool through a temp file
+        self.upload_spool_threshold = int(
+            float(os.getenv("QA_UPLOAD_SPOOL_MB", str(UPLOAD_SPOOL_THRESHOLD_MB))) * 1024 * 1024
+        )
+    
+    @property
+    def text_splitter(self):
+        """Default text splitter, created on first use."""
+        return self._get_text_splitter("")
+    
+    def _get_text_splitter(self, file_ext: str):
+        """
+        Return the text splitter for a file type, created on first use.
+        
+        Markdown and HTML use language-aware separators (segments are already
+        heading sections and DOM segments); JSON, PDF and everything else use
+        the recursive character splitter with the overlap configured in
+        CHUNK_OVERLAP_BY_TYPE.
+        """
+        file_ext = file_ext if file_ext in CHUNK_OVERLAP_BY_TYPE else ""
+        splitter = self._text_splitters.get(file_ext)
+        if splitter is None:
+            from langchain_text_splitters import Language, RecursiveCharacterTextSplitter
+            overlap = CHUNK_OVERLAP_BY_TYPE.get(file_ext, CHUNK_OVERLAP)
+            if file_ext in ('.md', '.html', '.htm'):
+                splitter = RecursiveCharacterTextSplitter.from_language(
+                    Language.MARKDOWN if file_ext == '.md' else Language.HTML,
+                    chunk_size=CHUNK_SIZE,
+                    chunk_overlap=overlap,
+                )
+            else:
+                splitter = RecursiveCharacterTextSplitter(
+                    chunk_size=CHUNK_SIZE,
+                    chunk_overlap=overlap,
+                    length_function=len,
+                )
+            self._text_splitters[file_ext] = splitter
+        return splitter
+    
+    @property
+    def embeddings(self):
+        """Embeddings client of the configured provider, created on first use."""
+        if self._embeddings is None and self.embeddings_provider == "local":
+            from local_embeddings import HashedNgramEmbeddings
+            self._embeddings = HashedNgramEmbeddings(dimensions=self.local_embed_dim)
+            print(f"Using local embeddings ({self._embeddings.signature})")
+        if self._embeddings is None:
+            from langchain_openai import OpenAIEmbeddings
+            try:
+                # Rate limits are retried by the embedding scheduler, which needs to see them
+                self._embeddings = OpenAIEmbeddings(
+                    model=self.embed_model,
+                    openai_api_key=self._openai_api_key,
+                    max_retries=0,
+                )
+                print(f"Using OpenAI embeddings ({self.embed_model})")
+            except Exception as exc:
+                raise RuntimeError("Failed to initialize OpenAI embeddings.") from exc
+        return self._embeddings
+    
+    @embeddings.setter
+    def embeddings(self, value):
+        self._embeddings = value
+    
+    @property
+    def embedding_scheduler(self) -> EmbeddingScheduler:
+        """Adaptive batch scheduler around the embeddings client, created on first use."""
+        embeddings = self.embeddings
+        if self._embedding_scheduler is None or self._embedding_scheduler.embeddings is not embeddings:
+            self._embedding_scheduler = EmbeddingScheduler(
+                embeddings,
+                self._embedding_token_counter(),
+                batch_tokens=self.embed_batch_tokens,
+                max_concurrency=self.embed_max_concurrency,
+                target_latency=self.embed_target_latency,
+            )
+            self._cached_embeddings = None
+        return self._embedding_scheduler
+    
+    @property
+    def vector_store_embeddings(self):
+        """Embeddings as used by the vector store: the scheduler behind the embedding cache, if enabled."""
+        scheduler = self.embedding_scheduler
+        if not self.embedding_cache.enabled:
+            return scheduler
+        if self._cached_embeddings is None:
+            self._cached_embeddings = CachedEmbeddings(
+                scheduler, self.embedding_cache, self._embedding_signature()
+            )
+        return self._cached_embeddings
+    
+    def _embedding_token_counter(self) -> Callable[[str], int]:
+        """Token counter for batch sizing: tiktoken for OpenAI models, an estimate otherwise."""
+        if self.embeddings_provider == "openai":
+            return _token_counter(self.embed_model).count
+        return lambda text: len(text) // 4 + 1
+    
+    @property
+    def prompt_token_counter(self) -> TokenCounter:
+        """Token counter of the chat model, used to pack prompts into ``context_token_budget``."""
+        return _token_counter(self.llm_model, "o200k_base")
+    
+    @property
+    def llm(self):
+        """OpenAI chat model, created on first use."""
+        if self._llm is None:
+            if not self._openai_api_key:
+                raise RuntimeError(
+                    "OPENAI_API_KEY environment variable is required to generate test cases and scripts."
+                )
+            from langchain_openai import ChatOpenAI
+            try:
+                self._llm = ChatOpenAI(
+                    model=self.llm_model,
+                    temperature=0.1,
+                    openai_api_key=self._openai_api_key,
+                )
+                print(f"Using OpenAI LLM ({self.llm_model})")
+            except Exception as exc:
+                raise RuntimeError("Failed to initialize OpenAI LLM. Check your API key and model name.") from exc
+        return self._llm
+    
+    @llm.setter
+    def llm(self, value):
+        self._llm = value
+    
+    def _knowledge_base_directory(self, name: str) -> str:
+        """Directory the vector store of a knowledge base persists to."""
+        if name == DEFAULT_KNOWLEDGE_BASE:
+            return VECTOR_STORE_DIRECTORIES[self.vector_store_kind]
+        return os.path.join(
+            self.knowledge_base_root, name, os.path.basename(VECTOR_STORE_DIRECTORIES[self.vector_store_kind])
+        )
+    
+    def _knowledge_base_exists(self, name: str) -> bool:
+        return name == DEFAULT_KNOWLEDGE_BASE or os.path.isdir(os.path.join(self.knowledge_base_root, name))
+    
+    def list_knowledge_bases(self) -> List[Dict[str, Any]]:
+        """
+        List the knowledge bases that can be selected.
+        
+        Returns:
+            One dictionary per knowledge base, default first, with its ``name``,
+            the ``sources`` it indexes, whether it is ``built`` with the
+            configured embeddings and whether it is ``selected``
+        """
+        names = [DEFAULT_KNOWLEDGE_BASE]
+        if os.path.isdir(self.knowledge_base_root):
+            names.extend(sorted(
+                entry.name for entry in os.scandir(self.knowledge_base_root)
+                if entry.is_dir() and entry.name != DEFAULT_KNOWLEDGE_BASE
+                and KNOWLEDGE_BASE_NAME_RE.fullmatch(entry.name)
+            ))
+        knowledge_bases = []
+        for name in names:
+            manifest = _read_manifest(os.path.join(self._knowledge_base_directory(name), MANIFEST_FILENAME))
+            knowledge_bases.append({
+                "name": name,
+                "sources": sorted(
+                    source for source in manifest["sources"] if source != HTML_SOURCE
+                ) if manifest else [],
+                "built": bool(manifest) and manifest.get("embedding") == self._embedding_signature(),
+                "selected": name == self.knowledge_base,
+            })
+        return knowledge_bases
+    
+    def create_knowledge_base(self, name: str) -> Dict[str, Any]:
+        """
+        Create an empty named knowledge base; select it and build it to use it.
+        
+        Args:
+            name: Letters, digits, '-' and '_', starting with a letter or digit
+            
+        Returns:
+            Dictionary with status and message
+        """
+        name = (name or "").strip()
+        if not KNOWLEDGE_BASE_NAME_RE.fullmatch(name):
+            return {
+                "status": "error",
+                "message": "Knowledge base names must start with a letter or digit and contain only "
+                           "letters, digits, '-' and '_' (at most 64 characters).",
+            }
+        if self._knowledge_base_exists(name):
+            return {"status": "error", "message": f"Knowledge base '{name}' already exists."}
+        try:
+            os.makedirs(os.path.join(self.knowledge_base_root, name))
+        except OSError as e:
+            return {"status": "error", "message": f"Error creating knowledge base '{name}': {str(e)}"}
+        return {"status": "success", "message": f"Created knowledge base '{name}'."}
+    
+    def select_knowledge_base(self, name: str) -> Dict[str, Any]:
+        """
+        Switch this backend to another knowledge base.
+        
+        Knowledge bases stay open in the process once queried, so switching
+        back and forth does not reload or rebuild anything.
+        
+        Args:
+            name: Name of an existing knowledge base
+            
+        Returns:
+            Dictionary with status, message and whether the selected knowledge
+            base is ``built``
+        """
+        name = (name or "").strip()
+        if not KNOWLEDGE_BASE_NAME_RE.fullmatch(name) or not self._knowledge_base_exists(name):
+            return {"status": "error", "message": f"Knowledge base '{name}' does not exist.", "built": False}
+        if name != self.knowledge_base:
+            self.knowledge_base = name
+            self.persist_directory = self._knowledge_base_directory(name)
+            # The page HTML belongs to the build of the previous knowledge base
+            self.html_content = None
+        manifest = self._load_manifest()
+        return {
+            "status": "success",
+            "message": f"Selected knowledge base '{name}'.",
+            "built": bool(manifest) and manifest.get("embedding") == self._embedding_signature(),
+        }
+    
+    def delete_knowledge_base(self, name: str) -> Dict[str, Any]:
+        """
+        Delete a named knowledge base and everything indexed in it.
+        
+        Sessions that have it selected get a "not found" error on their next
+        query. If this backend has it selected, it switches to the default
+        knowledge base.
+        
+        Args:
+            name: Name of the knowledge base; the default one cannot be deleted
+            
+        Returns:
+            Dictionary with status and message
+        """
+        name = (name or "").strip()
+        if name == DEFAULT_KNOWLEDGE_BASE:
+            return {"status": "error", "message": "The default knowledge base cannot be deleted."}
+        if not KNOWLEDGE_BASE_NAME_RE.fullmatch(name) or not self._knowledge_base_exists(name):
+            return {"status": "error", "message": f"Knowledge base '{name}' does not exist."}
+        directory = self._knowledge_base_directory(name)
+        shared = _shared_knowledge_base(directory)
+        if not shared.build_lock.acquire(blocking=False):
+            return {"status": "error", "message": f"Knowledge base '{name}' is being built; try again when the build is done."}
         try:
-            self.llm = ChatOpenAI(
-                model=llm_model,
-                temperature=0.1,
-                openai_api_key=openai_api_key,
+            with shared.lock.write():
+                _close_vector_store(shared.vector_store)
+                shared.vector_store = None
+                shared.keyword_index = None
+                shared.collection = None
+                shared.version = None
+                # Only this store kind's index; the other kind may live next to it
+                if os.path.exists(directory):
+                    shutil.rmtree(directory)
+                try:
+                    os.rmdir(os.path.join(self.knowledge_base_root, name))
+                except OSError:
+                    pass
+        except OSError as e:
+            return {"status": "error", "message": f"Error deleting knowledge base '{name}': {str(e)}"}
+        finally:
+            shared.build_lock.release()
+        if name == self.knowledge_base:
+            self.select_knowledge_base(DEFAULT_KNOWLEDGE_BASE)
+        return {"status": "success", "message": f"Deleted knowledge base '{name}'."}
+    
+    @property
+    def shared_knowledge_base(self) -> SharedKnowledgeBase:
+        """Process-wide state of this backend's knowledge base."""
+        return _shared_knowledge_base(self.persist_directory)
+    
+    @property
+    def vector_store(self):
+        """The process-wide vector store handle of the knowledge base, or None if it is not open yet."""
+        return self.shared_knowledge_base.vector_store
+    
+    def _open_vector_store(self, collection: Optional[str] = None):
+        """
+        Open a collection of the persistent vector store (Chroma or NumPy).
+        
+        Args:
+            collection: Collection name, as recorded in the manifest; None
+                opens the default collection
+        """
+        if self.vector_store_kind == "numpy":
+            from numpy_store import NumpyVectorStore
+            return NumpyVectorStore(
+                persist_directory=(
+                    os.path.join(self.persist_directory, collection) if collection else self.persist_directory
+                ),
+                embedding_function=self.vector_store_embeddings,
             )
-            print(f"Using OpenAI LLM ({llm_model})")
-        except Exception as exc:
-            raise RuntimeError("Failed to initialize OpenAI LLM. Check your API key and model name.") from exc
+        from chroma_store import ChromaVectorStore
+        kwargs = {"collection_name": collection} if collection else {}
+        return ChromaVectorStore(
+            persist_directory=self.persist_directory,
+            embedding_function=self.vector_store_embeddings,
+            **kwargs,
+        )
+    
+    def _keyword_index_path(self, collection: Optional[str] = None) -> str:
+        """Path of the BM25 keyword index of a collection."""
+        if not collection:
+            return os.path.join(self.persist_directory, KEYWORD_INDEX_FILENAME)
+        return os.path.join(self.persist_directory, f"keyword_index-{collection}.sqlite3")
+    
+    def _dedup_index_path(self, collection: Optional[str] = None) -> str:
+        """Path of the near-duplicate index of a collection."""
+        if not collection:
+            return os.path.join(self.persist_directory, DEDUP_INDEX_FILENAME)
+        return os.path.join(self.persist_directory, f"dedup_index-{collection}.sqlite3")
+    
+    def _drop_collection(self, collection: Optional[str]) -> None:
+        """Delete a collection of the vector store together with its keyword and near-duplicate indexes."""
+        try:
+            # Dropping the collection keeps open Chroma clients valid, unlike
+            # deleting its files underneath them
+            vector_store = self._open_vector_store(collection)
+            try:
+                vector_store.delete_collection()
+            finally:
+                _close_vector_store(vector_store)
+        except Exception as e:
+            print(f"Warning: Could not delete collection {collection or 'default'}: {str(e)}")
+        if collection:
+            try:
+                os.rmdir(os.path.join(self.persist_directory, collection))
+            except OSError:
+                pass
+        if self.vector_store_kind == "chroma":
+            _remove_orphaned_chroma_segments(self.persist_directory)
+        KeywordIndex(self._keyword_index_path(collection)).clear()
+        NearDuplicateIndex(self._dedup_index_path(collection)).clear()
         
     def _run_llm(self, prompt: str) -> str:
         """Invoke OpenAI model and return plain text."""
@@ -96,117 +2670,1128 @@ class QAAgentBackend:
         except Exception as exc:
             raise RuntimeError(f"OpenAI generation failed: {exc}") from exc
     
-    def _parse_document(self, file_path: str) -> str:
+    def _parse_document(self, file_path: SupportDocument) -> str:
+        """
+        Parse a document based on its file extension.
+        
+        Args:
+            file_path: Path to the document file, or an in-memory DocumentSource
+            
+        Returns:
+            Extracted text content from the document
+        """
+        return _parse_document_file(file_path)
+    
+    def _parse_documents_parallel(self, file_paths: List[SupportDocument], spool_dir: str, started: float,
+                                  labels: Optional[Dict[SupportDocument, str]] = None):
+        """
+        Parse several documents in a process pool.
+        
+        Each file is parsed in a worker process with a per-file timeout, so a
+        slow or crashing parser only costs that file. Files whose worker
+        crashed are retried one at a time in a dedicated process to tell the
+        culprit apart from files that merely shared the broken pool. Workers
+        stream their segments to spool files in ``spool_dir``.
+        
+        This is a generator: it yields a "parsed" progress event as each file
+        finishes and returns the results when done.
+        
+        Args:
+            file_paths: Paths of the documents to parse, or in-memory documents
+            spool_dir: Directory for the per-file segment spools
+            started: ``time.perf_counter()`` at the start of the build
+            labels: Optional display names for the paths in progress events
+            
+        Returns:
+            Dictionary mapping each path to its spool file (None on failure).
+            Empty when parsing is configured to run inline, in which case the
+            segments are streamed by ``_iter_parsed_segments`` on demand.
+        """
+        results: Dict[SupportDocument, Optional[str]] = {}
+        if self.parse_workers <= 1:
+            return results
+        
+        labels = labels or {}
+        spool_paths = {
+            file_path: os.path.join(spool_dir, f"{i}.jsonl")
+            for i, file_path in enumerate(file_paths)
+        }
+        suspects = yield from self._run_parse_pool(file_paths, self.parse_workers, spool_paths, results, started, labels)
+        for file_path in suspects:
+            crashed = yield from self._run_parse_pool([file_path], 1, spool_paths, results, started, labels)
+            if crashed:
+                print(f"Error parsing {file_path}: parser process crashed")
+                results[file_path] = None
+                yield _progress_event(
+                    "parsed", started, source=labels.get(file_path, file_path), ok=False, cache_hit=False
+                )
+        return results
+    
+    def _run_parse_pool(self, file_paths: List[SupportDocument], max_workers: int,
+                        spool_paths: Dict[SupportDocument, str], results: Dict[SupportDocument, Optional[str]],
+                        started: float, labels: Dict[SupportDocument, str]):
+        """
+        Parse ``file_paths`` in one process pool, recording spool paths in ``results``.
+        
+        Yields a "parsed" progress event per finished file.
+        
+        Returns:
+            Paths that could not be parsed because a worker process died
+        """
+        if not file_paths:
+            return []
+        workers = min(max_workers, len(file_paths))
+        crashed: List[str] = []
+        context = multiprocessing.get_context()
+        worker_pids = context.SimpleQueue()
+        executor = ProcessPoolExecutor(
+            max_workers=workers, mp_context=context, initializer=_report_worker_pid, initargs=(worker_pids,)
+        )
+        futures = {
+            executor.submit(_parse_document_worker, file_path, self.parse_timeout, spool_paths[file_path]): file_path
+            for file_path in file_paths
+        }
+        # Backstop for parsers stuck in native code, where the in-worker alarm cannot fire
+        rounds = -(-len(file_paths) // workers)
+        backstop = self.parse_timeout * (rounds + 1)
+        try:
+            for future in as_completed(futures, timeout=backstop):
+                file_path = futures[future]
+                try:
+                    future.result()
+                    results[file_path] = spool_paths[file_path]
+                except BrokenProcessPool:
+                    crashed.append(file_path)
+                    continue
+                except ParseTimeoutError as e:
+                    print(f"Error parsing {file_path}: {e}")
+                    results[file_path] = None
+                except Exception as e:
+                    print(f"Error parsing {file_path}: {str(e)}")
+                    results[file_path] = None
+                yield _progress_event(
+                    "parsed", started,
+                    source=labels.get(file_path, file_path),
+                    ok=results[file_path] is not None,
+                    cache_hit=False,
+                )
+        except FuturesTimeoutError:
+            for future, file_path in futures.items():
+                if not future.done():
+                    print(f"Error parsing {file_path}: timed out")
+                    results[file_path] = None
+                    yield _progress_event(
+                        "parsed", started, source=labels.get(file_path, file_path), ok=False, cache_hit=False
+                    )
+            # Every worker that took a file reported its PID before starting it
+            while not worker_pids.empty():
+                try:
+                    os.kill(worker_pids.get(), signal.SIGTERM)
+                except OSError:
+                    pass
+        finally:
+            executor.shutdown(wait=False, cancel_futures=True)
+            worker_pids.close()
+        return crashed
+    
+    def _iter_parsed_segments(self, file_path: SupportDocument, file_hash: str,
+                              spool_paths: Dict[str, Optional[str]]) -> Iterator[Dict[str, Any]]:
+        """
+        Stream the segments of a document.
+        
+        Documents already parsed (cached or by the pool) are read back from
+        their spool. Otherwise the document is parsed inline, from disk or
+        memory, and its segments are written through to the parse cache as
+        they are produced.
+        """
+        if file_path in spool_paths:
+            if not spool_paths[file_path]:
+                return
+            try:
+                spool = open(spool_paths[file_path], 'r', encoding='utf-8')
+            except FileNotFoundError:
+                # Evicted by a process that could not see our cache lock
+                # (no file locks on this platform): parse the document again
+                pass
+            else:
+                yield from _iter_spooled_segments(spool)
+                return
+        if not self.parse_cache.enabled:
+            yield from _iter_document_segments(file_path)
+            return
+        
+        spool_dir = self.parse_cache.make_spool_dir()
+        spool_path = os.path.join(spool_dir, "inline.jsonl")
+        try:
+            with open(spool_path, 'w', encoding='utf-8') as spool:
+                for segment in _iter_document_segments(file_path):
+                    spool.write(json.dumps(segment) + "\n")
+                    yield segment
+            self.parse_cache.put(file_hash, spool_path)
+        finally:
+            shutil.rmtree(spool_dir, ignore_errors=True)
+    
+    def _embedding_signature(self) -> str:
+        """Identify the embedding space; chunks from a different space must be re-embedded."""
+        if self.embeddings_provider == "local":
+            from local_embeddings import local_embedding_signature
+            return local_embedding_signature(self.local_embed_dim)
+        return f"openai:{self.embed_model}"
+    
+    def _chunking_signature(self) -> str:
+        """Identify the chunking settings; a change means every source must be re-split."""
+        overlaps = ",".join(f"{ext}={overlap}" for ext, overlap in sorted(CHUNK_OVERLAP_BY_TYPE.items()))
+        store_version = ""
+        if self.vector_store_kind == "numpy":
+            # NumPy stores of an older layout read as empty and must be filled again
+            from numpy_store import INDEX_VERSION
+            store_version = f":numpyv{INDEX_VERSION}"
+        return (
+            f"{_parser_signature()}:recursive:{CHUNK_SIZE}:{CHUNK_OVERLAP}:{overlaps}"
+            f":simhash{SIMHASH_SHINGLE_SIZE}/{SIMHASH_MAX_DISTANCE}:bm25v{KEYWORD_INDEX_VERSION}{store_version}"
+        )
+    
+    def _manifest_path(self, staging: bool = False) -> str:
+        return os.path.join(self.persist_directory, STAGING_MANIFEST_FILENAME if staging else MANIFEST_FILENAME)
+    
+    def _knowledge_base_version(self) -> Optional[tuple]:
+        """
+        Identify the current state of the knowledge base.
+        
+        Every build rewrites the manifest, so its file identity changes
+        whenever indexed content may have changed, including builds run by
+        other processes such as ingest_cli.py.
+        
+        Returns:
+            ``(inode, mtime_ns, size)`` of the manifest, or None if there is none
+        """
+        try:
+            stat = os.stat(self._manifest_path())
+        except OSError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    
+    def _load_manifest(self, staging: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Load the ingestion manifest describing what is currently indexed.
+        
+        Args:
+            staging: Load the manifest of an unfinished full rebuild instead
+        
+        Returns:
+            The manifest dictionary, or None if it is missing or unreadable
+        """
+        return _read_manifest(self._manifest_path(staging))
+    
+    def _save_manifest(self, manifest: Dict[str, Any], staging: bool = False) -> None:
+        """Atomically write the ingestion manifest (or the manifest of an unfinished full rebuild)."""
+        os.makedirs(self.persist_directory, exist_ok=True)
+        tmp_path = self._manifest_path(staging) + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self._manifest_path(staging))
+    
+    def _drop_staged_build(self, live_collection: Optional[str]) -> None:
+        """Delete the collection of a full rebuild that was interrupted before it replaced the live one."""
+        staged = self._load_manifest(staging=True)
+        if staged and staged.get("collection") and staged.get("collection") != live_collection:
+            self._drop_collection(staged["collection"])
+        try:
+            os.remove(self._manifest_path(staging=True))
+        except OSError:
+            pass
+    
+    def _resume_staged_build(self, live_collection: Optional[str]) -> Optional[Dict[str, Any]]:
+        """
+        Return the manifest of an interrupted full build to continue, or drop that build.
+        
+        A full build records every source it has indexed in the staging
+        manifest. If it was cancelled, failed or killed, the next full build
+        continues in its collection, so those sources are not embedded
+        again, unless it embedded into a different space.
+        
+        Returns:
+            The staging manifest, or None if there is no build to resume
+        """
+        staged = self._load_manifest(staging=True)
+        if (staged and staged.get("version") == MANIFEST_VERSION
+                and staged.get("embedding") == self._embedding_signature()
+                and staged.get("collection") and staged.get("collection") != live_collection):
+            return staged
+        self._drop_staged_build(live_collection)
+        return None
+    
+    def _swap_in_collection(self, manifest: Dict[str, Any], vector_store, keyword_index: KeywordIndex,
+                            old_collection: Optional[str]) -> None:
+        """
+        Make a fully built collection the live knowledge base and drop the one it replaces.
+        
+        Runs under the shared write lock: queries finish on the old collection
+        before the swap and start on the new one after it.
+        """
+        shared = self.shared_knowledge_base
+        with shared.lock.write():
+            self._save_manifest(manifest)
+            if shared.vector_store is not vector_store:
+                _close_vector_store(shared.vector_store)
+            shared.vector_store = vector_store
+            shared.keyword_index = keyword_index
+            shared.collection = manifest.get("collection")
+            shared.version = self._knowledge_base_version()
+            if old_collection != shared.collection:
+                self._drop_collection(old_collection)
+        try:
+            os.remove(self._manifest_path(staging=True))
+        except OSError:
+            pass
+    
+    def _indexed_chunk_ids(self, vector_store, source: str) -> List[str]:
+        """Return the IDs of all chunks currently stored for a source."""
+        return vector_store.get(where={"source": source}, include=[])["ids"]
+    
+    def _forget_source(self, vector_store, keyword_index: KeywordIndex, dedup_index: NearDuplicateIndex,
+                       manifest: Dict[str, Any], source: str, write_lock: Callable[[], ContextManager]) -> tuple:
+        """
+        Delete a source's chunks and its manifest entry.
+        
+        Chunks of other sources that were dropped as duplicates of the
+        deleted chunks are stored in their place.
+        
+        Args:
+            write_lock: Context manager factory held while the indexes are
+                written (the shared write lock for the live knowledge base)
+        
+        Returns:
+            ``(deleted, restored)`` chunk counts
+        """
+        stale_ids = self._indexed_chunk_ids(vector_store, source)
+        with write_lock():
+            if stale_ids:
+                vector_store.delete(ids=stale_ids)
+                keyword_index.remove(stale_ids)
+            dedup_index.drop_aliases(source)
+            orphans = dedup_index.remove(sorted(set(stale_ids) | set(dedup_index.chunk_ids(source))))
+        manifest["sources"].pop(source, None)
+        restored = self._restore_aliases(vector_store, keyword_index, dedup_index, manifest, orphans, write_lock)
+        return len(stale_ids), restored
+    
+    def _restore_aliases(self, vector_store, keyword_index: KeywordIndex, dedup_index: NearDuplicateIndex,
+                         manifest: Dict[str, Any], orphans: List["Document"],
+                         write_lock: Callable[[], ContextManager]) -> int:
+        """
+        Store chunks that were dropped as duplicates of chunks that have been deleted.
+        
+        They are deduplicated again first, so a chunk with another stored
+        copy becomes an alias of that copy instead.
+        
+        Returns:
+            Number of chunks stored
+        """
+        by_source: Dict[str, List["Document"]] = {}
+        for doc in orphans:
+            by_source.setdefault(doc.metadata["source"], []).append(doc)
+        restored = 0
+        for source, docs in by_source.items():
+            for start in range(0, len(docs), UPSERT_BATCH_SIZE):
+                kept = dedup_index.deduplicate(source, docs[start:start + UPSERT_BATCH_SIZE], stored_ids=set())
+                if kept:
+                    self._write_chunks(vector_store, keyword_index, source, kept, [], write_lock)
+                    restored += len(kept)
+                    if source in manifest["sources"]:
+                        manifest["sources"][source]["chunk_count"] += len(kept)
+        return restored
+    
+    def _write_chunks(self, vector_store, keyword_index: KeywordIndex, source: str, new_docs: List["Document"],
+                      kept_docs: List["Document"], write_lock: Callable[[], ContextManager]) -> None:
         """
-        Parse a document based on its file extension.
+        Add new chunks of a source and refresh the metadata of its kept chunks.
+        
+        New chunks are embedded before ``write_lock`` is taken, so queries on
+        the live knowledge base wait for the writes but never for the
+        embeddings API.
+        """
+        vectors = (
+            self.vector_store_embeddings.embed_documents([doc.page_content for doc in new_docs]) if new_docs else []
+        )
+        with write_lock():
+            if new_docs:
+                vector_store.add_embeddings(
+                    zip([doc.page_content for doc in new_docs], vectors),
+                    metadatas=[doc.metadata for doc in new_docs],
+                    ids=[doc.id for doc in new_docs],
+                )
+            if kept_docs:
+                # Chunk positions may shift when text is inserted earlier in the
+                # file; update metadata in place without re-embedding
+                vector_store.update_metadata([doc.id for doc in kept_docs], [doc.metadata for doc in kept_docs])
+            # Kept chunks are passed too, so knowledge bases built before the
+            # keyword index existed are back-filled; indexed chunks are skipped
+            keyword_index.add(source, [*new_docs, *kept_docs])
+    
+    def _iter_source_chunks(self, source: str, segments: Iterable[Dict[str, Any]], file_hash: str) -> Iterator["Document"]:
+        """
+        Split a single source into chunks with deterministic IDs.
+        
+        Segments are split one at a time with the splitter for the source's
+        file type, so chunks never span pages or sections and only the current
+        segment is held in memory.
         
         Args:
-            file_path: Path to the document file
+            source: Source name recorded in chunk metadata
+            segments: Text segments of the source, in document order
+            file_hash: sha256 of the source file
             
+        Yields:
+            Chunk documents; each document's ``id`` is its vector store ID
+        """
+        from langchain_core.documents import Document
+        
+        text_splitter = self._get_text_splitter(Path(source).suffix.lower())
+        chunk_index = 0
+        occurrences: Dict[str, int] = {}
+        for segment in segments:
+            for chunk in text_splitter.split_text(segment["text"]):
+                chunk_hash = _sha256_text(chunk)
+                occurrence = occurrences.get(chunk_hash, 0)
+                occurrences[chunk_hash] = occurrence + 1
+                metadata = {
+                    "source": source,
+                    "chunk_index": chunk_index,
+                    "file_hash": file_hash,
+                    "chunk_hash": chunk_hash,
+                }
+                for key in ("page", "heading", "json_path", "element"):
+                    if key in segment:
+                        metadata[key] = segment[key]
+                yield Document(
+                    id=_chunk_id(source, chunk_hash, occurrence),
+                    page_content=chunk,
+                    metadata=metadata
+                )
+                chunk_index += 1
+    
+    def _drop_duplicate_chunks(self, dedup_index: NearDuplicateIndex, source: str, chunks: Iterable["Document"],
+                               stored_ids: Set[str], report: Dict[str, Any]) -> Iterator["Document"]:
+        """
+        Filter out chunks of a source whose content an indexed chunk already holds.
+        
+        Chunks are compared with the chunks of every other source and with
+        the chunks of this source kept earlier in the stream, in batches of
+        ``UPSERT_BATCH_SIZE`` (see ``NearDuplicateIndex.deduplicate``).
+        Chunks already stored for the source are kept as they are.
+        ``report["chunks"]`` counts the chunks read and ``report["dropped"]``
+        the dropped ones.
+        """
+        dedup_index.drop_aliases(source)
+        seen_ids: Set[str] = set()
+        batch: List["Document"] = []
+        for doc in chunks:
+            report["chunks"] += 1
+            batch.append(doc)
+            if len(batch) >= UPSERT_BATCH_SIZE:
+                kept = dedup_index.deduplicate(source, batch, stored_ids, seen_ids)
+                report["dropped"] += len(batch) - len(kept)
+                batch = []
+                yield from kept
+        if batch:
+            kept = dedup_index.deduplicate(source, batch, stored_ids, seen_ids)
+            report["dropped"] += len(batch) - len(kept)
+            yield from kept
+    
+    def _sync_source_chunks(self, vector_store, keyword_index: KeywordIndex, dedup_index: NearDuplicateIndex,
+                            manifest: Dict[str, Any], source: str, chunks: Iterable["Document"],
+                            existing_ids: Set[str], dedup_report: Dict[str, int], started: float,
+                            write_lock: Callable[[], ContextManager]):
+        """
+        Bring the stored chunks of one source in line with ``chunks``.
+        
+        Chunks are consumed in batches: new chunks are embedded and upserted,
+        chunks that are still present only get their metadata refreshed (no
+        embedding call), and once the stream ends chunks that no longer exist
+        are deleted. Chunks of other sources that were dropped as duplicates
+        of the deleted chunks are stored in their place. Every batch and the
+        final deletion are written under ``write_lock``; a reader may see a
+        source half updated, but never a batch half written.
+        
+        This is a generator: it yields an "embedded" progress event after
+        every batch and a "chunked" event once the chunk stream ends, and
+        returns the counts when done.
+        
+        Args:
+            existing_ids: IDs of the chunks stored for the source before the sync
+            dedup_report: Chunk counts of ``_drop_duplicate_chunks`` for ``chunks``
+            write_lock: Context manager factory held while the indexes are
+                written (the shared write lock for the live knowledge base)
+        
         Returns:
-            Extracted text content from the document
+            Dictionary with counts of total, embedded, kept, deleted and restored chunks
         """
-        file_ext = Path(file_path).suffix.lower()
-        text_content = ""
+        wanted_ids = set()
+        counts = {"total": 0, "embedded": 0, "kept": 0, "deleted": 0, "restored": 0}
         
-        try:
-            if file_ext == '.pdf':
-                # Use PyMuPDF for PDF parsing
-                doc = fitz.open(file_path)
-                for page in doc:
-                    text_content += page.get_text()
-                doc.close()
-            elif file_ext in ['.md', '.txt']:
-                # Read text files directly
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    text_content = f.read()
-            elif file_ext == '.json':
-                # Read JSON files
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    text_content = f.read()
-            else:
-                # Use unstructured for other file types
-                elements = partition(filename=file_path)
-                text_content = "\n\n".join([str(el) for el in elements])
-        except Exception as e:
-            print(f"Error parsing {file_path}: {str(e)}")
-            # Fallback: try reading as text
-            try:
-                with open(file_path, 'r', encoding='utf-8', errors='ignore') as f:
-                    text_content = f.read()
-            except:
-                text_content = ""
+        batch: List["Document"] = []
+        
+        def flush():
+            new_docs = [doc for doc in batch if doc.id not in existing_ids]
+            kept_docs = [doc for doc in batch if doc.id in existing_ids]
+            self._write_chunks(vector_store, keyword_index, source, new_docs, kept_docs, write_lock)
+            counts["embedded"] += len(new_docs)
+            counts["kept"] += len(kept_docs)
+            batch.clear()
         
-        return text_content
+        for doc in chunks:
+            wanted_ids.add(doc.id)
+            counts["total"] += 1
+            batch.append(doc)
+            if len(batch) >= UPSERT_BATCH_SIZE:
+                flush()
+                yield _progress_event(
+                    "embedded", started, source=source,
+                    embedded=counts["embedded"], chunks=counts["total"],
+                )
+        yield _progress_event(
+            "chunked", started, source=source,
+            chunks=dedup_report["chunks"], deduplicated=dedup_report["dropped"],
+        )
+        if batch:
+            flush()
+            yield _progress_event(
+                "embedded", started, source=source,
+                embedded=counts["embedded"], chunks=counts["total"],
+            )
+        
+        stale_ids = sorted(existing_ids - wanted_ids)
+        with write_lock():
+            if stale_ids:
+                vector_store.delete(ids=stale_ids)
+                keyword_index.remove(stale_ids)
+            # Fingerprints of chunks an interrupted build never stored are dropped too
+            orphans = dedup_index.remove(sorted(set(stale_ids) | (set(dedup_index.chunk_ids(source)) - wanted_ids)))
+        counts["deleted"] = len(stale_ids)
+        counts["restored"] = self._restore_aliases(
+            vector_store, keyword_index, dedup_index, manifest, orphans, write_lock
+        )
+        return counts
     
-    def ingest_documents(self, support_docs_paths: List[str], html_content: str) -> Dict[str, Any]:
+    def ingest_documents(self, support_docs_paths: SupportDocuments, html_content: str, rebuild: bool = False,
+                         progress_callback: Optional[Callable[[Dict[str, Any]], None]] = None,
+                         prune_missing: bool = True) -> Dict[str, Any]:
         """
         Ingest support documents and HTML content into the knowledge base.
         
+        Blocking wrapper around ``iter_ingest_documents``.
+        
         Args:
-            support_docs_paths: List of paths to support documents
+            support_docs_paths: Support document paths or in-memory DocumentSource objects,
+                as a list or as a dictionary keyed by source name
             html_content: HTML content string
+            rebuild: Discard the existing index and re-embed everything
+            progress_callback: Optional function called with every progress event
+            prune_missing: Remove indexed sources that are not in ``support_docs_paths``
             
         Returns:
-            Dictionary with status and message
+            Dictionary with status, message and ingestion statistics
+        """
+        result: Dict[str, Any] = {"status": "error", "message": "Knowledge base build did not complete."}
+        for event in self.iter_ingest_documents(support_docs_paths, html_content, rebuild, prune_missing):
+            if progress_callback:
+                progress_callback(event)
+            if event["stage"] == "done":
+                result = event["result"]
+        return result
+    
+    def iter_ingest_documents(self, support_docs_paths: SupportDocuments, html_content: str,
+                              rebuild: bool = False, prune_missing: bool = True,
+                              cancel: Optional[threading.Event] = None) -> Iterator[Dict[str, Any]]:
+        """
+        Ingest support documents and HTML content, yielding progress events.
+        
+        Ingestion is incremental: every file is hashed and only files whose
+        content changed are parsed and re-chunked, and of those only new
+        chunks are embedded. Chunks whose content an indexed chunk of any
+        source already holds (an exact copy, or a near copy that adds
+        nothing) are skipped; retrieval scoped to their source still finds
+        that chunk. Sources that are no longer part of
+        ``support_docs_paths`` are removed from the index, unless
+        ``prune_missing`` is False (for ingesting a large corpus in batches).
+        
+        Sources are named after the document's file name. Pass a dictionary
+        to choose the names, e.g. paths relative to a corpus root. The HTML
+        content is indexed as the ``HTML_SOURCE`` source, split into forms,
+        sections and widget groups that are retrieved on demand.
+        
+        Every event is a dictionary with a ``stage``, the seconds ``elapsed``
+        since the build started, and ``files_done`` out of ``files_total``
+        sources (unchanged sources count as done once they are hashed):
+        
+        - ``started``: ``sources`` to ingest
+        - ``hashed``: ``changed``, ``unchanged`` and ``removed`` source counts
+        - ``parsed``: a ``source`` finished parsing (``ok``, ``cache_hit``);
+          sources parsed inline are reported by ``chunked`` instead
+        - ``embedded``: batch progress for a ``source``, ``embedded`` new
+          chunks out of ``chunks`` processed so far
+        - ``chunked``: a ``source`` is fully split into ``chunks``, of which
+          ``deduplicated`` were dropped as duplicates
+        - ``indexed``: a ``source`` is fully synced, with its chunk counts,
+          ``duration`` and the ``done``/``total`` changed sources
+        - ``done``: the final ``result`` dictionary (same as ``ingest_documents``)
+        
+        In-memory documents are hashed and parsed straight from memory; only
+        those larger than ``QA_UPLOAD_SPOOL_MB`` are written to a private
+        temp file, so they can be parsed in the process pool.
+        
+        A full rebuild (``rebuild``, a missing manifest or a new embedding
+        space) is written to a new collection while queries keep using the
+        live one, which it replaces atomically once complete; a full build
+        that was interrupted is resumed by the next one. Other builds update
+        the live collection in place, one batch of chunks at a time under
+        the shared write lock.
+        
+        Args:
+            support_docs_paths: Support document paths or in-memory DocumentSource objects,
+                as a list or as a dictionary keyed by source name
+            html_content: HTML content string
+            rebuild: Discard the existing index and re-embed everything
+            prune_missing: Remove indexed sources that are not in ``support_docs_paths``
+            cancel: Optional event that stops the build's embedding requests
+                once set; the build then ends with an error result. The
+                generator must be consumed on a single thread.
+            
+        Yields:
+            Progress events, ending with a ``done`` event
         """
+        files = {"files_done": 0, "files_total": 0}
+        events = self._iter_ingest_events(support_docs_paths, html_content, rebuild, prune_missing, files)
+        try:
+            with self.embedding_scheduler.cancellable(cancel):
+                for event in events:
+                    yield {**event, **files}
+        finally:
+            # A caller that stops early must not leave the build lock held
+            events.close()
+    
+    def _iter_ingest_events(self, support_docs_paths: SupportDocuments, html_content: str, rebuild: bool,
+                            prune_missing: bool, files: Dict[str, int]) -> Iterator[Dict[str, Any]]:
+        """Run a build for ``iter_ingest_documents``, keeping the ``files_done``/``files_total`` counts in ``files``."""
+        started = time.perf_counter()
+        shared = self.shared_knowledge_base
+        vector_store = None
+        # One build per knowledge base at a time in this process
+        shared.build_lock.acquire()
         try:
             # Store HTML content separately (strip whitespace but keep content)
             self.html_content = html_content.strip() if html_content else ""
             
-            # Parse all support documents
-            all_texts = []
-            for doc_path in support_docs_paths:
-                if os.path.exists(doc_path):
-                    text = self._parse_document(doc_path)
-                    if text:
-                        all_texts.append(text)
+            # Map source names to documents; the name identifies a source across builds
+            if isinstance(support_docs_paths, dict):
+                named_docs = support_docs_paths.items()
+            else:
+                named_docs = ((Path(str(doc_path)).name, doc_path) for doc_path in support_docs_paths)
+            sources: Dict[str, SupportDocument] = {}
+            for source, doc_path in named_docs:
+                if isinstance(doc_path, DocumentSource) or os.path.exists(doc_path):
+                    sources[source] = doc_path
                 else:
                     print(f"Warning: File not found: {doc_path}")
+            # The page under test is indexed as DOM segments next to the documents
+            if self.html_content:
+                sources[HTML_SOURCE] = DocumentSource(HTML_SOURCE, self.html_content.encode('utf-8'))
+            files["files_total"] = len(sources)
+            yield _progress_event("started", started, sources=len(sources))
             
-            if not all_texts:
-                return {
-                    "status": "error",
-                    "message": "No valid documents were parsed. Please check file paths."
-                }
+            # A missing manifest or a different embedding space invalidates the
+            # whole index (this also prevents dimension mismatches)
+            live_manifest = self._load_manifest()
+            live_collection = live_manifest.get("collection") if live_manifest else None
+            manifest = None if rebuild else live_manifest
+            staged = manifest is None or manifest.get("embedding") != self._embedding_signature()
+            if staged:
+                # Build into a new collection; the live one keeps serving
+                # queries until the new one replaces it
+                manifest = self._resume_staged_build(live_collection)
+                if manifest is None:
+                    manifest = {
+                        "version": MANIFEST_VERSION,
+                        "embedding": self._embedding_signature(),
+                        "chunking": self._chunking_signature(),
+                        "collection": f"kb-{time.time_ns():x}",
+                        "sources": {},
+                    }
+                    # Recorded before anything is written, so the collection
+                    # is resumed or dropped even if no source completes
+                    self._save_manifest(manifest, staging=True)
+            if manifest.get("chunking") != self._chunking_signature():
+                # Every source must be re-split; clearing the hashes (rather than
+                # re-chunking only this call's sources) keeps batched ingestion correct
+                for entry in manifest["sources"].values():
+                    entry["file_hash"] = None
+                manifest["chunking"] = self._chunking_signature()
             
-            # Combine all texts
-            combined_text = "\n\n---\n\n".join(all_texts)
+            vector_store = self._open_vector_store(manifest.get("collection"))
+            keyword_index = KeywordIndex(self._keyword_index_path(manifest.get("collection")))
+            dedup_index = NearDuplicateIndex(self._dedup_index_path(manifest.get("collection")))
+            # Queries only read the live collection
+            write_lock = nullcontext if staged else shared.lock.write
             
-            # Split into chunks
-            chunks = self.text_splitter.split_text(combined_text)
+            stats = {
+                "sources_added": 0,
+                "sources_updated": 0,
+                "sources_unchanged": 0,
+                "sources_removed": 0,
+                "chunks_embedded": 0,
+                "chunks_deleted": 0,
+                "chunks_deduplicated": 0,
+                "chunks_restored": 0,
+                "parse_cache_hits": 0,
+                "embedding_cache_hits": 0,
+                "embedding_tokens": 0,
+                "embedding_seconds": 0.0,
+                "embedding_rate_limited": 0,
+                "embedding_tokens_per_second": 0.0,
+            }
+            embedder = self.vector_store_embeddings
+            scheduler = self.embedding_scheduler
+            embedding_hits = getattr(embedder, "hits", 0)
+            embedding_usage = (scheduler.tokens, scheduler.seconds, scheduler.rate_limited)
             
-            # Create documents with metadata
-            documents = [
-                Document(
-                    page_content=chunk,
-                    metadata={"source": "support_docs", "chunk_index": i}
+            # Drop chunks of sources that are no longer part of the corpus
+            removed_sources = set(manifest["sources"]) - set(sources) if prune_missing else set()
+            for source in sorted(removed_sources):
+                deleted, restored = self._forget_source(
+                    vector_store, keyword_index, dedup_index, manifest, source, write_lock
                 )
-                for i, chunk in enumerate(chunks)
+                stats["chunks_deleted"] += deleted
+                stats["chunks_restored"] += restored
+                stats["sources_removed"] += 1
+            
+            # Hash every source first so only changed files reach the parse stage
+            file_hashes = {
+                source: _sha256_bytes(doc_path.data) if isinstance(doc_path, DocumentSource) else _sha256_file(doc_path)
+                for source, doc_path in sources.items()
+            }
+            changed_sources = {
+                source for source, file_hash in file_hashes.items()
+                if source not in manifest["sources"]
+                or manifest["sources"][source]["file_hash"] != file_hash
+            }
+            changed = [
+                (source, doc_path, file_hashes[source])
+                for source, doc_path in sources.items() if source in changed_sources
             ]
+            stats["sources_unchanged"] = len(sources) - len(changed)
+            files["files_done"] = stats["sources_unchanged"]
+            yield _progress_event(
+                "hashed", started,
+                changed=len(changed), unchanged=stats["sources_unchanged"], removed=len(removed_sources),
+            )
+            
+            spool_paths: Dict[str, Optional[str]] = {}
+            spool_dir = self.parse_cache.make_spool_dir()
+            try:
+                # Keep cache hits from being evicted by another build before they are read
+                with self.parse_cache.reading():
+                    # Reuse cached parser output; only cache misses reach the parse stage
+                    for source, doc_path, file_hash in changed:
+                        cached_spool = self.parse_cache.get(file_hash)
+                        if cached_spool:
+                            spool_paths[doc_path] = cached_spool
+                            stats["parse_cache_hits"] += 1
+                            yield _progress_event("parsed", started, source=source, ok=True, cache_hit=True)
+                    
+                    # In-memory uploads are parsed in the process pool as well: large
+                    # ones from a private temp file, the rest sent to the workers as bytes
+                    if self.parse_workers > 1:
+                        upload_dir = os.path.join(spool_dir, "uploads")
+                        for i, (source, doc_path, file_hash) in enumerate(changed):
+                            if (isinstance(doc_path, DocumentSource) and doc_path not in spool_paths
+                                    and doc_path.size > self.upload_spool_threshold):
+                                os.makedirs(upload_dir, exist_ok=True)
+                                changed[i] = (source, doc_path.write_to(upload_dir), file_hash)
+                    to_parse = [
+                        (doc_path, file_hash) for _, doc_path, file_hash in changed
+                        if doc_path not in spool_paths
+                    ]
+                    parsed = yield from self._parse_documents_parallel(
+                        [doc_path for doc_path, _ in to_parse], spool_dir, started,
+                        labels={doc_path: source for source, doc_path, _ in changed},
+                    )
+                    for doc_path, file_hash in to_parse:
+                        if parsed.get(doc_path):
+                            parsed[doc_path] = self.parse_cache.put(file_hash, parsed[doc_path])
+                    spool_paths.update(parsed)
+                    
+                    for done, (source, doc_path, file_hash) in enumerate(changed, start=1):
+                        source_started = time.perf_counter()
+                        entry = manifest["sources"].get(source)
+                        # Stream segments -> chunks -> dedup -> batched upserts for one file at a time
+                        segments = self._iter_parsed_segments(doc_path, file_hash, spool_paths)
+                        chunks = self._iter_source_chunks(source, segments, file_hash)
+                        existing_ids = set(self._indexed_chunk_ids(vector_store, source))
+                        dedup_report = {"chunks": 0, "dropped": 0}
+                        chunks = self._drop_duplicate_chunks(dedup_index, source, chunks, existing_ids, dedup_report)
+                        counts = yield from self._sync_source_chunks(
+                            vector_store, keyword_index, dedup_index, manifest, source, chunks, existing_ids,
+                            dedup_report, started, write_lock,
+                        )
+                        stats["chunks_embedded"] += counts["embedded"]
+                        stats["chunks_deleted"] += counts["deleted"]
+                        stats["chunks_deduplicated"] += dedup_report["dropped"]
+                        stats["chunks_restored"] += counts["restored"]
+                        
+                        # A source whose chunks are all duplicates stays indexed
+                        if counts["total"] or dedup_report["dropped"]:
+                            stats["sources_updated" if entry else "sources_added"] += 1
+                            manifest["sources"][source] = {
+                                "file_hash": file_hash,
+                                "chunk_count": counts["total"],
+                            }
+                        else:
+                            if entry:
+                                stats["sources_removed"] += 1
+                            manifest["sources"].pop(source, None)
+                        # Record progress per file so an interrupted build resumes where it stopped
+                        self._save_manifest(manifest, staging=staged)
+                        files["files_done"] += 1
+                        yield _progress_event(
+                            "indexed", started,
+                            source=source,
+                            chunks=counts["total"],
+                            embedded=counts["embedded"],
+                            deleted=counts["deleted"],
+                            deduplicated=dedup_report["dropped"],
+                            duration=round(time.perf_counter() - source_started, 3),
+                            done=done,
+                            total=len(changed),
+                        )
+            finally:
+                shutil.rmtree(spool_dir, ignore_errors=True)
+                self.parse_cache.evict()
+                self.embedding_cache.evict()
+                stats["embedding_cache_hits"] = getattr(embedder, "hits", 0) - embedding_hits
+                stats["embedding_tokens"] = scheduler.tokens - embedding_usage[0]
+                stats["embedding_seconds"] = round(scheduler.seconds - embedding_usage[1], 3)
+                stats["embedding_rate_limited"] = scheduler.rate_limited - embedding_usage[2]
+                stats["embedding_tokens_per_second"] = round(
+                    stats["embedding_tokens"] / stats["embedding_seconds"] if stats["embedding_seconds"] else 0.0, 1
+                )
+            if staged:
+                self._swap_in_collection(manifest, vector_store, keyword_index, live_collection)
+            else:
+                self._save_manifest(manifest)
             
-            # Ensure previous ChromaDB data is removed to prevent dimension mismatches
-            if os.path.exists(self.persist_directory):
-                import shutil
-                shutil.rmtree(self.persist_directory, ignore_errors=True)
+            if not manifest["sources"]:
+                result = {
+                    "status": "error",
+                    "message": "No valid documents were parsed. Please check file paths.",
+                    "stats": stats,
+                }
+            else:
+                throughput = (
+                    f", {stats['embedding_tokens_per_second']:,.0f} tokens/s" if stats["embedding_tokens"] else ""
+                )
+                result = {
+                    "status": "success",
+                    "message": (
+                        "Knowledge Base Built Successfully. "
+                        f"{stats['chunks_embedded']} chunks embedded "
+                        f"({stats['embedding_cache_hits']} from the embedding cache{throughput}), "
+                        f"{stats['chunks_deleted']} removed, "
+                        f"{stats['chunks_deduplicated']} duplicate chunks skipped, "
+                        f"{stats['sources_unchanged']} unchanged source(s) skipped."
+                    ),
+                    "stats": stats,
+                }
             
-            # Create new vector store with current embeddings
-            self.vector_store = Chroma.from_documents(
-                documents=documents,
-                embedding=self.embeddings,
-                persist_directory=self.persist_directory,
-            )
+        except IngestionCancelled as e:
+            result = {"status": "error", "message": str(e)}
+        except Exception as e:
+            result = {
+                "status": "error",
+                "message": f"Error building knowledge base: {str(e)}"
+            }
+        finally:
+            # A staged build's handle now serves queries; any other is done
+            if vector_store is not shared.vector_store:
+                _close_vector_store(vector_store)
+            shared.build_lock.release()
+        
+        yield _progress_event("done", started, result=result)
+    
+    def prune_sources(self, keep: Iterable[str]) -> Dict[str, Any]:
+        """
+        Remove indexed sources that are not in ``keep``.
+        
+        Used after ingesting a corpus in batches with ``prune_missing=False``.
+        Chunks of kept sources that were dropped as duplicates of removed
+        chunks are stored again.
+        
+        Args:
+            keep: Names of the sources that make up the corpus
             
+        Returns:
+            Dictionary with status, message, the ``removed`` source names and
+            the numbers of ``chunks_deleted`` and ``chunks_restored``
+        """
+        shared = self.shared_knowledge_base
+        vector_store = None
+        shared.build_lock.acquire()
+        try:
+            manifest = self._load_manifest()
+            if manifest is None or manifest.get("embedding") != self._embedding_signature():
+                return {"status": "success", "message": "Nothing to prune.",
+                        "removed": [], "chunks_deleted": 0, "chunks_restored": 0}
+            vector_store = self._open_vector_store(manifest.get("collection"))
+            keyword_index = KeywordIndex(self._keyword_index_path(manifest.get("collection")))
+            dedup_index = NearDuplicateIndex(self._dedup_index_path(manifest.get("collection")))
+            removed = set(manifest["sources"]) - set(keep)
+            chunks_deleted = chunks_restored = 0
+            for source in sorted(removed):
+                deleted, restored = self._forget_source(
+                    vector_store, keyword_index, dedup_index, manifest, source, shared.lock.write
+                )
+                chunks_deleted += deleted
+                chunks_restored += restored
+            self._save_manifest(manifest)
             return {
                 "status": "success",
-                "message": "Knowledge Base Built Successfully."
+                "message": f"Removed {len(removed)} source(s) and {chunks_deleted} chunks.",
+                "removed": sorted(removed),
+                "chunks_deleted": chunks_deleted,
+                "chunks_restored": chunks_restored,
             }
-            
         except Exception as e:
             return {
                 "status": "error",
-                "message": f"Error building knowledge base: {str(e)}"
+                "message": f"Error pruning knowledge base: {str(e)}",
+                "removed": [],
+                "chunks_deleted": 0,
+                "chunks_restored": 0,
             }
+        finally:
+            _close_vector_store(vector_store)
+            shared.build_lock.release()
+    
+    def list_sources(self) -> List[str]:
+        """
+        List the names of the documents indexed in the knowledge base.
+        
+        Returns:
+            Sorted source names, suitable for scoping retrieval (the page
+            HTML is always retrieved separately and is not listed)
+        """
+        manifest = self._load_manifest()
+        return sorted(source for source in manifest["sources"] if source != HTML_SOURCE) if manifest else []
+    
+    def _hybrid_search(self, query: str, k: int = RETRIEVAL_K,
+                       search_filter: Optional[Dict[str, Any]] = None) -> List["Document"]:
+        """
+        Retrieve the chunks most relevant to ``query`` from both indexes.
+        
+        The ``HYBRID_CANDIDATES`` best vector matches and the best BM25
+        keyword matches are fused with reciprocal rank fusion: embeddings find
+        paraphrases, BM25 finds exact identifiers (discount codes, field
+        names, error messages) that embeddings tend to rank low, so fewer
+        chunks are needed per prompt.
+        
+        Results are cached per knowledge base version (see
+        ``_knowledge_base_version``), so regenerating with the same prompt or
+        test case skips retrieval entirely until the knowledge base is rebuilt.
+        
+        Args:
+            query: Search query
+            k: Number of chunks to return
+            search_filter: Optional vector store metadata filter on ``source``
+            
+        Returns:
+            Passages (see ``_select_passages``), best first
+        """
+        return self._hybrid_search_many([query], k, search_filter)[0]
+    
+    def _scope_filter(self, search_filter: Optional[Dict[str, Any]], collection: Optional[str]) -> Optional[Dict[str, Any]]:
+        """
+        Widen a ``source`` filter to the chunks of other sources that hold the
+        content of chunks dropped from its sources as duplicates.
+        """
+        if not search_filter:
+            return search_filter
+        try:
+            hashes = NearDuplicateIndex(self._dedup_index_path(collection)).aliased_hashes(search_filter)
+        except sqlite3.Error as e:
+            print(f"Duplicate lookup failed, searching the filtered sources only: {e}")
+            return search_filter
+        if not hashes:
+            return search_filter
+        return {"$or": [search_filter, {"chunk_hash": {"$in": hashes}}]}
+    
+    def _hybrid_search_many(self, queries: List[str], k: int = RETRIEVAL_K,
+                            search_filter: Optional[Dict[str, Any]] = None) -> List[List["Document"]]:
+        """
+        Run ``_hybrid_search`` for several queries at once.
+        
+        Queries missing from the retrieval cache are embedded in one call and
+        searched with one batched top-k query, and the chunk vectors used for
+        MMR are fetched once for all of them.
+        
+        Args:
+            queries: Search queries
+            k: Number of chunks to return per query
+            search_filter: Optional vector store metadata filter on ``source``
+            
+        Returns:
+            Passages for each query, in query order
+        """
+        from langchain_core.documents import Document
+        import numpy as np
+        
+        error = self._open_knowledge_base({})
+        if error:
+            raise RuntimeError(error["message"])
+        shared = self.shared_knowledge_base
+        kb_key = (shared.directory, shared.version, self._embedding_signature())
+        filter_key = json.dumps(search_filter, sort_keys=True)
+        results: Dict[str, List["Document"]] = {}
+        for query in queries:
+            cached = RETRIEVAL_CACHE.get((*kb_key, query, k, filter_key))
+            if cached is not None:
+                # Callers may reorder the list, never the documents
+                results[query] = list(cached)
+        pending = [query for query in dict.fromkeys(queries) if query not in results]
+        if not pending:
+            return [list(results[query]) for query in queries]
+        
+        def key(metadata: Dict[str, Any]) -> str:
+            # Chroma does not return IDs with search results; a chunk's
+            # position identifies it just as well
+            return f"{metadata.get('source')}#{metadata.get('chunk_index')}"
+        
+        query_vectors = self._embed_queries(pending)
+        with shared.lock.read():
+            if shared.vector_store is None:
+                # The knowledge base was deleted since it was opened above
+                raise RuntimeError("Knowledge base not found. Please build the knowledge base first.")
+            where = self._scope_filter(search_filter, shared.collection)
+            vector_hits = _similarity_search_many(shared.vector_store, query_vectors, HYBRID_CANDIDATES, where)
+            keyword_hits: List[List[str]] = []
+            for query in pending:
+                try:
+                    keyword_hits.append([
+                        chunk_id for chunk_id, _ in shared.keyword_index.search(query, HYBRID_CANDIDATES, where)
+                    ])
+                except sqlite3.Error as e:
+                    print(f"Keyword search failed, using vector results only: {e}")
+                    keyword_hits.append([])
+            # Keyword matches and the stored vectors of every candidate (for
+            # MMR) in one lookup, so candidates are never embedded again
+            candidate_ids = sorted(
+                {chunk_id for hits in keyword_hits for chunk_id in hits}
+                | {doc.id for hits in vector_hits for doc in hits if doc.id}
+            )
+            found = (
+                shared.vector_store.get(ids=candidate_ids, include=["documents", "metadatas", "embeddings"])
+                if candidate_ids else {"ids": [], "documents": [], "metadatas": [], "embeddings": []}
+            )
+        
+        docs: Dict[str, "Document"] = {key(doc.metadata): doc for hits in vector_hits for doc in hits}
+        keyword_keys: Dict[str, str] = {}
+        stored_vectors: Dict[str, Any] = {}
+        embeddings = found.get("embeddings")
+        if embeddings is None:
+            embeddings = [None] * len(found["ids"])
+        for chunk_id, text, metadata, vector in zip(found["ids"], found["documents"], found["metadatas"], embeddings):
+            metadata = metadata or {}
+            keyword_keys[chunk_id] = key(metadata)
+            if vector is not None:
+                stored_vectors[key(metadata)] = vector
+            docs.setdefault(key(metadata), Document(id=chunk_id, page_content=text, metadata=metadata))
+        
+        # Chunk embeddings for MMR; only chunks returned without an ID are embedded again
+        doc_keys = list(docs)
+        missing = [doc_key for doc_key in doc_keys if doc_key not in stored_vectors]
+        if missing:
+            for doc_key, vector in zip(missing, self.vector_store_embeddings.embed_documents(
+                    [docs[doc_key].page_content for doc_key in missing])):
+                stored_vectors[doc_key] = vector
+        doc_vectors = np.asarray([stored_vectors[doc_key] for doc_key in doc_keys], dtype=np.float32)
+        rows = {doc_key: row for row, doc_key in enumerate(doc_keys)}
+        
+        for query, hits, keyword_ranking in zip(pending, vector_hits, keyword_hits):
+            fused = _reciprocal_rank_fusion([
+                [key(doc.metadata) for doc in hits],
+                [keyword_keys[chunk_id] for chunk_id in keyword_ranking if chunk_id in keyword_keys],
+            ])
+            passages = self._select_passages(
+                [docs[doc_key] for doc_key, _ in fused],
+                [score for _, score in fused],
+                doc_vectors[[rows[doc_key] for doc_key, _ in fused]],
+                k,
+            )
+            RETRIEVAL_CACHE.put((*kb_key, query, k, filter_key), tuple(passages))
+            results[query] = passages
+        return [list(results[query]) for query in queries]
+    
+    def _embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """Embed search queries in one call, reusing vectors from the process-wide query embedding cache."""
+        signature = self._embedding_signature()
+        vectors = {query: QUERY_EMBEDDING_CACHE.get((signature, query)) for query in queries}
+        missing = [query for query, vector in vectors.items() if vector is None]
+        if missing:
+            for query, vector in zip(missing, self.vector_store_embeddings.embed_queries(missing)):
+                QUERY_EMBEDDING_CACHE.put((signature, query), vector)
+                vectors[query] = vector
+        return [vectors[query] for query in queries]
+    
+    def _select_passages(self, docs: List["Document"], scores: List[float], vectors, k: int) -> List["Document"]:
+        """
+        Turn ranked candidate chunks into at most ``k`` chunks' worth of distinct passages.
+        
+        Neighbouring chunks are merged so the splitter overlap is sent only
+        once, then passages are picked with MMR, using the chunk embeddings
+        to skip near-duplicates of passages already selected.
+        
+        Args:
+            docs: Candidate chunks, best first
+            scores: Relevance score of each candidate
+            vectors: Embedding of each candidate, one row per chunk
+            k: Chunk budget
+            
+        Returns:
+            Selected passages, best first
+        """
+        if not docs:
+            return []
+        max_overlap = max(CHUNK_OVERLAP, *CHUNK_OVERLAP_BY_TYPE.values())
+        passages, passage_scores, members = _merge_adjacent_chunks(docs, scores, max_overlap, k)
+        
+        import numpy as np
+        
+        passage_vectors = np.stack([vectors[group].mean(axis=0) for group in members])
+        norms = np.linalg.norm(passage_vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        selected = _mmr_select(passage_scores, passage_vectors / norms, [len(group) for group in members], k)
+        return [passages[i] for i in selected]
+    
+    def _retrieve_html_fragments(self, queries: List[str]) -> List[List["Document"]]:
+        """
+        Retrieve the fragments of the page under test most relevant to each query.
+        
+        The best matching DOM segments are returned as packing candidates, so
+        prompt size does not grow with the page. Falls back to this session's
+        raw HTML as a single fragment if the page has not been indexed yet.
+        
+        Args:
+            queries: Texts describing what the fragments should cover
+            
+        Returns:
+            Fragments for each query, best first; empty if no HTML is available
+        """
+        from langchain_core.documents import Document
+        
+        results = self._hybrid_search_many(queries, k=CONTEXT_CANDIDATE_K, search_filter={"source": HTML_SOURCE})
+        return [
+            fragments or ([Document(page_content=self.html_content, metadata={"source": HTML_SOURCE})]
+                          if self.html_content else [])
+            for fragments in results
+        ]
     
     def _clean_json_response(self, text: str) -> str:
         """
@@ -302,49 +3887,73 @@ class QAAgentBackend:
         # If all strategies fail, raise the original error
         raise json.JSONDecodeError("Could not parse JSON with any strategy", response, 0)
     
-    def generate_test_cases(self, prompt: str) -> Dict[str, Any]:
+    def _open_knowledge_base(self, empty_result: Dict[str, Any]) -> Optional[Dict[str, Any]]:
+        """
+        Make sure the shared vector store handle is open on the live collection.
+        
+        The handle is opened once per process and knowledge base; it is only
+        reopened when a build in another process has replaced the collection.
+        
+        Args:
+            empty_result: Fields added to the error result, e.g. ``{"script": ""}``
+            
+        Returns:
+            An error result if there is no usable knowledge base, otherwise None
+        """
+        shared = self.shared_knowledge_base
+        version = self._knowledge_base_version()
+        if shared.vector_store is not None and shared.version == version:
+            return None
+        if not os.path.exists(self.persist_directory):
+            return {
+                "status": "error",
+                "message": "Knowledge base not found. Please build the knowledge base first.",
+                **empty_result
+            }
+        with shared.lock.write():
+            if shared.vector_store is not None and shared.version == version:
+                return None
+            manifest = self._load_manifest()
+            collection = manifest.get("collection") if manifest else None
+            if shared.vector_store is None or shared.collection != collection:
+                _close_vector_store(shared.vector_store)
+                shared.vector_store = None
+                try:
+                    shared.vector_store = self._open_vector_store(collection)
+                except Exception as load_err:
+                    error_msg = str(load_err).lower()
+                    if "dimension" in error_msg or "embedding" in error_msg:
+                        shutil.rmtree(self.persist_directory, ignore_errors=True)
+                        shared.vector_store = None
+                        return {
+                            "status": "error",
+                            "message": "Knowledge base embeddings are outdated. Please rebuild the knowledge base (Phase 1).",
+                            **empty_result
+                        }
+                    raise
+                shared.keyword_index = KeywordIndex(self._keyword_index_path(collection))
+                shared.collection = collection
+            shared.version = version
+        return None
+    
+    def generate_test_cases(self, prompt: str, sources: Optional[List[str]] = None) -> Dict[str, Any]:
         """
         Generate test cases using RAG pipeline based on the knowledge base.
         
         Args:
             prompt: User prompt describing what test cases to generate
+            sources: Restrict retrieval to these source documents (default: all)
             
         Returns:
             Dictionary with status, message, and generated test cases
         """
         try:
             # Check if knowledge base exists
-            if self.vector_store is None:
-                # Try to load existing vector store
-                if os.path.exists(self.persist_directory):
-                    try:
-                        self.vector_store = Chroma(
-                            persist_directory=self.persist_directory,
-                            embedding_function=self.embeddings,
-                        )
-                    except Exception as load_err:
-                        error_msg = str(load_err).lower()
-                        if "dimension" in error_msg or "embedding" in error_msg:
-                            import shutil
-                            shutil.rmtree(self.persist_directory, ignore_errors=True)
-                            return {
-                                "status": "error",
-                                "message": "Knowledge base embeddings are outdated. Please rebuild the knowledge base (Phase 1).",
-                                "test_cases": []
-                            }
-                        raise
-                else:
-                    return {
-                        "status": "error",
-                        "message": "Knowledge base not found. Please build the knowledge base first.",
-                        "test_cases": []
-                    }
+            error = self._open_knowledge_base({"test_cases": []})
+            if error:
+                return error
             
-            # Create retriever from vector store
-            retriever = self.vector_store.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": 5}  # Retrieve top 5 relevant chunks
-            )
+            source_filter = _source_filter(sources)
             
             # Create QA Engineer prompt template
             qa_prompt_template = """You are an expert QA Engineer tasked with generating comprehensive test cases based on the provided documentation and HTML content.
@@ -361,7 +3970,7 @@ class QAAgentBackend:
 **User Request:**
 {user_prompt}
 
-**HTML Content (if available):**
+**Relevant HTML Fragments of the Page (if available):**
 {html_content}
 
 **Instructions:**
@@ -417,6 +4026,7 @@ class QAAgentBackend:
 Generate the test cases now:"""
             
             # Create the prompt template
+            from langchain_core.prompts import PromptTemplate
             prompt_template = PromptTemplate(
                 template=qa_prompt_template,
                 input_variables=["context", "user_prompt", "html_content"]
@@ -424,19 +4034,22 @@ Generate the test cases now:"""
             
             # Create RAG chain
             def format_docs(docs):
-                return "\n\n".join([f"Document {i+1}:\n{doc.page_content}\nSource: {doc.metadata.get('source', 'unknown')}" 
+                return "\n\n".join([f"Document {i+1}:\n{doc.page_content}\nSource: {_format_source(doc.metadata)}" 
                                    for i, doc in enumerate(docs)])
             
-            # Get HTML content for context (if available)
-            html_context = self.html_content if self.html_content else "No HTML content available."
-            
-            # Create the RAG chain
-            def format_docs_wrapper(docs):
-                return format_docs(docs)
+            # Retrieve candidate documents and HTML fragments (if available)
+            candidate_docs = self._hybrid_search(prompt, k=CONTEXT_CANDIDATE_K, search_filter=source_filter)
+            candidate_fragments = self._retrieve_html_fragments([prompt])[0]
             
-            # Retrieve relevant documents
-            retrieved_docs = retriever.invoke(prompt)
+            # Pack the best of them into what the instructions leave of the
+            # token budget; documentation wins ties with the HTML
+            counter = self.prompt_token_counter
+            instructions = prompt_template.format(context="", user_prompt=prompt, html_content="")
+            retrieved_docs, html_fragments = _pack_context(
+                [candidate_docs, candidate_fragments], self.context_token_budget - counter.count(instructions), counter
+            )
             context = format_docs(retrieved_docs)
+            html_context = _format_html_fragments(html_fragments) or "No HTML content available."
             
             # Format the prompt with all variables
             formatted_prompt = prompt_template.format(
@@ -444,6 +4057,8 @@ Generate the test cases now:"""
                 user_prompt=prompt,
                 html_content=html_context
             )
+            prompt_tokens = self._log_prompt_size(formatted_prompt, retrieved_docs, html_fragments,
+                                                  len(candidate_docs) + len(candidate_fragments))
             
             # Invoke Gemini
             response = self._run_llm(formatted_prompt)
@@ -499,7 +4114,8 @@ Generate the test cases now:"""
                         "status": "error",
                         "message": f"Failed to parse JSON response from LLM: {str(e)}. Attempted multiple parsing strategies.",
                         "raw_response": response[:2000],  # Limit response length
-                        "test_cases": []
+                        "test_cases": [],
+                        "prompt_tokens": prompt_tokens
                     }
             
             # Extract test cases
@@ -519,7 +4135,8 @@ Generate the test cases now:"""
             return {
                 "status": "success",
                 "message": f"Generated {len(validated_test_cases)} test cases successfully.",
-                "test_cases": validated_test_cases
+                "test_cases": validated_test_cases,
+                "prompt_tokens": prompt_tokens
             }
             
         except Exception as e:
@@ -529,74 +4146,120 @@ Generate the test cases now:"""
                 "test_cases": []
             }
     
-    def generate_selenium_script(self, test_case: dict) -> Dict[str, Any]:
+    def _log_prompt_size(self, formatted_prompt: str, docs: List["Document"], fragments: List["Document"],
+                         candidates: int) -> int:
+        """
+        Count the tokens of a packed prompt and log what it is made of.
+        
+        Returns:
+            The prompt's token count
+        """
+        counter = self.prompt_token_counter
+        prompt_tokens = counter.count(formatted_prompt)
+        truncated = sum(1 for doc in docs + fragments if doc.metadata.get("truncated"))
+        print(
+            f"Prompt: {prompt_tokens} {'tokens' if counter.encoding is not None else 'tokens (estimated)'} "
+            f"of {self.context_token_budget} for {self.llm_model}; {len(docs)} document passage(s) and "
+            f"{len(fragments)} HTML fragment(s) packed from {candidates} candidates, {truncated} truncated"
+        )
+        return prompt_tokens
+    
+    def retrieve_script_contexts(self, test_cases: List[dict],
+                                 sources: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Retrieve the script generation context of several test cases at once.
+        
+        All search queries are embedded in one call and searched with one
+        batched top-k query per index, instead of one round trip per test case.
+        
+        Args:
+            test_cases: Test case dictionaries (Feature, Test_Scenario, Expected_Result, ...)
+            sources: Restrict retrieval to these source documents (default: all)
+            
+        Returns:
+            One dictionary per test case with the candidate ``html_fragments``
+            and ``documents``, best first, for packing into the prompt
+        """
+        if not test_cases:
+            return []
+        # Use Test_Scenario and Feature to create a search query
+        search_queries = [
+            f"{test_case.get('Feature', '')} {test_case.get('Test_Scenario', '')}" for test_case in test_cases
+        ]
+        # The HTML fragments the script has to interact with
+        html_fragments = self._retrieve_html_fragments([
+            f"{search_query} {test_case.get('Expected_Result', '')}"
+            for search_query, test_case in zip(search_queries, test_cases)
+        ])
+        # Relevant documentation
+        documents = self._hybrid_search_many(
+            search_queries, k=CONTEXT_CANDIDATE_K, search_filter=_source_filter(sources)
+        )
+        return [
+            {"html_fragments": fragments, "documents": docs}
+            for fragments, docs in zip(html_fragments, documents)
+        ]
+    
+    def generate_selenium_scripts(self, test_cases: List[dict],
+                                  sources: Optional[List[str]] = None) -> List[Dict[str, Any]]:
+        """
+        Generate Selenium scripts for several test cases, retrieving all their contexts in one pass.
+        
+        Args:
+            test_cases: Test case dictionaries
+            sources: Restrict retrieval to these source documents (default: all)
+            
+        Returns:
+            One ``generate_selenium_script`` result per test case, in order
+        """
+        try:
+            error = self._open_knowledge_base({"script": ""})
+            contexts = None if error else self.retrieve_script_contexts(test_cases, sources)
+        except Exception as e:
+            error = {"status": "error", "message": f"Error generating Selenium script: {str(e)}", "script": ""}
+        if error:
+            return [{**error, "test_case": test_case} for test_case in test_cases]
+        return [
+            self.generate_selenium_script(test_case, sources, context=context)
+            for test_case, context in zip(test_cases, contexts)
+        ]
+    
+    def generate_selenium_script(self, test_case: dict, sources: Optional[List[str]] = None,
+                                 context: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
         """
         Generate a runnable Python Selenium script for a given test case.
         
         Args:
             test_case: Dictionary containing test case information (Test_ID, Feature, Test_Scenario, Expected_Result, Grounded_In)
+            sources: Restrict retrieval to these source documents (default: all)
+            context: Context from ``retrieve_script_contexts``; retrieved here if omitted
             
         Returns:
             Dictionary with status, message, and generated script
         """
         try:
             # Check if knowledge base exists
-            if self.vector_store is None:
-                # Try to load existing vector store
-                if os.path.exists(self.persist_directory):
-                    try:
-                        self.vector_store = Chroma(
-                            persist_directory=self.persist_directory,
-                            embedding_function=self.embeddings,
-                        )
-                    except Exception as load_err:
-                        error_msg = str(load_err).lower()
-                        if "dimension" in error_msg or "embedding" in error_msg:
-                            import shutil
-                            shutil.rmtree(self.persist_directory, ignore_errors=True)
-                            return {
-                                "status": "error",
-                                "message": "Knowledge base embeddings are outdated. Please rebuild the knowledge base (Phase 1).",
-                                "script": ""
-                            }
-                        raise
-                else:
-                    return {
-                        "status": "error",
-                        "message": "Knowledge base not found. Please build the knowledge base first.",
-                        "script": ""
-                    }
+            error = self._open_knowledge_base({"script": ""})
+            if error:
+                return error
             
-            # Check if HTML content is available
-            if not self.html_content or len(self.html_content.strip()) == 0:
+            # Retrieve the HTML fragments and documentation chunks for the test case
+            if context is None:
+                context = self.retrieve_script_contexts([test_case], sources)[0]
+            if not context["html_fragments"]:
                 return {
                     "status": "error",
                     "message": "HTML content not found. Please upload HTML content in Phase 1 and rebuild the knowledge base.",
                     "script": ""
                 }
             
-            # Retrieve relevant documentation chunks based on test case
-            # Use Test_Scenario and Feature to create a search query
-            search_query = f"{test_case.get('Feature', '')} {test_case.get('Test_Scenario', '')}"
-            
-            # Create retriever from vector store
-            retriever = self.vector_store.as_retriever(
-                search_type="similarity",
-                search_kwargs={"k": 5}  # Retrieve top 5 relevant chunks
-            )
-            
-            # Retrieve relevant documentation
-            retrieved_docs = retriever.invoke(search_query)
-            
             # Format retrieved documentation
             def format_docs(docs):
                 return "\n\n".join([
-                    f"Document {i+1}:\n{doc.page_content}\nSource: {doc.metadata.get('source', 'unknown')}" 
+                    f"Document {i+1}:\n{doc.page_content}\nSource: {_format_source(doc.metadata)}" 
                     for i, doc in enumerate(docs)
                 ])
             
-            documentation_context = format_docs(retrieved_docs)
-            
             # Format test case as JSON for the prompt
             test_case_json = json.dumps(test_case, indent=2)
             
@@ -609,7 +4272,7 @@ Generate a complete, runnable Python Selenium script that automates the test cas
 **Test Case to Automate:**
 {test_case_json}
 
-**Full HTML Content (checkout.html):**
+**Relevant HTML Fragments of the Page Under Test:**
 {html_content}
 
 **Relevant Documentation Context:**
@@ -706,16 +4369,32 @@ finally:
 Generate the complete Selenium script now:"""
             
             # Create the prompt template
+            from langchain_core.prompts import PromptTemplate
             prompt_template = PromptTemplate(
                 template=selenium_prompt_template,
                 input_variables=["test_case_json", "html_content", "documentation_context"]
             )
             
+            # Pack the best fragments and documents into what the instructions
+            # leave of the token budget; the HTML wins ties, selectors come from it
+            counter = self.prompt_token_counter
+            instructions = prompt_template.format(test_case_json=test_case_json, html_content="",
+                                                  documentation_context="")
+            html_fragments, retrieved_docs = _pack_context(
+                [context["html_fragments"], context["documents"]],
+                self.context_token_budget - counter.count(instructions),
+                counter,
+            )
+            
             # Format the prompt
             formatted_prompt = prompt_template.format(
                 test_case_json=test_case_json,
-                html_content=self.html_content,
-                documentation_context=documentation_context
+                html_content=_format_html_fragments(html_fragments),
+                documentation_context=format_docs(retrieved_docs)
+            )
+            prompt_tokens = self._log_prompt_size(
+                formatted_prompt, retrieved_docs, html_fragments,
+                len(context["documents"]) + len(context["html_fragments"])
             )
             
             # Invoke Gemini to generate the script
@@ -762,7 +4441,8 @@ Generate the complete Selenium script now:"""
                 "status": "success",
                 "message": f"Selenium script generated successfully for {test_case.get('Test_ID', 'test case')}.",
                 "script": script,
-                "test_case": test_case
+                "test_case": test_case,
+                "prompt_tokens": prompt_tokens
             }
             
         except Exception as e:
@@ -772,3 +4452,178 @@ Generate the complete Selenium script now:"""
                 "script": "",
                 "test_case": test_case
             }
+
+
+class IngestionJob:
+    """State of one background knowledge base build."""
+    
+    def __init__(self, job_id: str):
+        self.job_id = job_id
+        self.status = "queued"
+        self.events: List[Dict[str, Any]] = []
+        self.result: Optional[Dict[str, Any]] = None
+        self.created_at = time.time()
+        self.finished_at: Optional[float] = None
+        self.cancel_requested = threading.Event()
+        self._lock = threading.Lock()
+    
+    def start(self) -> bool:
+        """Mark the job as running, unless it was cancelled while queued."""
+        with self._lock:
+            if self.cancel_requested.is_set():
+                return False
+            self.status = "running"
+            return True
+    
+    def record(self, event: Dict[str, Any]) -> None:
+        with self._lock:
+            self.events.append(event)
+    
+    def finish(self, status: str, result: Dict[str, Any]) -> None:
+        with self._lock:
+            self.status = status
+            self.result = result
+            self.finished_at = time.time()
+    
+    @property
+    def done(self) -> bool:
+        return self.status in ("succeeded", "failed", "cancelled")
+    
+    def snapshot(self) -> Dict[str, Any]:
+        """Return a consistent copy of the job state, safe to read from another thread."""
+        with self._lock:
+            return {
+                "job_id": self.job_id,
+                "status": self.status,
+                "events": list(self.events),
+                "result": self.result,
+                "created_at": self.created_at,
+                "finished_at": self.finished_at,
+                "cancel_requested": self.cancel_requested.is_set(),
+            }
+
+
+class IngestionJobManager:
+    """
+    Runs knowledge base builds on background worker threads.
+    
+    Jobs are identified by an ID and can be polled with ``status`` and
+    cancelled with ``cancel``. Builds run one at a time by default because
+    they write to the same vector store; queued jobs wait their turn.
+    """
+    
+    def __init__(self, max_workers: int = 1, max_finished_jobs: int = 50):
+        from concurrent.futures import ThreadPoolExecutor
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="qa-ingest")
+        self._jobs: Dict[str, IngestionJob] = {}
+        self._lock = threading.Lock()
+        self._max_finished_jobs = max_finished_jobs
+    
+    def submit(self, backend: "QAAgentBackend", support_docs_paths: List[SupportDocument], html_content: str,
+               rebuild: bool = False, on_finish: Optional[Callable[[IngestionJob], None]] = None) -> str:
+        """
+        Queue a knowledge base build.
+        
+        Args:
+            backend: Backend whose knowledge base is built
+            support_docs_paths: List of support document paths or in-memory DocumentSource objects
+            html_content: HTML content string
+            rebuild: Discard the existing index and re-embed everything
+            on_finish: Optional function called with the job once it ends (e.g. temp file cleanup)
+            
+        Returns:
+            The job ID
+        """
+        import uuid
+        job = IngestionJob(uuid.uuid4().hex)
+        with self._lock:
+            self._prune_finished()
+            self._jobs[job.job_id] = job
+        self._executor.submit(self._run, job, backend, support_docs_paths, html_content, rebuild, on_finish)
+        return job.job_id
+    
+    def status(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """Return a snapshot of a job, or None if the ID is unknown."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+        return job.snapshot() if job else None
+    
+    def cancel(self, job_id: str) -> bool:
+        """
+        Request cancellation of a job.
+        
+        A queued job never starts. A running build stops at its next progress
+        event or embedding request, whichever comes first, and retry waits
+        are cut short, so it normally stops within one embedding request
+        (seconds; at most the client's request timeout). A document being
+        parsed inline is finished first, and one being parsed in the process
+        pool within ``QA_PARSE_TIMEOUT``. Documents already indexed are
+        kept and skipped by the next build; those of a full rebuild are kept
+        in its new collection, which the next full build continues.
+        
+        Returns:
+            True if the job exists and had not finished yet
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None or job.done:
+                return False
+            job.cancel_requested.set()
+        return True
+    
+    def _run(self, job: IngestionJob, backend: "QAAgentBackend", support_docs_paths: List[SupportDocument],
+             html_content: str, rebuild: bool, on_finish: Optional[Callable[[IngestionJob], None]]) -> None:
+        try:
+            # Under the manager lock, so a cancel sees either a queued or a running job
+            with self._lock:
+                started = job.start()
+            if not started:
+                job.finish("cancelled", {"status": "error", "message": "Knowledge base build was cancelled."})
+                return
+            result = None
+            events = backend.iter_ingest_documents(
+                support_docs_paths, html_content, rebuild, cancel=job.cancel_requested
+            )
+            try:
+                for event in events:
+                    job.record(event)
+                    if event["stage"] == "done":
+                        result = event["result"]
+                    elif job.cancel_requested.is_set():
+                        break
+            finally:
+                # Closing the generator runs its cleanup (spool files, parse cache eviction)
+                events.close()
+            if result is None or (job.cancel_requested.is_set() and result["status"] != "success"):
+                job.finish("cancelled", {"status": "error", "message": "Knowledge base build was cancelled."})
+            else:
+                job.finish("succeeded" if result["status"] == "success" else "failed", result)
+        except Exception as e:
+            job.finish("failed", {"status": "error", "message": f"Error building knowledge base: {str(e)}"})
+        finally:
+            if on_finish:
+                try:
+                    on_finish(job)
+                except Exception as e:
+                    print(f"Warning: Ingestion job cleanup failed: {str(e)}")
+    
+    def _prune_finished(self) -> None:
+        """Forget the oldest finished jobs beyond ``max_finished_jobs``."""
+        finished = sorted((job for job in self._jobs.values() if job.done), key=lambda job: job.created_at)
+        for job in finished[:max(0, len(finished) - self._max_finished_jobs)]:
+            del self._jobs[job.job_id]
+
+
+_ingestion_job_manager: Optional[IngestionJobManager] = None
+_ingestion_job_manager_lock = threading.Lock()
+
+
+def get_ingestion_job_manager() -> IngestionJobManager:
+    """Return the process-wide ingestion job manager shared by all sessions."""
+    global _ingestion_job_manager
+    with _ingestion_job_manager_lock:
+        if _ingestion_job_manager is None:
+            _ingestion_job_manager = IngestionJobManager(
+                max_workers=int(os.getenv("QA_INGEST_JOB_WORKERS", "1"))
+            )
+        return _ingestion_job_manager
@@ -0,0 +1,87 @@
+"""
+Startup-time benchmark for the QA Agent backend.
+
+Measures, in fresh interpreters, how long ``import backend`` and
+``QAAgentBackend()`` take, which is what every Streamlit process start pays.
+Results are printed and appended as a JSON line to benchmarks/results.jsonl.
+
+Usage:
+    python benchmarks/bench_startup.py [--runs 5] [--max-seconds 1.0]
+"""
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+RESULTS_FILE = Path(__file__).resolve().parent / "results.jsonl"
+
+# Runs in a child interpreter so every measurement is a true cold start
+PROBE = """
+import json, os, time
+os.environ.setdefault("OPENAI_API_KEY", "sk-benchmark")
+start = time.perf_counter()
+import backend
+imported = time.perf_counter()
+backend.QAAgentBackend()
+constructed = time.perf_counter()
+print(json.dumps({"import_s": imported - start, "init_s": constructed - imported}))
+"""
+
+
+def run_probe() -> dict:
+    """Run one cold-start measurement in a fresh interpreter."""
+    wall_start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    wall = time.perf_counter() - wall_start
+    sample = json.loads(output.strip().splitlines()[-1])
+    sample["process_s"] = wall
+    return sample
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Measure backend cold-start time.")
+    parser.add_argument("--runs", type=int, default=5, help="number of cold starts to measure")
+    parser.add_argument("--max-seconds", type=float, default=None,
+                        help="exit non-zero if the median import + init time exceeds this")
+    args = parser.parse_args()
+
+    samples = [run_probe() for _ in range(args.runs)]
+    result = {
+        "benchmark": "startup",
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "runs": args.runs,
+        "import_s": statistics.median(s["import_s"] for s in samples),
+        "init_s": statistics.median(s["init_s"] for s in samples),
+        "process_s": statistics.median(s["process_s"] for s in samples),
+    }
+    result["total_s"] = result["import_s"] + result["init_s"]
+
+    print(f"import backend:   {result['import_s'] * 1000:8.1f} ms")
+    print(f"QAAgentBackend(): {result['init_s'] * 1000:8.1f} ms")
+    print(f"total:            {result['total_s'] * 1000:8.1f} ms  (median of {args.runs})")
+    print(f"interpreter wall: {result['process_s'] * 1000:8.1f} ms")
+
+    with open(RESULTS_FILE, "a", encoding="utf-8") as f:
+        f.write(json.dumps(result) + "\n")
+
+    if args.max_seconds is not None and result["total_s"] > args.max_seconds:
+        print(f"FAIL: cold start {result['total_s']:.3f}s exceeds {args.max_seconds:.3f}s")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,209 @@
+"""
+Vector store benchmark for the QA Agent backend: Chroma vs. the NumPy store.
+
+Builds both stores from the same synthetic chunks (random unit vectors, so
+no embedding API is involved) in ingestion-sized batches, timing the first
+and the last batches to show whether adding to a store slows down as it
+grows, and then re-ingests batches of existing chunks (delete and add, as an
+incremental build does for a changed document). It then measures in fresh
+interpreters how long opening each store and answering the first query take,
+steady-state query latency with the filter the backend uses for retrieval,
+and the memory the store adds to the process. Results are printed and
+appended as JSON lines to benchmarks/results.jsonl.
+
+Usage:
+    python benchmarks/bench_vector_store.py [--chunks 5000] [--dims 1536] [--queries 200]
+                                            [--batch-size 128] [--reingest-batches 20]
+"""
+import argparse
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+RESULTS_FILE = Path(__file__).resolve().parent / "results.jsonl"
+
+# Runs in a child interpreter so load time and memory are measured from a cold start
+PROBE = """
+import json, resource, statistics, sys, time
+import numpy as np
+kind, directory, dims, queries = sys.argv[1], sys.argv[2], int(sys.argv[3]), int(sys.argv[4])
+
+def rss_mb():
+    # Current resident set size (Linux); peak RSS elsewhere
+    try:
+        with open("/proc/self/status") as status:
+            for line in status:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+class NoEmbeddings:
+    def embed_documents(self, texts):
+        raise RuntimeError("not used")
+    def embed_query(self, text):
+        raise RuntimeError("not used")
+
+rng = np.random.default_rng(1)
+vectors = rng.standard_normal((queries, dims)).astype(np.float32)
+vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+vectors = vectors.tolist()
+search_filter = {"source": {"$ne": "page-under-test.html"}}
+
+if kind == "numpy":
+    from numpy_store import NumpyVectorStore
+else:
+    from langchain_community.vectorstores import Chroma
+baseline_mb = rss_mb()
+
+start = time.perf_counter()
+if kind == "numpy":
+    store = NumpyVectorStore(persist_directory=directory, embedding_function=NoEmbeddings())
+else:
+    store = Chroma(persist_directory=directory, embedding_function=NoEmbeddings())
+opened = time.perf_counter()
+store.similarity_search_by_vector(vectors[0], k=5, filter=search_filter)
+first_query = time.perf_counter()
+
+latencies = []
+for vector in vectors:
+    query_start = time.perf_counter()
+    store.similarity_search_by_vector(vector, k=5, filter=search_filter)
+    latencies.append(time.perf_counter() - query_start)
+latencies.sort()
+print(json.dumps({
+    "open_s": opened - start,
+    "first_query_s": first_query - opened,
+    "query_p50_ms": statistics.median(latencies) * 1000,
+    "query_p95_ms": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+    "memory_mb": rss_mb() - baseline_mb,
+}))
+"""
+
+
+class PrecomputedEmbeddings:
+    """Returns the vector stored for each synthetic chunk text."""
+
+    def __init__(self, vectors):
+        self.vectors = vectors
+
+    def embed_documents(self, texts):
+        return [self.vectors[int(text.split()[1])].tolist() for text in texts]
+
+    def embed_query(self, text):
+        raise RuntimeError("not used")
+
+
+def add_batch(store, first: int, last: int) -> float:
+    """Add (or replace) synthetic chunks ``first`` to ``last - 1``; returns the seconds taken."""
+    numbers = range(first, last)
+    start = time.perf_counter()
+    store.add_texts(
+        [f"chunk {number} " + "lorem ipsum " * 60 for number in numbers],
+        metadatas=[{"source": f"doc{number % 50}.md", "chunk_index": number} for number in numbers],
+        ids=[f"chunk-{number}" for number in numbers],
+    )
+    return time.perf_counter() - start
+
+
+def build_store(kind: str, directory: str, vectors: np.ndarray, batch_size: int, reingest_batches: int) -> dict:
+    """
+    Add every synthetic chunk in ingestion-sized batches, then re-ingest batches of them.
+
+    Returns:
+        Build time, median time of the first and last few batches, and median
+        time to re-ingest a batch of existing chunks
+    """
+    sys.path.insert(0, str(REPO_ROOT))
+    embeddings = PrecomputedEmbeddings(vectors)
+    if kind == "numpy":
+        from numpy_store import NumpyVectorStore
+        store = NumpyVectorStore(persist_directory=directory, embedding_function=embeddings)
+    else:
+        from langchain_community.vectorstores import Chroma
+        store = Chroma(persist_directory=directory, embedding_function=embeddings)
+    batch_seconds = [
+        add_batch(store, first, min(first + batch_size, len(vectors)))
+        for first in range(0, len(vectors), batch_size)
+    ]
+    rng = np.random.default_rng(2)
+    reingest_seconds = []
+    for _ in range(reingest_batches):
+        first = int(rng.integers(0, max(1, len(vectors) - batch_size)))
+        last = min(first + batch_size, len(vectors))
+        start = time.perf_counter()
+        store.delete(ids=[f"chunk-{number}" for number in range(first, last)])
+        reingest_seconds.append(time.perf_counter() - start + add_batch(store, first, last))
+    edge = max(1, min(5, len(batch_seconds) // 2))
+    return {
+        "build_s": sum(batch_seconds),
+        "first_batches_ms": statistics.median(batch_seconds[:edge]) * 1000,
+        "last_batches_ms": statistics.median(batch_seconds[-edge:]) * 1000,
+        "reingest_batch_ms": statistics.median(reingest_seconds) * 1000 if reingest_seconds else 0.0,
+    }
+
+
+def run_probe(kind: str, directory: str, dims: int, queries: int) -> dict:
+    output = subprocess.run(
+        [sys.executable, "-c", PROBE, kind, directory, str(dims), str(queries)],
+        cwd=REPO_ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Compare the Chroma and NumPy vector stores.")
+    parser.add_argument("--chunks", type=int, default=5000, help="number of chunks in each store")
+    parser.add_argument("--dims", type=int, default=1536, help="embedding dimensions")
+    parser.add_argument("--queries", type=int, default=200, help="queries per latency measurement")
+    parser.add_argument("--batch-size", type=int, default=128, help="chunks per add, as in ingestion")
+    parser.add_argument("--reingest-batches", type=int, default=20,
+                        help="batches of existing chunks to delete and add again after the build")
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(0)
+    vectors = rng.standard_normal((args.chunks, args.dims)).astype(np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    with tempfile.TemporaryDirectory(prefix="qa_bench_") as workdir:
+        for kind in ("chroma", "numpy"):
+            directory = str(Path(workdir) / kind)
+            build = build_store(kind, directory, vectors, args.batch_size, args.reingest_batches)
+            result = {
+                "benchmark": "vector_store",
+                "store": kind,
+                "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+                "python": platform.python_version(),
+                "chunks": args.chunks,
+                "dims": args.dims,
+                "queries": args.queries,
+                "batch_size": args.batch_size,
+                **build,
+                **run_probe(kind, directory, args.dims, args.queries),
+            }
+            print(
+                f"{kind:>6}: build {result['build_s']:7.2f} s (batch {result['first_batches_ms']:6.1f} ms first, "
+                f"{result['last_batches_ms']:6.1f} ms last, re-ingest {result['reingest_batch_ms']:6.1f} ms) | open {result['open_s'] * 1000:7.1f} ms | "
+                f"first query {result['first_query_s'] * 1000:7.1f} ms | "
+                f"query p50 {result['query_p50_ms']:6.2f} ms, p95 {result['query_p95_ms']:6.2f} ms | "
+                f"memory +{result['memory_mb']:6.1f} MB"
+            )
+            with open(RESULTS_FILE, "a", encoding="utf-8") as f:
+                f.write(json.dumps(result) + "\n")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
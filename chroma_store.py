@@ -0,0 +1,85 @@
+"""
+Chroma vector store for the QA Agent knowledge base.
+
+The default store (QA_VECTOR_STORE=chroma). ``ChromaVectorStore`` is
+LangChain's Chroma integration opened on a chromadb client created here. The
+store keeps that client and the chromadb ``Collection`` it serves, so the
+backend reaches what the integration does not expose through chromadb's
+public API instead of the integration's private attributes.
+"""
+import os
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import chromadb
+from langchain_community.vectorstores import Chroma
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+
+# Collection LangChain uses when none is named; knowledge bases built with
+# the default collection keep it
+DEFAULT_COLLECTION_NAME = "langchain"
+
+
+class ChromaVectorStore(Chroma):
+    """
+    LangChain Chroma store that owns its persistent chromadb client.
+
+    Adds the parts of the NumpyVectorStore interface the backend relies on:
+    ``update_metadata`` to refresh metadata without re-embedding,
+    ``add_embeddings`` to add texts embedded beforehand,
+    ``similarity_search_by_vectors`` for batched top-k queries and ``close``.
+    """
+
+    def __init__(self, persist_directory: str, embedding_function: Embeddings,
+                 collection_name: str = DEFAULT_COLLECTION_NAME):
+        # Chroma shares one system per persist directory string; an absolute path
+        # keeps every handle on a directory on the same system
+        persist_directory = os.path.abspath(persist_directory)
+        self.client = chromadb.PersistentClient(path=persist_directory)
+        super().__init__(
+            collection_name=collection_name,
+            embedding_function=embedding_function,
+            persist_directory=persist_directory,
+            client=self.client,
+        )
+        self.collection = self.client.get_collection(collection_name)
+
+    def close(self) -> None:
+        """Close the chromadb client; the directory's system stops once its last client is closed."""
+        self.client.close()
+
+    def update_metadata(self, ids: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        """Replace the metadata of stored chunks without re-embedding them."""
+        self.collection.update(ids=ids, metadatas=metadatas)
+
+    def add_embeddings(self, text_embeddings: Iterable[Tuple[str, List[float]]],
+                       metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None) -> List[str]:
+        """Add texts with their precomputed embeddings; existing IDs are replaced."""
+        text_embeddings = list(text_embeddings)
+        if not text_embeddings:
+            return []
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in text_embeddings]
+        self.collection.upsert(
+            ids=ids,
+            embeddings=[vector for _, vector in text_embeddings],
+            documents=[text for text, _ in text_embeddings],
+            metadatas=list(metadatas) if metadatas else None,
+        )
+        return ids
+
+    def similarity_search_by_vectors(self, embeddings: List[List[float]], k: int = 4,
+                                     filter: Optional[Dict[str, Any]] = None) -> List[List[Document]]:
+        """Find the ``k`` chunks most similar to each of several vectors in one query."""
+        if not embeddings:
+            return []
+        results = self.collection.query(
+            query_embeddings=embeddings, n_results=k, where=filter or None, include=["documents", "metadatas"]
+        )
+        return [
+            [
+                Document(id=chunk_id, page_content=text, metadata=metadata or {})
+                for chunk_id, text, metadata in zip(ids, texts, metadatas)
+            ]
+            for ids, texts, metadatas in zip(results["ids"], results["documents"], results["metadatas"])
+        ]
@@ -0,0 +1,269 @@
+"""
+Command-line ingestion for large support document corpora.
+
+Builds the same knowledge base as the Streamlit app from server-side
+directories, glob patterns and .zip / .tar(.gz|.bz2|.xz) archives, so big
+corpora can be indexed from CI or cron without a browser.
+
+Documents are ingested in batches. Archive members are read one at a time
+(tar archives as a stream) and never extracted to disk, and the next batch is
+read while the current one is parsed and embedded. Within a batch documents
+are parsed in parallel by the backend's process pool (QA_PARSE_WORKERS).
+Sources that are no longer part of the corpus are removed at the end.
+
+Usage:
+    python ingest_cli.py docs/ "specs/**/*.md" corpus.tar.gz [--html checkout.html] [--batch-size 64] [--rebuild]
+        [--knowledge-base NAME]
+"""
+import argparse
+import glob
+import itertools
+import os
+import queue
+import sys
+import tarfile
+import threading
+import time
+import zipfile
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+from backend import QAAgentBackend, DocumentSource, SupportDocument, HTML_SOURCE
+
+ARCHIVE_SUFFIXES = (".zip", ".tar", ".tar.gz", ".tgz", ".tar.bz2", ".tbz2", ".tar.xz", ".txz")
+
+
+def _is_archive(path: str) -> bool:
+    return path.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def _wanted(name: str, extensions: Optional[Set[str]]) -> bool:
+    """Skip hidden files and, if given, files with other extensions."""
+    if any(part.startswith(".") for part in Path(name).parts):
+        return False
+    return not extensions or Path(name).suffix.lower() in extensions
+
+
+def _iter_archive(archive_path: str, extensions: Optional[Set[str]]) -> Iterator[Tuple[str, SupportDocument]]:
+    """
+    Yield the members of an archive as in-memory documents named ``archive:member``.
+
+    Members are read lazily, one at a time; tar archives are read as a stream
+    so compressed tarballs are decompressed in a single pass.
+    """
+    prefix = Path(archive_path).name
+    if archive_path.lower().endswith(".zip"):
+        with zipfile.ZipFile(archive_path) as zf:
+            for info in zf.infolist():
+                name = f"{prefix}:{info.filename}"
+                if info.is_dir() or not _wanted(info.filename, extensions):
+                    continue
+                yield name, DocumentSource(info.filename, zf.read(info))
+    else:
+        with tarfile.open(archive_path, mode="r|*") as tf:
+            for member in tf:
+                name = f"{prefix}:{member.name}"
+                if not member.isfile() or not _wanted(member.name, extensions):
+                    continue
+                member_file = tf.extractfile(member)
+                yield name, DocumentSource(member.name, member_file.read())
+
+
+def iter_corpus(inputs: List[str], extensions: Optional[Set[str]] = None) -> Iterator[Tuple[str, SupportDocument]]:
+    """
+    Expand directories, glob patterns and archives into named documents.
+
+    Source names are paths relative to the given directory, paths as matched
+    by a glob pattern, or ``archive:member`` for archive members.
+
+    Args:
+        inputs: Directories, files, glob patterns or archives
+        extensions: Only include files with these extensions (e.g. {".md"})
+
+    Yields:
+        (source name, document) pairs; files are yielded as paths
+    """
+    for item in inputs:
+        if os.path.isdir(item):
+            for root, dirs, files in os.walk(item):
+                dirs.sort()
+                for file_name in sorted(files):
+                    file_path = os.path.join(root, file_name)
+                    name = Path(os.path.relpath(file_path, item)).as_posix()
+                    if _wanted(name, extensions):
+                        yield name, file_path
+        elif os.path.isfile(item) and _is_archive(item):
+            yield from _iter_archive(item, extensions)
+        else:
+            matches = sorted(glob.glob(item, recursive=True))
+            if not matches:
+                print(f"Warning: No files match {item}")
+            for file_path in matches:
+                if not os.path.isfile(file_path):
+                    continue
+                if _is_archive(file_path):
+                    yield from _iter_archive(file_path, extensions)
+                    continue
+                name = Path(os.path.normpath(file_path)).as_posix()
+                if _wanted(name, extensions):
+                    yield name, file_path
+
+
+def iter_batches(documents: Iterable[Tuple[str, SupportDocument]], batch_size: int,
+                 batch_bytes: int, seen: Set[str]) -> Iterator[Dict[str, SupportDocument]]:
+    """
+    Group named documents into batches of at most ``batch_size`` documents.
+
+    A batch is also closed once its in-memory documents reach ``batch_bytes``,
+    which bounds memory when reading archives. Names already in ``seen`` are
+    skipped with a warning; every new name is added to it.
+    """
+    batch: Dict[str, SupportDocument] = {}
+    held = 0
+    for name, document in documents:
+        if name in seen:
+            print(f"Warning: Skipping duplicate source name {name}")
+            continue
+        seen.add(name)
+        batch[name] = document
+        if isinstance(document, DocumentSource):
+            held += document.size
+        if len(batch) >= batch_size or held >= batch_bytes:
+            yield batch
+            batch, held = {}, 0
+    if batch:
+        yield batch
+
+
+def prefetch(items: Iterable, depth: int = 1) -> Iterator:
+    """Produce ``items`` on a background thread, up to ``depth`` ahead of the consumer."""
+    buffer: "queue.Queue" = queue.Queue(maxsize=depth)
+    done = object()
+    errors: List[BaseException] = []
+
+    def produce():
+        try:
+            for item in items:
+                buffer.put(item)
+        except BaseException as e:
+            errors.append(e)
+        finally:
+            buffer.put(done)
+
+    threading.Thread(target=produce, daemon=True).start()
+    while True:
+        item = buffer.get()
+        if item is done:
+            break
+        yield item
+    if errors:
+        raise errors[0]
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Build the QA Agent knowledge base from files on disk.")
+    parser.add_argument("inputs", nargs="+", help="directories, files, glob patterns or .zip/.tar(.gz) archives")
+    parser.add_argument("--html", default=None, help="HTML file of the page under test, indexed as DOM segments")
+    parser.add_argument("--batch-size", type=int, default=64, help="documents per ingestion batch (default: 64)")
+    parser.add_argument("--batch-mb", type=float, default=256,
+                        help="close a batch once its archive members hold this many MB (default: 256)")
+    parser.add_argument("--ext", default="",
+                        help="comma-separated extensions to include, e.g. .md,.pdf (default: all files)")
+    parser.add_argument("--knowledge-base", default=None,
+                        help="named knowledge base to build, created if missing (default: QA_KNOWLEDGE_BASE)")
+    parser.add_argument("--workers", type=int, default=None, help="parser processes (default: QA_PARSE_WORKERS)")
+    parser.add_argument("--rebuild", action="store_true", help="discard the existing index and re-embed everything")
+    parser.add_argument("--no-prune", action="store_true",
+                        help="keep indexed sources that are not part of the given inputs")
+    parser.add_argument("--quiet", action="store_true", help="only print batch summaries")
+    args = parser.parse_args()
+
+    extensions = {
+        ext if ext.startswith(".") else f".{ext}"
+        for ext in (e.strip().lower() for e in args.ext.split(",")) if ext
+    } or None
+
+    backend = QAAgentBackend()
+    if args.knowledge_base:
+        if not any(kb["name"] == args.knowledge_base for kb in backend.list_knowledge_bases()):
+            created = backend.create_knowledge_base(args.knowledge_base)
+            if created["status"] != "success":
+                print(f"FAIL: {created['message']}")
+                return 1
+        backend.select_knowledge_base(args.knowledge_base)
+    if args.workers is not None:
+        backend.parse_workers = args.workers
+
+    started = time.perf_counter()
+    totals = {"batches": 0, "failed_batches": 0, "sources_added": 0, "sources_updated": 0,
+              "sources_unchanged": 0, "sources_removed": 0, "chunks_embedded": 0,
+              "chunks_deleted": 0, "chunks_deduplicated": 0, "chunks_restored": 0, "embedding_cache_hits": 0,
+              "embedding_tokens": 0, "embedding_seconds": 0.0, "embedding_rate_limited": 0}
+
+    def on_progress(event):
+        if not args.quiet and event["stage"] == "indexed":
+            print(
+                f"  indexed {event['source']}: {event['chunks']} chunks, {event['embedded']} embedded, "
+                f"{event['deduplicated']} duplicates ({event['duration']:.1f}s)"
+            )
+
+    def ingest(documents: Iterable[Tuple[str, SupportDocument]], seen: Set[str], rebuild: bool) -> None:
+        """Ingest documents batch by batch."""
+        batches = iter_batches(documents, args.batch_size, int(args.batch_mb * 1024 * 1024), seen)
+        for batch in prefetch(batches):
+            totals["batches"] += 1
+            print(f"Batch {totals['batches']}: {len(batch)} document(s)")
+            result = backend.ingest_documents(
+                batch, "", rebuild=rebuild, progress_callback=on_progress, prune_missing=False
+            )
+            rebuild = False
+            for key, value in result.get("stats", {}).items():
+                if key in totals:
+                    totals[key] += value
+            if result["status"] != "success":
+                totals["failed_batches"] += 1
+                print(f"  {result['message']}")
+
+    def iter_documents() -> Iterator[Tuple[str, SupportDocument]]:
+        documents = iter_corpus(args.inputs, extensions)
+        if args.html:
+            with open(args.html, "rb") as f:
+                page = DocumentSource(HTML_SOURCE, f.read())
+            documents = itertools.chain([(HTML_SOURCE, page)], documents)
+        return documents
+
+    corpus: Set[str] = set()
+    ingest(iter_documents(), corpus, args.rebuild)
+
+    if not args.no_prune:
+        pruned = backend.prune_sources(corpus)
+        print(pruned["message"])
+        if pruned["status"] == "success":
+            totals["sources_removed"] += len(pruned["removed"])
+            totals["chunks_deleted"] += pruned["chunks_deleted"]
+            totals["chunks_restored"] += pruned["chunks_restored"]
+
+    elapsed = time.perf_counter() - started
+    print(
+        f"Ingested {len(corpus)} document(s) in {totals['batches']} batch(es) in {elapsed:.1f}s: "
+        f"{totals['sources_added']} added, {totals['sources_updated']} updated, "
+        f"{totals['sources_unchanged']} unchanged, {totals['sources_removed']} removed; "
+        f"{totals['chunks_embedded']} chunks embedded ({totals['embedding_cache_hits']} from cache), "
+        f"{totals['chunks_deleted']} removed, "
+        f"{totals['chunks_deduplicated']} duplicates skipped, "
+        f"{totals['chunks_restored']} restored after their copy was removed"
+    )
+    if totals["embedding_seconds"]:
+        print(
+            f"Embedding throughput: {totals['embedding_tokens'] / totals['embedding_seconds']:,.0f} tokens/s "
+            f"({totals['embedding_tokens']:,} tokens in {totals['embedding_seconds']:.1f}s, "
+            f"{totals['embedding_rate_limited']} rate-limited request(s))"
+        )
+    if totals["failed_batches"]:
+        print(f"FAIL: {totals['failed_batches']} batch(es) failed")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
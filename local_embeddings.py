@@ -0,0 +1,139 @@
+"""
+Local embedding engine for the QA Agent knowledge base.
+
+Embeds text on the CPU with NumPy, without network calls or API keys, so
+knowledge bases can be built in CI and air-gapped environments. Selected with
+QA_EMBEDDINGS_PROVIDER=local (see QAAgentBackend.embeddings).
+
+Vectors are hashed n-gram term frequencies: words, word bigrams and
+character trigrams are hashed into a fixed number of signed buckets
+("feature hashing"), weighted by sublinear term frequency and L2-normalized,
+so cosine similarity measures lexical overlap. No corpus statistics are
+used, which keeps every vector independent of the rest of the index: a chunk
+never has to be re-embedded because other documents changed.
+"""
+import re
+import zlib
+from typing import Dict, List, Tuple
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+# Bump when the features or weighting change; it is part of the embedding signature
+LOCAL_EMBEDDING_VERSION = 1
+
+DEFAULT_DIMENSIONS = 1024
+
+# Feature families and their weights: whole words carry most of the meaning,
+# bigrams add phrase order, character trigrams match inflections and typos
+WORD_WEIGHT = 1.0
+BIGRAM_WEIGHT = 0.7
+TRIGRAM_WEIGHT = 0.3
+
+TOKEN_RE = re.compile(r'\w+', re.UNICODE)
+
+# Texts embedded per NumPy pass
+BATCH_SIZE = 256
+
+# Word and trigram hashes are memoized per word; word frequencies are skewed,
+# so most lookups hit
+HASH_CACHE_SIZE = 200_000
+
+
+def local_embedding_signature(dimensions: int) -> str:
+    """Identify the local embedding space (feature set and dimensions)."""
+    return f"local:hashed-ngram-v{LOCAL_EMBEDDING_VERSION}:{dimensions}"
+
+
+def _feature_hash(feature: str) -> int:
+    return zlib.crc32(feature.encode('utf-8'))
+
+
+def _word_features(word: str) -> Tuple[List[int], List[float]]:
+    """Hashes and weights of a word and its character trigrams (with ``<``/``>`` word boundaries)."""
+    padded = f"<{word}>"
+    hashes = [_feature_hash(f"w:{word}")]
+    hashes.extend(_feature_hash(f"c:{padded[start:start + 3]}") for start in range(len(padded) - 2))
+    return hashes, [WORD_WEIGHT] + [TRIGRAM_WEIGHT] * (len(hashes) - 1)
+
+
+class HashedNgramEmbeddings(Embeddings):
+    """
+    CPU-only embeddings from hashed word, bigram and character n-grams.
+
+    Hashing uses CRC32 rather than ``hash()``, which is salted per process,
+    so vectors are identical across runs and machines.
+    """
+
+    def __init__(self, dimensions: int = DEFAULT_DIMENSIONS, batch_size: int = BATCH_SIZE):
+        if dimensions < 16:
+            raise ValueError("Local embeddings need at least 16 dimensions.")
+        self.dimensions = dimensions
+        self.batch_size = batch_size
+        self._hash_cache: Dict[str, Tuple[List[int], List[float]]] = {}
+
+    @property
+    def signature(self) -> str:
+        """Identify the embedding space (feature set and dimensions)."""
+        return local_embedding_signature(self.dimensions)
+
+    def _embed_batch(self, texts: List[str]) -> np.ndarray:
+        """
+        Embed a batch of texts as a ``(len(texts), dimensions)`` float32 matrix.
+
+        Features of the whole batch are hashed into flat (row, bucket, signed
+        weight) arrays and summed with a single ``bincount``.
+        """
+        if len(self._hash_cache) > HASH_CACHE_SIZE:
+            self._hash_cache.clear()
+        cache = self._hash_cache
+        row_sizes: List[int] = []
+        hashes: List[int] = []
+        weights: List[float] = []
+        for text in texts:
+            size = len(hashes)
+            words = TOKEN_RE.findall(text.lower())
+            for word in words:
+                features = cache.get(word)
+                if features is None:
+                    features = cache[word] = _word_features(word)
+                hashes.extend(features[0])
+                weights.extend(features[1])
+            hashes.extend(_feature_hash(f"b:{first} {second}") for first, second in zip(words, words[1:]))
+            weights.extend([BIGRAM_WEIGHT] * (len(hashes) - len(weights)))
+            row_sizes.append(len(hashes) - size)
+        rows = np.repeat(np.arange(len(texts), dtype=np.int64), row_sizes)
+
+        hashes_array = np.asarray(hashes, dtype=np.int64)
+        # The low bits pick the bucket, the top bit the sign, so collisions cancel out on average
+        buckets = hashes_array % self.dimensions
+        signs = np.where(hashes_array & 0x80000000, -1.0, 1.0)
+        flat = rows * self.dimensions + buckets
+        counts = np.bincount(
+            flat, weights=signs * np.asarray(weights), minlength=len(texts) * self.dimensions
+        ).reshape(len(texts), self.dimensions)
+
+        # Sublinear term frequency, then unit length for cosine similarity
+        vectors = np.sign(counts) * np.log1p(np.abs(counts))
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        norms[norms == 0] = 1.0
+        return (vectors / norms).astype(np.float32)
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """
+        Embed a list of documents.
+
+        Args:
+            texts: Texts to embed
+
+        Returns:
+            One vector per text
+        """
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), self.batch_size):
+            vectors.extend(self._embed_batch(texts[start:start + self.batch_size]).tolist())
+        return vectors
+
+    def embed_query(self, text: str) -> List[float]:
+        """Embed a search query."""
+        return self._embed_batch([text])[0].tolist()
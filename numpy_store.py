@@ -0,0 +1,514 @@
+"""
+NumPy vector store for the QA Agent knowledge base.
+
+A brute-force alternative to Chroma for small and medium knowledge bases (up
+to tens of thousands of chunks), selected with QA_VECTOR_STORE=numpy. At that
+size a vectorized scan of every chunk takes milliseconds, less than opening
+Chroma's persistent client. Queries compute all cosine similarities with one
+matrix-vector product over a memory-mapped float32 matrix and select the top
+k with ``argpartition``.
+
+Layout of the store directory:
+
+    index.json                 dimensions and the current generation's file
+                               names; rewritten only when a generation starts
+    vectors-<generation>.f32   unit-length float32 vectors, one row per chunk;
+                               rows are appended as chunks are added
+    log-<generation>.jsonl     append-only log of adds (IDs, texts, metadata
+                               and first vector row), deletes and metadata
+                               updates; replaying it rebuilds the index
+
+Every write appends to the two files, so building a store costs time
+proportional to what is added rather than to the size of the store. Rows,
+texts and metadata of deleted, replaced or updated chunks stay in the files
+until they outnumber the live chunks; the live chunks are then compacted into
+a new generation. Vectors are written before their log record, and a record
+only counts once its line is complete, so a crash never exposes a partial
+write. All store instances on a directory share a lock and replay the records
+another instance has appended since they last read the log.
+"""
+import json
+import os
+import threading
+import uuid
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+INDEX_FILENAME = "index.json"
+
+# Bump when the index layout changes; older stores are treated as empty
+INDEX_VERSION = 2
+
+# Stale rows and log records are compacted away once there are more of them than this and than live chunks
+COMPACT_MIN_DEAD_ROWS = 1024
+
+_DIRECTORY_LOCKS: Dict[str, threading.RLock] = {}
+_DIRECTORY_LOCKS_GUARD = threading.Lock()
+
+
+def _directory_lock(directory: str) -> threading.RLock:
+    """Lock shared by every store instance on ``directory`` in this process."""
+    key = os.path.realpath(directory)
+    with _DIRECTORY_LOCKS_GUARD:
+        return _DIRECTORY_LOCKS.setdefault(key, threading.RLock())
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    """Scale rows to unit length so that dot products are cosine similarities."""
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (vectors / norms).astype(np.float32)
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Persistent brute-force vector store backed by a memory-mapped float32 matrix.
+
+    Implements the parts of the Chroma interface the backend uses: ``get``
+    with ``where`` filters, ``delete``, ``add_documents``, similarity search
+    with metadata filters (``$eq``, ``$ne``, ``$in``, ``$nin``, ``$and``,
+    ``$or``) and ``delete_collection``, plus ``update_metadata`` to refresh
+    metadata without re-embedding, ``add_embeddings`` to add texts
+    embedded beforehand and ``close``.
+    """
+
+    def __init__(self, persist_directory: str, embedding_function: Embeddings):
+        self.persist_directory = persist_directory
+        self._embedding = embedding_function
+        self._lock = _directory_lock(persist_directory)
+        self._stamp: Optional[Tuple[int, int, int]] = None
+        self._clear()
+        with self._lock:
+            self._refresh()
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def _index_path(self) -> str:
+        return os.path.join(self.persist_directory, INDEX_FILENAME)
+
+    def _clear(self) -> None:
+        self._dimensions: Optional[int] = None
+        self._generation = 0
+        self._vectors_file: Optional[str] = None
+        self._log_file: Optional[str] = None
+        self._log_size = 0
+        self._stale = 0
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._metadatas: List[Dict[str, Any]] = []
+        self._rows = np.zeros(0, dtype=np.int64)
+        # Deleted and replaced chunks keep their position, marked dead, until compaction
+        self._live = np.zeros(0, dtype=bool)
+        self._positions: Dict[str, int] = {}
+        self._matrix_cache: Optional[np.ndarray] = None
+        self._columns: Dict[str, np.ndarray] = {}
+
+    def _index_stamp(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self._index_path())
+        except FileNotFoundError:
+            return None
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _refresh(self) -> None:
+        """Reload the index if a new generation started, or replay records appended since the log was last read."""
+        stamp = self._index_stamp()
+        if stamp != self._stamp:
+            self._clear()
+            self._stamp = stamp
+            if stamp is None:
+                return
+            with open(self._index_path(), 'r', encoding='utf-8') as f:
+                index = json.load(f)
+            if index.get("version") != INDEX_VERSION:
+                return
+            self._dimensions = index["dimensions"]
+            self._generation = index["generation"]
+            self._vectors_file = index["vectors_file"]
+            self._log_file = index["log_file"]
+        if self._log_file is None:
+            return
+        try:
+            with open(self._log_path(), 'rb') as f:
+                f.seek(self._log_size)
+                appended = f.read()
+        except FileNotFoundError:
+            return
+        # A line without its newline is a write still in progress (or interrupted)
+        complete = appended[:appended.rfind(b"\n") + 1]
+        for line in complete.splitlines():
+            self._apply(json.loads(line))
+        self._log_size += len(complete)
+
+    def _save_index(self) -> None:
+        """Atomically write index.json for the current generation and remember its stamp."""
+        os.makedirs(self.persist_directory, exist_ok=True)
+        index = {
+            "version": INDEX_VERSION,
+            "dimensions": self._dimensions,
+            "generation": self._generation,
+            "vectors_file": self._vectors_file,
+            "log_file": self._log_file,
+        }
+        tmp_path = self._index_path() + ".tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(index, f)
+        os.replace(tmp_path, self._index_path())
+        self._stamp = self._index_stamp()
+
+    def _log_path(self) -> str:
+        return os.path.join(self.persist_directory, self._log_file)
+
+    def _append(self, record: Dict[str, Any]) -> None:
+        """Append a record to the log, then apply it to the in-memory index."""
+        with open(self._log_path(), 'ab') as f:
+            # Drop a partial record left behind by an interrupted write
+            f.truncate(self._log_size)
+            f.write((json.dumps(record, ensure_ascii=False) + "\n").encode('utf-8'))
+            self._log_size = f.tell()
+        self._apply(record)
+
+    def _apply(self, record: Dict[str, Any]) -> None:
+        """Apply a log record to the in-memory index."""
+        ids = record["ids"]
+        if record["op"] == "update":
+            for chunk_id, metadata in zip(ids, record["metadatas"]):
+                position = self._positions.get(chunk_id)
+                if position is not None:
+                    self._metadatas[position] = metadata
+                    self._stale += 1
+        else:
+            self._remove_positions(self._positions[chunk_id] for chunk_id in ids if chunk_id in self._positions)
+        if record["op"] == "add":
+            first_position = len(self._ids)
+            self._ids.extend(ids)
+            self._texts.extend(record["texts"])
+            self._metadatas.extend(record["metadatas"])
+            first_row = record["first_row"]
+            self._rows = np.concatenate([self._rows, np.arange(first_row, first_row + len(ids), dtype=np.int64)])
+            self._live = np.concatenate([self._live, np.ones(len(ids), dtype=bool)])
+            self._positions.update((chunk_id, first_position + offset) for offset, chunk_id in enumerate(ids))
+        self._columns = {}
+
+    def _vectors_path(self) -> str:
+        return os.path.join(self.persist_directory, self._vectors_file)
+
+    def _row_count(self) -> int:
+        """Number of complete rows in the vectors file."""
+        try:
+            return os.path.getsize(self._vectors_path()) // (4 * self._dimensions)
+        except (OSError, TypeError):
+            return 0
+
+    def _matrix(self) -> np.ndarray:
+        """The vectors file as a read-only memory-mapped ``(rows, dimensions)`` matrix."""
+        rows = self._row_count()
+        if self._matrix_cache is None or self._matrix_cache.shape[0] != rows:
+            if rows == 0:
+                self._matrix_cache = np.zeros((0, self._dimensions or 0), dtype=np.float32)
+            else:
+                self._matrix_cache = np.memmap(
+                    self._vectors_path(), dtype=np.float32, mode='r', shape=(rows, self._dimensions)
+                )
+        return self._matrix_cache
+
+    def _column(self, key: str) -> np.ndarray:
+        """Metadata values of ``key`` for every chunk, for vectorized filtering."""
+        column = self._columns.get(key)
+        if column is None:
+            column = np.empty(len(self._metadatas), dtype=object)
+            column[:] = [metadata.get(key) for metadata in self._metadatas]
+            self._columns[key] = column
+        return column
+
+    def _where_mask(self, where: Dict[str, Any]) -> np.ndarray:
+        """Boolean mask of the live chunks matching a Chroma-style ``where`` filter."""
+        mask = self._live.copy()
+        for key, condition in where.items():
+            if key in ("$and", "$or"):
+                masks = [self._where_mask(clause) for clause in condition]
+                combine = np.logical_and if key == "$and" else np.logical_or
+                mask &= combine.reduce(masks) if masks else key == "$and"
+                continue
+            column = self._column(key)
+            if not isinstance(condition, dict):
+                condition = {"$eq": condition}
+            for operator, value in condition.items():
+                if operator == "$eq":
+                    mask &= column == value
+                elif operator == "$ne":
+                    mask &= column != value
+                elif operator in ("$in", "$nin"):
+                    values = set(value)
+                    found = np.fromiter((item in values for item in column), dtype=bool, count=len(column))
+                    mask &= found if operator == "$in" else ~found
+                else:
+                    raise ValueError(f"Unsupported filter operator {operator!r}")
+        return mask
+
+    def _remove_positions(self, positions: Iterable[int]) -> None:
+        """Mark chunks dead; they and their vector rows are dropped at the next compaction."""
+        for position in positions:
+            self._live[position] = False
+            del self._positions[self._ids[position]]
+            self._stale += 1
+
+    def _compact(self) -> None:
+        """Rewrite the live chunks into a new generation once stale rows and records outnumber them."""
+        if self._stale <= max(COMPACT_MIN_DEAD_ROWS, len(self._positions)):
+            return
+        old_paths = [self._vectors_path(), self._log_path()]
+        keep = np.flatnonzero(self._live)
+        live = np.asarray(self._matrix()[self._rows[keep]])
+        self._ids = [self._ids[position] for position in keep]
+        self._texts = [self._texts[position] for position in keep]
+        self._metadatas = [self._metadatas[position] for position in keep]
+        self._generation += 1
+        self._vectors_file = f"vectors-{self._generation}.f32"
+        self._log_file = f"log-{self._generation}.jsonl"
+        with open(self._vectors_path(), 'wb') as f:
+            f.write(live.tobytes())
+        snapshot = {"op": "add", "ids": self._ids, "texts": self._texts, "metadatas": self._metadatas, "first_row": 0}
+        with open(self._log_path(), 'wb') as f:
+            f.write((json.dumps(snapshot, ensure_ascii=False) + "\n").encode('utf-8'))
+            self._log_size = f.tell()
+        self._rows = np.arange(len(self._ids), dtype=np.int64)
+        self._live = np.ones(len(self._ids), dtype=bool)
+        self._positions = {chunk_id: position for position, chunk_id in enumerate(self._ids)}
+        self._stale = 0
+        self._matrix_cache = None
+        self._columns = {}
+        # The new generation becomes visible to other instances here
+        self._save_index()
+        for path in old_paths:
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        """
+        Embed and add texts; existing IDs are replaced.
+
+        Returns:
+            IDs of the added texts
+        """
+        texts = list(texts)
+        if not texts:
+            return []
+        return self.add_embeddings(zip(texts, self._embedding.embed_documents(texts)), metadatas, ids)
+
+    def add_embeddings(self, text_embeddings: Iterable[Tuple[str, List[float]]],
+                       metadatas: Optional[List[dict]] = None, ids: Optional[List[str]] = None,
+                       **kwargs: Any) -> List[str]:
+        """
+        Add texts with their precomputed embeddings; existing IDs are replaced.
+
+        Returns:
+            IDs of the added texts
+        """
+        text_embeddings = list(text_embeddings)
+        if not text_embeddings:
+            return []
+        texts = [text for text, _ in text_embeddings]
+        ids = list(ids) if ids else [str(uuid.uuid4()) for _ in texts]
+        metadatas = list(metadatas) if metadatas else [{} for _ in texts]
+        vectors = _normalize(np.asarray([vector for _, vector in text_embeddings], dtype=np.float32))
+        with self._lock:
+            self._refresh()
+            if self._dimensions is None:
+                self._dimensions = vectors.shape[1]
+                self._vectors_file = f"vectors-{self._generation}.f32"
+                self._log_file = f"log-{self._generation}.jsonl"
+                os.makedirs(self.persist_directory, exist_ok=True)
+                # Start from empty files, even over those of an older index version
+                for path in (self._vectors_path(), self._log_path()):
+                    open(path, 'wb').close()
+                self._save_index()
+            elif vectors.shape[1] != self._dimensions:
+                raise ValueError(
+                    f"Embedding dimension {vectors.shape[1]} does not match collection dimensionality {self._dimensions}"
+                )
+            first_row = self._row_count()
+            with open(self._vectors_path(), 'ab') as f:
+                # Drop a partial row left behind by an interrupted write
+                f.truncate(first_row * 4 * self._dimensions)
+                f.write(vectors.tobytes())
+            self._append({
+                "op": "add",
+                "ids": ids,
+                "texts": texts,
+                "metadatas": [dict(metadata or {}) for metadata in metadatas],
+                "first_row": first_row,
+            })
+            self._compact()
+        return ids
+
+    def get(self, ids: Optional[List[str]] = None, where: Optional[Dict[str, Any]] = None,
+            include: Iterable[str] = ("metadatas", "documents")) -> Dict[str, Any]:
+        """
+        Return stored chunks by ID and/or metadata filter, like Chroma's ``get``.
+
+        Returns:
+            Dictionary with ``ids`` and, if included, ``metadatas``, ``documents``
+            and ``embeddings`` (a float32 matrix, one unit-length row per chunk)
+        """
+        with self._lock:
+            self._refresh()
+            mask = self._where_mask(where) if where else self._live
+            if ids is not None:
+                positions = sorted({self._positions[chunk_id] for chunk_id in ids if chunk_id in self._positions})
+                positions = [position for position in positions if mask[position]]
+            else:
+                positions = np.flatnonzero(mask).tolist()
+            result: Dict[str, Any] = {"ids": [self._ids[position] for position in positions]}
+            if "metadatas" in include:
+                result["metadatas"] = [dict(self._metadatas[position]) for position in positions]
+            if "documents" in include:
+                result["documents"] = [self._texts[position] for position in positions]
+            if "embeddings" in include:
+                result["embeddings"] = (
+                    np.asarray(self._matrix()[self._rows[positions]]) if positions
+                    else np.zeros((0, self._dimensions or 0), dtype=np.float32)
+                )
+            return result
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        """Delete chunks by ID."""
+        if not ids:
+            return None
+        with self._lock:
+            self._refresh()
+            ids = [chunk_id for chunk_id in ids if chunk_id in self._positions]
+            if not ids:
+                return True
+            self._append({"op": "delete", "ids": ids})
+            self._compact()
+        return True
+
+    def update_metadata(self, ids: List[str], metadatas: List[Dict[str, Any]]) -> None:
+        """Replace the metadata of stored chunks without re-embedding them."""
+        with self._lock:
+            self._refresh()
+            updates = [(chunk_id, dict(metadata)) for chunk_id, metadata in zip(ids, metadatas) if chunk_id in self._positions]
+            if not updates:
+                return
+            self._append({
+                "op": "update",
+                "ids": [chunk_id for chunk_id, _ in updates],
+                "metadatas": [metadata for _, metadata in updates],
+            })
+            self._compact()
+
+    def close(self) -> None:
+        """Release the memory-mapped vectors; they are mapped again if the store is used."""
+        with self._lock:
+            self._matrix_cache = None
+
+    def delete_collection(self) -> None:
+        """Delete every chunk and the store files (other files in the directory are kept)."""
+        with self._lock:
+            if os.path.isdir(self.persist_directory):
+                for entry in os.scandir(self.persist_directory):
+                    if entry.name == INDEX_FILENAME or (
+                        entry.name.startswith(("vectors-", "log-")) and entry.name.endswith((".f32", ".jsonl"))
+                    ):
+                        os.remove(entry.path)
+            self._clear()
+            self._stamp = None
+
+    def similarity_search_by_vectors_with_score(self, embeddings: List[List[float]], k: int = 4,
+                                                filter: Optional[Dict[str, Any]] = None
+                                                ) -> List[List[Tuple[Document, float]]]:
+        """
+        Find the ``k`` chunks most similar to each of several vectors in one pass.
+
+        All queries are scored with a single matrix product, so a batch costs
+        one scan of the vectors file instead of one per query.
+
+        Returns:
+            For each vector, (document, cosine similarity) pairs, most similar first
+        """
+        if not embeddings:
+            return []
+        queries = _normalize(np.asarray(embeddings, dtype=np.float32))
+        with self._lock:
+            self._refresh()
+            if not self._positions:
+                return [[] for _ in embeddings]
+            if queries.shape[1] != self._dimensions:
+                raise ValueError(
+                    f"Embedding dimension {queries.shape[1]} does not match collection dimensionality {self._dimensions}"
+                )
+            # One product over the whole file (dead rows are bounded by compaction), then live chunks only
+            scores = (queries @ self._matrix().T)[:, self._rows]
+            mask = self._where_mask(filter) if filter else self._live
+            candidates = int(mask.sum())
+            scores = np.where(mask, scores, -np.inf)
+            k = min(k, candidates)
+            if k <= 0:
+                return [[] for _ in embeddings]
+            top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+            top_scores = np.take_along_axis(scores, top, axis=1)
+            top = np.take_along_axis(top, np.argsort(-top_scores, axis=1, kind="stable"), axis=1)
+            return [
+                [
+                    (
+                        Document(id=self._ids[position], page_content=self._texts[position],
+                                 metadata=dict(self._metadatas[position])),
+                        float(row_scores[position]),
+                    )
+                    for position in row.tolist()
+                ]
+                for row, row_scores in zip(top, scores)
+            ]
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float], k: int = 4,
+                                               filter: Optional[Dict[str, Any]] = None) -> List[Tuple[Document, float]]:
+        """
+        Find the ``k`` chunks most similar to a vector.
+
+        Returns:
+            (document, cosine similarity) pairs, most similar first
+        """
+        return self.similarity_search_by_vectors_with_score([embedding], k, filter)[0]
+
+    def similarity_search_by_vectors(self, embeddings: List[List[float]], k: int = 4,
+                                     filter: Optional[Dict[str, Any]] = None) -> List[List[Document]]:
+        """Find the ``k`` chunks most similar to each of several vectors in one pass."""
+        return [
+            [doc for doc, _ in results]
+            for results in self.similarity_search_by_vectors_with_score(embeddings, k, filter)
+        ]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    filter: Optional[Dict[str, Any]] = None, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k, filter)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k, filter)
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[Dict[str, Any]] = None,
+                          **kwargs: Any) -> List[Document]:
+        """Find the ``k`` chunks most similar to a query, optionally restricted by a metadata filter."""
+        return [doc for doc, _ in self.similarity_search_with_score(query, k, filter)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        # Cosine similarity in [-1, 1] to a relevance score in [0, 1]
+        return lambda score: (score + 1.0) / 2.0
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None,
+                   ids: Optional[List[str]] = None, persist_directory: str = "./numpy_index",
+                   **kwargs: Any) -> "NumpyVectorStore":
+        store = cls(persist_directory=persist_directory, embedding_function=embedding)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
@@ -0,0 +1,51 @@
+"""
+Shared fixtures for the QA Agent backend tests.
+
+Backends use the built-in local embedding engine, so no API key or network
+access is needed, and every test runs in its own working directory so the
+vector stores, manifests and caches it creates are private to it.
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+REPO_ROOT = Path(__file__).resolve().parent.parent
+sys.path.insert(0, str(REPO_ROOT))
+
+import backend  # noqa: E402
+
+
+@pytest.fixture
+def workdir(tmp_path, monkeypatch):
+    """Run the test in an empty working directory with local embeddings."""
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("QA_EMBEDDINGS_PROVIDER", "local")
+    monkeypatch.setenv("QA_PARSE_WORKERS", "2")
+    for name in ("QA_VECTOR_STORE", "QA_KNOWLEDGE_BASE", "QA_CONTEXT_TOKENS", "QA_JSON_SKIP_PATHS"):
+        monkeypatch.delenv(name, raising=False)
+    return tmp_path
+
+
+@pytest.fixture(params=["numpy", "chroma"])
+def make_backend(request, workdir, monkeypatch):
+    """Factory for backends on the vector store kind the test is parametrized with."""
+    monkeypatch.setenv("QA_VECTOR_STORE", request.param)
+
+    def make(**env):
+        for name, value in env.items():
+            monkeypatch.setenv(name, value)
+        return backend.QAAgentBackend()
+
+    return make
+
+
+@pytest.fixture
+def write_doc(workdir):
+    """Write a support document into the working directory and return its path."""
+    def write(name: str, text: str) -> str:
+        path = workdir / name
+        path.write_text(text, encoding="utf-8")
+        return str(path)
+
+    return write
@@ -0,0 +1,116 @@
+"""
+Queries during builds: the reader/writer lock, collection swaps and resumed builds.
+"""
+import threading
+import time
+
+import backend
+
+OLD = "## Express Shipping\nExpress shipping costs $10 and arrives within two business days.\n"
+NEW = "## Express Shipping\nExpress shipping costs $25 and arrives the next business day.\n"
+RETURNS = "## Returns\nItems can be returned within thirty days of delivery for a full refund.\n"
+
+
+def top_hit(qa_backend, query="express shipping cost"):
+    backend.RETRIEVAL_CACHE.clear()
+    return qa_backend._hybrid_search(query, k=1)[0].page_content
+
+
+def test_waiting_writer_goes_before_new_readers():
+    lock = backend.ReadWriteLock()
+    order = []
+    first_reader = lock.read()
+    first_reader.__enter__()
+
+    def write():
+        with lock.write():
+            order.append("writer")
+
+    def read():
+        with lock.read():
+            order.append("reader")
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    time.sleep(0.1)
+    reader = threading.Thread(target=read)
+    reader.start()
+    time.sleep(0.1)
+    assert order == []
+
+    first_reader.__exit__(None, None, None)
+    writer.join(5)
+    reader.join(5)
+    assert order == ["writer", "reader"]
+
+
+def test_rebuild_is_invisible_to_queries_until_it_is_swapped_in(make_backend, write_doc):
+    qa_backend = make_backend()
+    path = write_doc("shipping.md", OLD)
+    qa_backend.ingest_documents([path], "")
+    write_doc("shipping.md", NEW)
+
+    during = None
+    for event in qa_backend.iter_ingest_documents([path], "", rebuild=True):
+        if event["stage"] == "indexed":
+            during = top_hit(qa_backend)
+
+    assert "$10" in during
+    assert "$25" in top_hit(qa_backend)
+
+
+def test_interrupted_rebuild_is_resumed(make_backend, write_doc):
+    qa_backend = make_backend()
+    paths = [write_doc("returns.md", RETURNS), write_doc("shipping.md", OLD)]
+    first = qa_backend.ingest_documents(paths, "")
+    events = qa_backend.iter_ingest_documents(paths, "", rebuild=True)
+    next(event for event in events if event["stage"] == "indexed")
+    events.close()
+    assert "$10" in top_hit(qa_backend)
+
+    resumed = qa_backend.ingest_documents(paths, "", rebuild=True)
+
+    assert resumed["status"] == "success"
+    assert resumed["stats"]["sources_unchanged"] == 1
+    assert 0 < resumed["stats"]["chunks_embedded"] < first["stats"]["chunks_embedded"]
+    assert qa_backend.list_sources() == ["returns.md", "shipping.md"]
+    assert "thirty days" in top_hit(qa_backend, "return within thirty days")
+
+
+def test_resumed_build_drops_chunks_of_a_source_it_did_not_finish(make_backend, write_doc):
+    qa_backend = make_backend()
+    path = write_doc("shipping.md", OLD)
+    events = qa_backend.iter_ingest_documents([path], "")
+    next(event for event in events if event["stage"] == "embedded")
+    events.close()
+    assert qa_backend.list_sources() == []
+
+    write_doc("shipping.md", NEW)
+    result = qa_backend.ingest_documents([path], "")
+
+    assert result["status"] == "success"
+    stored = qa_backend.vector_store.get(where={"source": "shipping.md"}, include=["documents"])["documents"]
+    assert stored == [NEW.strip()]
+
+
+def test_incremental_writes_wait_for_running_queries(make_backend, write_doc):
+    qa_backend = make_backend()
+    path = write_doc("shipping.md", OLD)
+    qa_backend.ingest_documents([path], "")
+    write_doc("shipping.md", NEW)
+    stages = []
+
+    def build():
+        for event in qa_backend.iter_ingest_documents([path], ""):
+            stages.append(event["stage"])
+
+    with qa_backend.shared_knowledge_base.lock.read():
+        builder = threading.Thread(target=build)
+        builder.start()
+        time.sleep(0.5)
+        assert builder.is_alive()
+        assert "indexed" not in stages
+    builder.join(20)
+
+    assert stages[-1] == "done"
+    assert "$25" in top_hit(qa_backend)
@@ -0,0 +1,106 @@
+"""
+Near-duplicate chunk removal within and across sources.
+"""
+from pathlib import Path
+
+from langchain_core.documents import Document
+
+import backend
+
+SPECS = (Path(__file__).resolve().parent.parent / "test_assets" / "product_specs.md").read_text(encoding="utf-8")
+
+FOOTER = (
+    "## Contact\nQuestions about this document go to the checkout team on the support portal. "
+    "Escalations are answered within one business day by the on-call engineer."
+)
+
+
+def document(topic: str) -> str:
+    return (
+        f"## {topic.title()}\nThe {topic} rules of the shop are described here in detail, "
+        f"with every limit that applies to {topic} at checkout.\n\n{FOOTER}\n"
+    )
+
+
+def stored_texts(qa_backend, source):
+    return qa_backend.vector_store.get(where={"source": source}, include=["documents"])["documents"]
+
+
+def scoped_search(qa_backend, query, source):
+    return qa_backend._hybrid_search(query, k=4, search_filter=backend._source_filter([source]))
+
+
+def test_near_duplicates_are_dropped_only_when_they_add_nothing(tmp_path):
+    index = backend.NearDuplicateIndex(str(tmp_path / "dedup.sqlite3"))
+    paragraph = (
+        "The discount code SAVE15 applies a fifteen percent reduction to the cart subtotal "
+        "before shipping is added at checkout."
+    )
+    texts = [
+        paragraph,
+        paragraph.replace(".", "!").upper(),
+        paragraph + " The code SAVE20 applies twenty percent.",
+        paragraph,
+    ]
+    chunks = [
+        Document(id=f"chunk-{i}", page_content=text, metadata={"chunk_hash": backend._sha256_text(text)})
+        for i, text in enumerate(texts)
+    ]
+
+    kept = index.deduplicate("a.md", chunks, stored_ids=set(), seen_ids=set())
+
+    assert [doc.page_content for doc in kept] == [texts[0], texts[2]]
+
+
+def test_boilerplate_shared_by_documents_is_stored_once(make_backend, write_doc):
+    qa_backend = make_backend()
+    paths = [write_doc(f"{topic}.md", document(topic)) for topic in ("payment", "shipping", "returns")]
+
+    result = qa_backend.ingest_documents(paths, "")
+
+    assert result["stats"]["chunks_deduplicated"] == 2
+    assert sum(FOOTER in text for source in qa_backend.list_sources() for text in stored_texts(qa_backend, source)) == 1
+    assert qa_backend.list_sources() == ["payment.md", "returns.md", "shipping.md"]
+    # Retrieval scoped to a document still finds the copy kept for another one
+    hits = scoped_search(qa_backend, "who answers escalations", "shipping.md")
+    assert any("Escalations are answered" in doc.page_content for doc in hits)
+    assert not any("payment rules" in doc.page_content for doc in hits)
+
+
+def test_versioned_copy_stores_only_what_it_adds(make_backend, write_doc):
+    qa_backend = make_backend()
+    addition = "## Gift Cards\nGift cards can be combined with the discount code SAVE15 but not with SAVE20.\n"
+    qa_backend.ingest_documents([write_doc("specs-v1.md", SPECS)], "", prune_missing=False)
+
+    result = qa_backend.ingest_documents([write_doc("specs-v2.md", SPECS + "\n" + addition)], "", prune_missing=False)
+
+    assert result["stats"]["chunks_embedded"] == 1
+    assert stored_texts(qa_backend, "specs-v2.md") == [addition.strip()]
+    hits = scoped_search(qa_backend, "SAVE15 discount code", "specs-v2.md")
+    assert any("15% discount" in doc.page_content for doc in hits)
+
+
+def test_duplicate_is_stored_again_when_its_copy_is_removed(make_backend, write_doc):
+    qa_backend = make_backend()
+    payment, shipping = write_doc("payment.md", document("payment")), write_doc("shipping.md", document("shipping"))
+    qa_backend.ingest_documents([payment, shipping], "")
+    assert not any(FOOTER in text for text in stored_texts(qa_backend, "shipping.md"))
+
+    result = qa_backend.ingest_documents([shipping], "")
+
+    assert result["stats"]["chunks_restored"] == 1
+    assert any(FOOTER in text for text in stored_texts(qa_backend, "shipping.md"))
+    hits = scoped_search(qa_backend, "who answers escalations", "shipping.md")
+    assert any("Escalations are answered" in doc.page_content for doc in hits)
+
+
+def test_duplicate_is_stored_again_when_its_copy_changes(make_backend, write_doc):
+    qa_backend = make_backend()
+    payment, shipping = write_doc("payment.md", document("payment")), write_doc("shipping.md", document("shipping"))
+    qa_backend.ingest_documents([payment, shipping], "")
+
+    write_doc("payment.md", "## Payment\nOnly card payments are accepted.\n")
+    result = qa_backend.ingest_documents([payment, shipping], "")
+
+    assert result["stats"]["chunks_restored"] == 1
+    assert any(FOOTER in text for text in stored_texts(qa_backend, "shipping.md"))
@@ -0,0 +1,89 @@
+"""
+Embedding vectors cached by model and text hash.
+"""
+import time
+
+import backend
+
+TEXT = "## Returns\nItems can be returned within thirty days of delivery for a full refund.\n"
+
+
+class CountingEmbeddings:
+    """Embeddings that record every text they are asked to embed."""
+
+    def __init__(self):
+        self.documents = []
+        self.queries = []
+
+    def embed_documents(self, texts):
+        self.documents.extend(texts)
+        return [[float(len(text)), 1.0] for text in texts]
+
+    def embed_queries(self, texts):
+        self.queries.extend(texts)
+        return [[float(len(text)), 2.0] for text in texts]
+
+    def embed_query(self, text):
+        return self.embed_queries([text])[0]
+
+
+def test_only_missing_texts_are_embedded(tmp_path):
+    inner = CountingEmbeddings()
+    embedder = backend.CachedEmbeddings(inner, backend.EmbeddingCache(str(tmp_path), 1 << 20), "model-a")
+
+    first = embedder.embed_documents(["a", "bb", "a"])
+    second = embedder.embed_documents(["bb", "ccc"])
+
+    assert inner.documents == ["a", "bb", "ccc"]
+    assert first == [[1.0, 1.0], [2.0, 1.0], [1.0, 1.0]]
+    assert second == [[2.0, 1.0], [3.0, 1.0]]
+    assert (embedder.hits, embedder.misses) == (2, 3)
+
+
+def test_queries_and_other_models_do_not_share_vectors(tmp_path):
+    cache = backend.EmbeddingCache(str(tmp_path), 1 << 20)
+    inner = CountingEmbeddings()
+    embedder = backend.CachedEmbeddings(inner, cache, "model-a")
+    embedder.embed_documents(["a"])
+
+    assert embedder.embed_query("a") == [1.0, 2.0]
+    assert embedder.embed_queries(["a", "b"]) == [[1.0, 2.0], [1.0, 2.0]]
+    backend.CachedEmbeddings(inner, cache, "model-b").embed_documents(["a"])
+
+    assert inner.queries == ["a", "b"]
+    assert inner.documents == ["a", "a"]
+
+
+def test_least_recently_used_vectors_are_evicted(tmp_path):
+    cache = backend.EmbeddingCache(str(tmp_path), max_bytes=10 * 8)
+    for i in range(20):
+        cache.put_many("model", {f"hash-{i}": [float(i), 0.0]})
+    time.sleep(0.01)
+    cache.get_many("model", ["hash-0"])
+
+    removed = cache.evict()
+
+    assert removed > 0
+    assert cache.get_many("model", ["hash-0"])
+    assert len(cache.get_many("model", [f"hash-{i}" for i in range(20)])) == 20 - removed
+    assert cache.evict() == 0
+
+
+def test_disabled_cache_stores_nothing(tmp_path):
+    cache = backend.EmbeddingCache(str(tmp_path), max_bytes=0)
+    cache.put_many("model", {"hash": [1.0]})
+
+    assert not cache.enabled
+    assert cache.get_many("model", ["hash"]) == {}
+
+
+def test_rebuild_reuses_cached_vectors(make_backend, write_doc):
+    qa_backend = make_backend()
+    path = write_doc("returns.md", TEXT)
+    first = qa_backend.ingest_documents([path], "")
+
+    rebuilt = qa_backend.ingest_documents([path], "", rebuild=True)
+
+    assert first["stats"]["embedding_cache_hits"] == 0
+    assert rebuilt["stats"]["chunks_embedded"] == first["stats"]["chunks_embedded"] > 0
+    assert rebuilt["stats"]["embedding_cache_hits"] == rebuilt["stats"]["chunks_embedded"]
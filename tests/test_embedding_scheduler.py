@@ -0,0 +1,108 @@
+"""
+Token-sized embedding batches with AIMD concurrency and rate-limit retries.
+"""
+import threading
+
+import pytest
+
+import backend
+
+
+class RateLimited(Exception):
+    """An embeddings API error asking the client to wait ``retry_after`` seconds."""
+    status_code = 429
+
+    def __init__(self, retry_after):
+        super().__init__("rate limited")
+        self.response = type("Response", (), {"headers": {"retry-after": retry_after}})()
+
+
+class FlakyEmbeddings:
+    """Embeddings that raise the queued errors first, then embed each text as its length."""
+
+    def __init__(self, *errors):
+        self.errors = list(errors)
+        self.calls = []
+        self._lock = threading.Lock()
+
+    def embed_documents(self, texts):
+        with self._lock:
+            self.calls.append(list(texts))
+            if self.errors:
+                raise self.errors.pop(0)
+        return [[float(len(text))] for text in texts]
+
+
+def make_scheduler(embeddings, **kwargs):
+    return backend.EmbeddingScheduler(embeddings, len, **kwargs)
+
+
+@pytest.fixture
+def sleeps(monkeypatch):
+    """Record retry waits instead of sleeping."""
+    waits = []
+    monkeypatch.setattr(backend.time, "sleep", waits.append)
+    return waits
+
+
+def test_batches_hold_at_most_batch_tokens_and_keep_order():
+    embeddings = FlakyEmbeddings()
+    scheduler = make_scheduler(embeddings, batch_tokens=5, max_concurrency=4)
+    texts = ["aa", "bbb", "c", "dddd", "eeeeee", "f"]
+
+    vectors = scheduler.embed_documents(texts)
+
+    assert vectors == [[float(len(text))] for text in texts]
+    assert sorted(embeddings.calls) == [["aa", "bbb"], ["c", "dddd"], ["eeeeee"], ["f"]]
+    assert scheduler.tokens == sum(map(len, texts))
+
+
+def test_limit_grows_by_one_per_round_of_requests():
+    scheduler = make_scheduler(FlakyEmbeddings(), max_concurrency=8, target_latency=60)
+    assert scheduler.limit == 2
+
+    for _ in range(2):
+        scheduler._acquire()
+    scheduler._release(0.0, congested=False)
+    scheduler._release(0.0, congested=False)
+
+    # The first release found the limit in use; the second found a free slot
+    assert scheduler.limit == 2.5
+
+
+def test_rate_limit_halves_the_limit_once_and_honours_retry_after(sleeps):
+    embeddings = FlakyEmbeddings(RateLimited("7"))
+    scheduler = make_scheduler(embeddings, max_concurrency=8)
+    scheduler.limit = 4.0
+
+    assert scheduler.embed_documents(["abc"]) == [[3.0]]
+
+    assert sleeps == [7.0]
+    assert scheduler.rate_limited == 1
+    assert scheduler.limit == 2.0
+    # Requests sent before the decrease report the same congestion and do not halve it again
+    scheduler._acquire()
+    scheduler._release(0.0, congested=True)
+    assert scheduler.limit == 2.0
+
+
+def test_errors_without_retry_after_back_off(sleeps):
+    server_error = Exception("unavailable")
+    server_error.status_code = 503
+    scheduler = make_scheduler(FlakyEmbeddings(server_error, RateLimited("soon")))
+
+    assert scheduler.embed_documents(["abc"]) == [[3.0]]
+
+    assert len(sleeps) == 2 and all(0 < wait <= 2 for wait in sleeps)
+    assert scheduler.rate_limited == 1
+
+
+def test_other_errors_are_not_retried(sleeps):
+    embeddings = FlakyEmbeddings(ValueError("bad input"))
+    scheduler = make_scheduler(embeddings)
+
+    with pytest.raises(ValueError):
+        scheduler.embed_documents(["abc"])
+
+    assert len(embeddings.calls) == 1 and sleeps == []
+    assert scheduler._in_flight == 0
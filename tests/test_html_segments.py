@@ -0,0 +1,65 @@
+"""
+HTML pages split into DOM segments and retrieved fragment by fragment.
+"""
+from pathlib import Path
+
+import backend
+
+CHECKOUT = (Path(__file__).resolve().parent.parent / "test_assets" / "checkout.html").read_text(encoding="utf-8")
+
+PAGE = """
+<html><head><title>Account</title><style>p { color: red; }</style></head>
+<body>
+  <section id="profile" style="padding: 4px">
+    <h2>Profile</h2>
+    <p>Your name is shown on invoices.</p>
+    <form id="email-form"><label>Email</label><input type="email" name="email"></form>
+  </section>
+  <section class="empty"><h2>Nothing here</h2></section>
+  <p>Signed in as guest.</p>
+  <script>function save() { return true; }</script>
+</body></html>
+"""
+
+
+def test_nested_segments_are_split_innermost_first():
+    segments = list(backend._iter_html_segments(PAGE))
+
+    assert [segment["element"] for segment in segments] == ["section#profile", "form#email-form", "body", "script[1]"]
+    profile, form, body, script = segments
+    assert profile["heading"] == form["heading"] == "Profile"
+    assert "<!-- see form#email-form -->" in profile["text"] and "<input" not in profile["text"]
+    assert "<input" in form["text"]
+    assert "style=" not in profile["text"]
+    # A container left with only its heading is dropped, the rest of the body is kept
+    assert "Nothing here" not in body["text"] and "Signed in as guest." in body["text"]
+    assert body["heading"] == "Account"
+    assert script["text"] == "function save() { return true; }"
+
+
+def test_checkout_page_is_split_into_its_sections():
+    segments = {segment["element"]: segment for segment in backend._iter_html_segments(CHECKOUT)}
+
+    assert {"div.section", "div.discount-section", "form#checkout-form", "body", "script[1]"} <= set(segments)
+    assert 'id="discount-code"' in segments["div.discount-section"]["text"]
+    assert 'id="discount-code"' not in segments["div.section"]["text"]
+    assert segments["form#checkout-form"]["heading"] == "User Details"
+
+
+def test_only_relevant_fragments_are_retrieved(make_backend):
+    qa_backend = make_backend()
+    qa_backend.ingest_documents([], CHECKOUT)
+
+    fragments = qa_backend._retrieve_html_fragments(["apply a discount code"])[0]
+
+    assert fragments and all(doc.metadata["source"] == backend.HTML_SOURCE for doc in fragments)
+    assert 'id="discount-code"' in fragments[0].page_content
+    assert all(len(doc.page_content) < len(CHECKOUT) for doc in fragments)
+
+
+def test_raw_page_is_used_until_it_is_indexed(make_backend, write_doc):
+    qa_backend = make_backend()
+    qa_backend.ingest_documents([write_doc("faq.md", "## Email\nChanging your email needs a confirmation.\n")], "")
+    qa_backend.html_content = PAGE
+
+    assert [doc.page_content for doc in qa_backend._retrieve_html_fragments(["email"])[0]] == [PAGE]
@@ -0,0 +1,89 @@
+"""
+Corpus expansion and batching for command-line ingestion.
+"""
+import io
+import os
+import tarfile
+import zipfile
+
+import backend
+import ingest_cli
+
+TEXT = "## Returns\nItems can be returned within thirty days of delivery for a full refund.\n"
+
+
+def write(path, text=TEXT):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def read(document):
+    if isinstance(document, backend.DocumentSource):
+        return bytes(document.data).decode("utf-8")
+    with open(document, encoding="utf-8") as f:
+        return f.read()
+
+
+def test_directories_and_globs_are_expanded(tmp_path, monkeypatch):
+    write(tmp_path / "docs" / "b.md")
+    write(tmp_path / "docs" / "guides" / "a.md")
+    write(tmp_path / "docs" / "notes.txt")
+    write(tmp_path / "docs" / ".drafts" / "wip.md")
+    write(tmp_path / "specs" / "checkout.md")
+    monkeypatch.chdir(tmp_path)
+
+    corpus = dict(ingest_cli.iter_corpus(["docs", "specs/*.md", "missing/*.md"], {".md"}))
+
+    assert sorted(corpus) == ["b.md", "guides/a.md", "specs/checkout.md"]
+    assert corpus["guides/a.md"] == os.path.join("docs", "guides", "a.md")
+
+
+def test_archive_members_are_read_in_memory(tmp_path):
+    with zipfile.ZipFile(tmp_path / "corpus.zip", "w") as zf:
+        zf.writestr("faq/returns.md", TEXT)
+        zf.writestr("faq/.hidden.md", TEXT)
+        zf.writestr("logo.png", b"\x89PNG")
+    with tarfile.open(tmp_path / "corpus.tar.gz", "w:gz") as tf:
+        data = TEXT.encode("utf-8")
+        info = tarfile.TarInfo("specs/shipping.md")
+        info.size = len(data)
+        tf.addfile(info, io.BytesIO(data))
+
+    corpus = dict(ingest_cli.iter_corpus([str(tmp_path / "corpus.zip"), str(tmp_path / "*.tar.gz")], {".md"}))
+
+    assert sorted(corpus) == ["corpus.tar.gz:specs/shipping.md", "corpus.zip:faq/returns.md"]
+    assert all(isinstance(document, backend.DocumentSource) for document in corpus.values())
+    assert {read(document) for document in corpus.values()} == {TEXT}
+
+
+def test_batches_close_on_size_and_held_bytes():
+    documents = [(f"{i}.md", backend.DocumentSource(f"{i}.md", b"x" * 10)) for i in range(5)]
+
+    by_size = list(ingest_cli.iter_batches(iter(documents), batch_size=2, batch_bytes=1000, seen=set()))
+    by_bytes = list(ingest_cli.iter_batches(iter(documents), batch_size=10, batch_bytes=30, seen=set()))
+
+    assert [sorted(batch) for batch in by_size] == [["0.md", "1.md"], ["2.md", "3.md"], ["4.md"]]
+    assert [len(batch) for batch in by_bytes] == [3, 2]
+
+
+def test_duplicate_names_are_skipped_across_batches():
+    seen = set()
+    first = list(ingest_cli.iter_batches(iter([("a.md", "docs/a.md")]), 10, 1000, seen))
+
+    second = list(ingest_cli.iter_batches(iter([("a.md", "other/a.md"), ("b.md", "docs/b.md")]), 10, 1000, seen))
+
+    assert first == [{"a.md": "docs/a.md"}]
+    assert second == [{"b.md": "docs/b.md"}]
+    assert seen == {"a.md", "b.md"}
+
+
+def test_archive_batch_is_indexed_under_member_names(make_backend, tmp_path):
+    qa_backend = make_backend()
+    with zipfile.ZipFile(tmp_path / "corpus.zip", "w") as zf:
+        zf.writestr("faq/returns.md", TEXT)
+
+    for batch in ingest_cli.iter_batches(ingest_cli.iter_corpus([str(tmp_path / "corpus.zip")]), 10, 1000, set()):
+        assert qa_backend.ingest_documents(batch, "", prune_missing=False)["status"] == "success"
+
+    assert qa_backend.list_sources() == ["corpus.zip:faq/returns.md"]
@@ -0,0 +1,99 @@
+"""
+Incremental ingestion and pruning.
+"""
+from pathlib import Path
+
+SPECS = (Path(__file__).resolve().parent.parent / "test_assets" / "product_specs.md").read_text(encoding="utf-8")
+
+SHIPPING = "\n\n".join(
+    f"## Shipping rule {i}\nOrders to zone {i} ship in {i + 2} business days. "
+    f"Parcels above {i * 5} kg to zone {i} pay a surcharge of {i * 3} dollars per parcel, "
+    f"and remote addresses in zone {i} add one extra business day to the delivery estimate."
+    for i in range(1, 13)
+)
+
+
+def indexed_texts(qa_backend, source):
+    return qa_backend.vector_store.get(where={"source": source}, include=["documents"])["documents"]
+
+
+def test_rebuild_with_unchanged_sources_embeds_nothing(make_backend, write_doc):
+    qa_backend = make_backend()
+    paths = [write_doc("specs.md", SPECS), write_doc("shipping.md", SHIPPING)]
+
+    first = qa_backend.ingest_documents(paths, "")
+    assert first["status"] == "success"
+    assert first["stats"]["sources_added"] == 2
+    assert first["stats"]["chunks_embedded"] > 0
+
+    second = qa_backend.ingest_documents(paths, "")
+    assert second["status"] == "success"
+    assert second["stats"]["sources_unchanged"] == 2
+    assert second["stats"]["chunks_embedded"] == 0
+    assert qa_backend.list_sources() == ["shipping.md", "specs.md"]
+
+
+def test_changed_source_only_embeds_its_new_chunks(make_backend, write_doc):
+    qa_backend = make_backend()
+    specs = write_doc("specs.md", SPECS)
+    shipping = write_doc("shipping.md", SHIPPING)
+    qa_backend.ingest_documents([specs, shipping], "")
+    chunks_before = len(indexed_texts(qa_backend, "shipping.md"))
+
+    write_doc("shipping.md", SHIPPING + "\n\n## Drones\nDrone delivery with code SKYDROP is limited to 2 kg.")
+    result = qa_backend.ingest_documents([specs, shipping], "")
+
+    assert result["status"] == "success", result["message"]
+    stats = result["stats"]
+    assert stats["sources_updated"] == 1
+    assert stats["sources_unchanged"] == 1
+    assert 0 < stats["chunks_embedded"] < chunks_before
+    assert any("SKYDROP" in text for text in indexed_texts(qa_backend, "shipping.md"))
+    hits = qa_backend._hybrid_search("SKYDROP drone delivery limit")
+    assert hits and "SKYDROP" in hits[0].page_content
+
+
+def test_sources_missing_from_a_build_are_pruned(make_backend, write_doc):
+    qa_backend = make_backend()
+    specs = write_doc("specs.md", SPECS)
+    shipping = write_doc("shipping.md", SHIPPING)
+    qa_backend.ingest_documents([specs, shipping], "")
+
+    kept = qa_backend.ingest_documents([specs], "", prune_missing=False)
+    assert kept["stats"]["sources_removed"] == 0
+    assert qa_backend.list_sources() == ["shipping.md", "specs.md"]
+
+    pruned = qa_backend.ingest_documents([specs], "")
+    assert pruned["stats"]["sources_removed"] == 1
+    assert pruned["stats"]["chunks_deleted"] > 0
+    assert qa_backend.list_sources() == ["specs.md"]
+    assert indexed_texts(qa_backend, "shipping.md") == []
+
+
+def test_prune_sources_keeps_only_the_listed_sources(make_backend, write_doc):
+    qa_backend = make_backend()
+    qa_backend.ingest_documents([write_doc("specs.md", SPECS), write_doc("shipping.md", SHIPPING)], "")
+    chunks = len(indexed_texts(qa_backend, "shipping.md"))
+
+    result = qa_backend.prune_sources(keep=["specs.md"])
+
+    assert result["status"] == "success"
+    assert result["removed"] == ["shipping.md"]
+    assert result["chunks_deleted"] == chunks
+    assert qa_backend.list_sources() == ["specs.md"]
+    assert all(doc.metadata["source"] == "specs.md" for doc in qa_backend._hybrid_search("parcel surcharge zone"))
+
+
+def test_kept_chunks_get_their_new_positions_without_re_embedding(make_backend, write_doc):
+    qa_backend = make_backend()
+    shipping = write_doc("shipping.md", SHIPPING)
+    qa_backend.ingest_documents([shipping], "")
+
+    write_doc("shipping.md", "## Notice\nCarriers pause pickups on public holidays.\n\n" + SHIPPING)
+    result = qa_backend.ingest_documents([shipping], "")
+
+    assert result["stats"]["chunks_embedded"] == 1
+    stored = qa_backend.vector_store.get(where={"source": "shipping.md"}, include=["documents", "metadatas"])
+    positions = {metadata["chunk_index"]: text for text, metadata in zip(stored["documents"], stored["metadatas"])}
+    assert sorted(positions) == list(range(len(stored["ids"])))
+    assert positions[0].startswith("## Notice")
@@ -0,0 +1,101 @@
+"""
+Background ingestion jobs: polling, status and cancellation.
+"""
+import threading
+import time
+
+import backend
+
+TEXT = "## Returns\nItems can be returned within thirty days of delivery for a full refund.\n"
+
+
+class RateLimited(Exception):
+    """An embeddings API error asking the client to wait a long time."""
+    status_code = 429
+
+    class response:
+        headers = {"retry-after": "60"}
+
+
+class RateLimitedEmbeddings:
+    """Embeddings whose every request is rate limited; ``called`` is set on the first one."""
+
+    def __init__(self):
+        self.called = threading.Event()
+
+    def embed_documents(self, texts):
+        self.called.set()
+        raise RateLimited()
+
+
+class BlockingBackend:
+    """Stand-in backend whose build waits for ``release``."""
+
+    def __init__(self):
+        self.release = threading.Event()
+
+    def iter_ingest_documents(self, support_docs_paths, html_content, rebuild, cancel=None):
+        self.release.wait(10)
+        yield {"stage": "done", "result": {"status": "success", "message": "Built."}}
+
+
+def wait_until_done(manager, job_id, timeout=20):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = manager.status(job_id)
+        if job["status"] in ("succeeded", "failed", "cancelled"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"job {job_id} did not finish: {manager.status(job_id)['status']}")
+
+
+def test_job_runs_the_build_in_the_background(make_backend, write_doc):
+    qa_backend = make_backend()
+    manager = backend.IngestionJobManager()
+    finished = []
+
+    job_id = manager.submit(qa_backend, [write_doc("returns.md", TEXT)], "", on_finish=finished.append)
+    job = wait_until_done(manager, job_id)
+
+    assert job["status"] == "succeeded"
+    assert job["result"]["status"] == "success"
+    assert [event["stage"] for event in job["events"]][-1] == "done"
+    assert [job.job_id for job in finished] == [job_id]
+    assert qa_backend.list_sources() == ["returns.md"]
+    assert manager.status("unknown") is None
+    assert not manager.cancel(job_id)
+
+
+def test_cancelled_queued_job_never_starts():
+    manager = backend.IngestionJobManager(max_workers=1)
+    blocking = BlockingBackend()
+    first = manager.submit(blocking, [], "")
+    queued = manager.submit(BlockingBackend(), [], "")
+
+    assert manager.status(queued)["status"] == "queued"
+    assert manager.cancel(queued)
+    blocking.release.set()
+
+    assert wait_until_done(manager, first)["status"] == "succeeded"
+    job = wait_until_done(manager, queued)
+    assert job["status"] == "cancelled"
+    assert job["events"] == []
+
+
+def test_cancel_interrupts_a_build_waiting_to_retry_embeddings(make_backend, write_doc):
+    qa_backend = make_backend(QA_EMBED_CACHE_MB="0")
+    embeddings = RateLimitedEmbeddings()
+    qa_backend.embeddings = embeddings
+    manager = backend.IngestionJobManager()
+
+    job_id = manager.submit(qa_backend, [write_doc("returns.md", TEXT)], "")
+    assert embeddings.called.wait(20)
+    assert manager.status(job_id)["status"] == "running"
+    cancelled_at = time.monotonic()
+    assert manager.cancel(job_id)
+    job = wait_until_done(manager, job_id)
+
+    # The 60 second Retry-After wait is cut short
+    assert time.monotonic() - cancelled_at < 10
+    assert job["status"] == "cancelled"
+    assert not qa_backend.shared_knowledge_base.build_lock.locked()
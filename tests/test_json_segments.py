@@ -0,0 +1,99 @@
+"""
+Streaming JSON segmentation and skip paths.
+"""
+import json
+
+import pytest
+
+import backend
+
+MAX_CHARS = 300
+
+API = {
+    "info": {"title": "Shop API", "version": "1.0"},
+    "paths": {
+        f"/items/{i}": {"get": {"summary": f"Get item {i}", "examples": {"big": "EXAMPLEBLOB " * 50}}}
+        for i in range(6)
+    },
+    "tags": [{"name": f"tag{i}", "description": "d" * 40} for i in range(10)],
+}
+
+
+def blocks_of(text, size):
+    return (text[start:start + size] for start in range(0, len(text), size))
+
+
+def segment_values(segments):
+    """Parse the JSON after each segment's path label."""
+    values = []
+    for segment in segments:
+        label = f"{segment['json_path']}: "
+        assert segment["text"].startswith(label)
+        values.append(json.loads(segment["text"][len(label):]))
+    return values
+
+
+def test_segments_are_labelled_json_within_the_size_limit():
+    segments = list(backend._iter_json_segments(blocks_of(json.dumps(API), 7), MAX_CHARS, ["$.paths.*.examples"]))
+
+    assert len(segments) > 1
+    assert all(len(segment["text"]) <= MAX_CHARS for segment in segments)
+    values = segment_values(segments)
+    summaries = [
+        operation["get"]["summary"]
+        for segment, value in zip(segments, values) if segment["json_path"] == "$.paths"
+        for operation in value.values()
+    ]
+    assert summaries == [f"Get item {i}" for i in range(6)]
+    tags = [
+        tag["name"]
+        for segment, value in zip(segments, values) if segment["json_path"].startswith("$.tags[")
+        for tag in value
+    ]
+    assert tags == [f"tag{i}" for i in range(10)]
+
+
+def test_segments_do_not_depend_on_how_the_input_is_split():
+    text = json.dumps(API)
+    whole = list(backend._iter_json_segments([text], MAX_CHARS))
+    assert list(backend._iter_json_segments(blocks_of(text, 1), MAX_CHARS)) == whole
+    assert list(backend._iter_json_segments(blocks_of(text, 64), MAX_CHARS)) == whole
+
+
+def test_skipped_paths_are_left_out():
+    text = json.dumps(API)
+    assert any("EXAMPLEBLOB" in segment["text"] for segment in backend._iter_json_segments([text], MAX_CHARS))
+
+    segments = list(backend._iter_json_segments([text], MAX_CHARS, ["$.paths.*.examples", "$.tags"]))
+
+    assert not any("EXAMPLEBLOB" in segment["text"] for segment in segments)
+    assert not any(segment["json_path"].startswith("$.tags") for segment in segments)
+    assert any("Get item 5" in segment["text"] for segment in segments)
+
+
+def test_skip_patterns_match_quoted_keys_in_dotted_form():
+    skipped = backend._json_skip_matcher(["$.paths./users.*"])
+    assert skipped('$.paths["/users"].get')
+    assert not skipped('$.paths["/orders"].get')
+    assert backend._json_skip_matcher([]) is None
+
+
+def test_small_document_is_one_segment_and_trailing_data_is_rejected():
+    assert list(backend._iter_json_segments(['{"a": 1}'], MAX_CHARS)) == [{"text": '$: {"a": 1}', "json_path": "$"}]
+    with pytest.raises(ValueError):
+        list(backend._iter_json_segments(['{"a": 1} 2'], MAX_CHARS))
+
+
+def test_ingested_json_leaves_out_skip_paths(make_backend, workdir, monkeypatch):
+    monkeypatch.setattr(backend, "JSON_SKIP_PATHS", ("$.paths.*.examples",))
+    (workdir / "api.json").write_text(json.dumps(API), encoding="utf-8")
+    # Parse inline so the patched skip paths apply
+    qa_backend = make_backend(QA_PARSE_WORKERS="1")
+
+    result = qa_backend.ingest_documents([str(workdir / "api.json")], "")
+
+    assert result["status"] == "success"
+    stored = qa_backend.vector_store.get(include=["documents", "metadatas"])
+    assert stored["documents"] and not any("EXAMPLEBLOB" in text for text in stored["documents"])
+    assert any("Get item 3" in text for text in stored["documents"])
+    assert all(metadata.get("json_path", "").startswith("$") for metadata in stored["metadatas"])
@@ -0,0 +1,67 @@
+"""
+Named knowledge bases: create, select, delete.
+"""
+import os
+
+import backend
+
+SHIPPING = "## Express Shipping\nExpress shipping costs $10 and arrives within two business days.\n"
+RETURNS = "## Returns\nItems can be returned within thirty days of delivery for a full refund.\n"
+
+
+def summary(qa_backend):
+    return {kb["name"]: (kb["sources"], kb["built"], kb["selected"]) for kb in qa_backend.list_knowledge_bases()}
+
+
+def test_names_are_validated(make_backend):
+    qa_backend = make_backend()
+
+    assert qa_backend.create_knowledge_base("../escape")["status"] == "error"
+    assert qa_backend.create_knowledge_base("")["status"] == "error"
+    assert qa_backend.create_knowledge_base("returns-2024")["status"] == "success"
+    assert qa_backend.create_knowledge_base("returns-2024")["status"] == "error"
+    assert qa_backend.select_knowledge_base("missing")["status"] == "error"
+    assert qa_backend.delete_knowledge_base(backend.DEFAULT_KNOWLEDGE_BASE)["status"] == "error"
+
+
+def test_knowledge_bases_index_separately(make_backend, write_doc):
+    qa_backend = make_backend()
+    qa_backend.ingest_documents([write_doc("shipping.md", SHIPPING)], "")
+    qa_backend.create_knowledge_base("returns")
+
+    selected = qa_backend.select_knowledge_base("returns")
+    assert selected["status"] == "success" and not selected["built"]
+    qa_backend.ingest_documents([write_doc("returns.md", RETURNS)], "")
+
+    assert qa_backend.list_sources() == ["returns.md"]
+    assert summary(qa_backend) == {
+        backend.DEFAULT_KNOWLEDGE_BASE: (["shipping.md"], True, False),
+        "returns": (["returns.md"], True, True),
+    }
+    assert "thirty days" in qa_backend._hybrid_search("express shipping cost", k=1)[0].page_content
+    qa_backend.select_knowledge_base(backend.DEFAULT_KNOWLEDGE_BASE)
+    assert "$10" in qa_backend._hybrid_search("express shipping cost", k=1)[0].page_content
+
+
+def test_deleted_knowledge_base_can_be_created_again(make_backend, write_doc):
+    qa_backend, other = make_backend(), make_backend()
+    qa_backend.create_knowledge_base("returns")
+    qa_backend.select_knowledge_base("returns")
+    other.select_knowledge_base("returns")
+    qa_backend.ingest_documents([write_doc("returns.md", RETURNS)], "")
+    assert other._hybrid_search("returns", k=1)
+    directory = qa_backend.persist_directory
+
+    assert qa_backend.delete_knowledge_base("returns")["status"] == "success"
+
+    assert qa_backend.knowledge_base == backend.DEFAULT_KNOWLEDGE_BASE
+    assert not os.path.exists(directory)
+    assert "returns" not in summary(qa_backend)
+    assert other._open_knowledge_base({})["status"] == "error"
+    # A new knowledge base under the same name starts empty
+    qa_backend.create_knowledge_base("returns")
+    qa_backend.select_knowledge_base("returns")
+    assert qa_backend.list_sources() == []
+    qa_backend.ingest_documents([write_doc("shipping.md", SHIPPING)], "")
+    assert qa_backend.list_sources() == ["shipping.md"]
+    assert "$10" in qa_backend._hybrid_search("express shipping cost", k=1)[0].page_content
@@ -0,0 +1,150 @@
+"""
+NumpyVectorStore: adds, deletes, metadata updates, persistence and compaction.
+"""
+import os
+
+import numpy as np
+import pytest
+
+import numpy_store
+from local_embeddings import HashedNgramEmbeddings
+from numpy_store import NumpyVectorStore
+
+EMBEDDINGS = HashedNgramEmbeddings(dimensions=256)
+
+TEXTS = {
+    "ship-1": ("Express shipping costs ten dollars and arrives in two days.", {"source": "shipping.md"}),
+    "ship-2": ("Standard shipping is free for orders above fifty dollars.", {"source": "shipping.md"}),
+    "code-1": ("The discount code SAVE15 takes fifteen percent off the subtotal.", {"source": "codes.md"}),
+    "form-1": ("The email field of the checkout form is required.", {"source": "page.html"}),
+}
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = NumpyVectorStore(persist_directory=str(tmp_path / "index"), embedding_function=EMBEDDINGS)
+    store.add_texts(
+        [text for text, _ in TEXTS.values()],
+        metadatas=[metadata for _, metadata in TEXTS.values()],
+        ids=list(TEXTS),
+    )
+    return store
+
+
+def reopen(store):
+    return NumpyVectorStore(persist_directory=store.persist_directory, embedding_function=EMBEDDINGS)
+
+
+def test_added_texts_are_returned_by_id_and_filter(store):
+    assert store.get(include=[])["ids"] == list(TEXTS)
+    got = store.get(ids=["code-1", "ship-1"])
+    assert got["ids"] == ["ship-1", "code-1"]
+    assert got["documents"] == [TEXTS["ship-1"][0], TEXTS["code-1"][0]]
+    assert store.get(where={"source": "shipping.md"}, include=[])["ids"] == ["ship-1", "ship-2"]
+    assert store.get(where={"source": {"$nin": ["shipping.md", "codes.md"]}}, include=[])["ids"] == ["form-1"]
+    assert store.get(
+        where={"$or": [{"source": "codes.md"}, {"source": "page.html"}]}, include=[]
+    )["ids"] == ["code-1", "form-1"]
+
+
+def test_similarity_search_ranks_and_filters(store):
+    assert store.similarity_search("discount code SAVE15", k=1)[0].id == "code-1"
+    hits = store.similarity_search("shipping costs", k=4, filter={"source": {"$ne": "shipping.md"}})
+    assert {doc.id for doc in hits} == {"code-1", "form-1"}
+    scored = store.similarity_search_with_score("express shipping", k=2)
+    assert scored[0][1] >= scored[1][1]
+
+
+def test_stored_embeddings_are_unit_length_rows(store):
+    embeddings = store.get(ids=["ship-1", "form-1"], include=["embeddings"])["embeddings"]
+
+    assert embeddings.shape == (2, 256)
+    np.testing.assert_allclose(np.linalg.norm(embeddings, axis=1), 1.0, rtol=1e-5)
+    assert store.get(ids=["missing"], include=["embeddings"])["embeddings"].shape == (0, 256)
+
+
+def test_delete_removes_chunks_for_every_instance(store):
+    other = reopen(store)
+
+    store.delete(ids=["ship-2", "missing"])
+
+    for instance in (store, other, reopen(store)):
+        assert instance.get(include=[])["ids"] == ["ship-1", "code-1", "form-1"]
+        assert "ship-2" not in {doc.id for doc in instance.similarity_search("free standard shipping", k=4)}
+
+
+def test_adding_an_existing_id_replaces_it(store):
+    store.add_texts(["Express shipping now costs twelve dollars."], metadatas=[{"source": "shipping.md"}], ids=["ship-1"])
+
+    got = reopen(store).get(ids=["ship-1"])
+    assert got["documents"] == ["Express shipping now costs twelve dollars."]
+    assert len(reopen(store).get(include=[])["ids"]) == len(TEXTS)
+
+
+def test_update_metadata_keeps_the_vector(store):
+    before = store.get(ids=["form-1"], include=["embeddings"])["embeddings"]
+
+    store.update_metadata(["form-1", "missing"], [{"source": "page.html", "element": "form#checkout"}, {}])
+
+    got = reopen(store).get(ids=["form-1"], include=["metadatas", "embeddings"])
+    assert got["metadatas"] == [{"source": "page.html", "element": "form#checkout"}]
+    np.testing.assert_array_equal(got["embeddings"], before)
+    assert reopen(store).get(where={"element": "form#checkout"}, include=[])["ids"] == ["form-1"]
+
+
+def test_writes_append_to_the_log_instead_of_rewriting_the_index(store):
+    index_path = os.path.join(store.persist_directory, numpy_store.INDEX_FILENAME)
+    index_stat = os.stat(index_path)
+
+    store.add_texts(["Gift wrapping costs three dollars."], metadatas=[{"source": "extras.md"}], ids=["extra-1"])
+    store.delete(ids=["code-1"])
+    store.update_metadata(["ship-1"], [{"source": "shipping.md", "page": 2}])
+
+    assert os.stat(index_path).st_mtime_ns == index_stat.st_mtime_ns
+    assert reopen(store).get(include=[])["ids"] == ["ship-1", "ship-2", "form-1", "extra-1"]
+
+
+def test_interrupted_log_record_is_ignored_and_overwritten(store):
+    log_path = os.path.join(store.persist_directory, "log-0.jsonl")
+    with open(log_path, "ab") as log:
+        log.write(b'{"op": "delete", "ids": ["ship-1"')
+
+    recovered = reopen(store)
+    assert recovered.get(include=[])["ids"] == list(TEXTS)
+
+    recovered.add_texts(["Returns are free within thirty days."], metadatas=[{"source": "returns.md"}], ids=["ret-1"])
+    assert reopen(store).get(include=[])["ids"] == list(TEXTS) + ["ret-1"]
+
+
+def test_stale_entries_are_compacted_into_a_new_generation(store, monkeypatch):
+    monkeypatch.setattr(numpy_store, "COMPACT_MIN_DEAD_ROWS", 2)
+    other = reopen(store)
+
+    # Compaction starts once stale entries outnumber both the minimum and the live chunks
+    for version in range(6):
+        store.add_texts([f"Express shipping costs {version} dollars."], metadatas=[{"source": "shipping.md"}], ids=["ship-1"])
+
+    files = sorted(os.listdir(store.persist_directory))
+    assert "log-0.jsonl" not in files and "vectors-0.f32" not in files
+    for instance in (store, other, reopen(store)):
+        assert instance.get(ids=["ship-1"])["documents"] == ["Express shipping costs 5 dollars."]
+        assert instance.similarity_search("discount code SAVE15", k=1)[0].id == "code-1"
+
+
+def test_delete_collection_removes_the_store_files(store):
+    open(os.path.join(store.persist_directory, "keep.txt"), "w").close()
+
+    store.delete_collection()
+
+    assert os.listdir(store.persist_directory) == ["keep.txt"]
+    assert reopen(store).get()["ids"] == []
+    assert store.similarity_search("shipping", k=2) == []
+
+
+def test_add_embeddings_stores_the_given_vectors(store):
+    store.add_embeddings([("Gift wrapping costs three dollars.", [3.0] + [0.0] * 255)],
+                         metadatas=[{"source": "extras.md"}], ids=["extra-1"])
+
+    got = reopen(store).get(ids=["extra-1"], include=["documents", "embeddings"])
+    assert got["documents"] == ["Gift wrapping costs three dollars."]
+    np.testing.assert_allclose(got["embeddings"][0], [1.0] + [0.0] * 255)
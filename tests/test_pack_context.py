@@ -0,0 +1,104 @@
+"""
+Packing retrieved passages into a prompt token budget.
+"""
+import random
+
+from langchain_core.documents import Document
+
+import backend
+
+
+class WordCounter:
+    """Counts one token per word, so budgets are easy to reason about."""
+
+    def count(self, text):
+        return len(text.split())
+
+    def truncate(self, text, max_tokens):
+        return " ".join(text.split()[:max_tokens])
+
+
+COUNTER = WordCounter()
+
+
+def passage(source, words):
+    return Document(page_content=" ".join(f"{source}-{i}" for i in range(words)), metadata={"source": source})
+
+
+def cost(doc):
+    overhead = backend.PASSAGE_OVERHEAD_TOKENS + COUNTER.count(backend._format_source(doc.metadata))
+    return overhead + COUNTER.count(doc.page_content)
+
+
+def sources(section):
+    return [doc.metadata["source"] for doc in section]
+
+
+def test_everything_is_packed_when_it_fits():
+    docs = [passage("a.md", 20), passage("b.md", 30)]
+    html = [passage("page.html", 25)]
+
+    packed = backend._pack_context([docs, html], sum(cost(doc) for doc in docs + html), COUNTER)
+
+    assert packed == [docs, html]
+
+
+def test_passage_that_does_not_fit_makes_room_for_shorter_ones():
+    docs = [passage("a.md", 40), passage("big.md", 200), passage("c.md", 40)]
+
+    packed = backend._pack_context([docs], cost(docs[0]) + cost(docs[2]) + 10, COUNTER)
+
+    assert sources(packed[0]) == ["a.md", "c.md"]
+
+
+def test_sections_are_interleaved_by_rank():
+    docs = [passage("a.md", 30), passage("b.md", 30)]
+    html = [passage("page.html", 30), passage("form.html", 30)]
+
+    packed = backend._pack_context([docs, html], 3 * cost(docs[0]), COUNTER)
+
+    # Rank 0 of both sections, then rank 1 of the first section wins the tie
+    assert sources(packed[0]) == ["a.md", "b.md"]
+    assert sources(packed[1]) == ["page.html"]
+
+
+def test_oversized_best_passage_is_truncated_to_the_remaining_budget():
+    docs = [passage("a.md", 50)]
+    html = [passage("page.html", 2000)]
+    budget = 600
+
+    packed = backend._pack_context([docs, html], budget, COUNTER)
+
+    assert sources(packed[0]) == ["a.md"]
+    fragment = packed[1][0]
+    assert fragment.metadata["truncated"] is True
+    assert html[0].page_content.startswith(fragment.page_content)
+    assert COUNTER.count(fragment.page_content) >= backend.MIN_TRUNCATED_PASSAGE_TOKENS
+    # Whatever the other section left is handed to the truncated passage
+    assert sum(cost(doc) for section in packed for doc in section) == budget
+    assert "truncated" not in html[0].metadata
+
+
+def test_nothing_is_truncated_below_the_minimum_worth_sending():
+    html = [passage("page.html", 2000)]
+    budget = backend.PASSAGE_OVERHEAD_TOKENS + backend.MIN_TRUNCATED_PASSAGE_TOKENS // 2
+
+    assert backend._pack_context([html], budget, COUNTER) == [[]]
+
+
+def test_packed_passages_never_exceed_the_budget():
+    rng = random.Random(7)
+    for _ in range(200):
+        sections = [
+            [passage(f"s{section}-{rank}.md", rng.randint(1, 400)) for rank in range(rng.randint(0, 6))]
+            for section in range(rng.randint(1, 3))
+        ]
+        budget = rng.randint(0, 1500)
+
+        packed = backend._pack_context(sections, budget, COUNTER)
+
+        assert sum(cost(doc) for section in packed for doc in section) <= budget
+        for candidates, chosen in zip(sections, packed):
+            assert [doc.metadata["source"] for doc in chosen] == [
+                doc.metadata["source"] for doc in candidates if doc.metadata["source"] in sources(chosen)
+            ]
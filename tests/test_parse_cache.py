@@ -0,0 +1,65 @@
+"""
+Parsed-document cache: hits across rebuilds, LRU eviction and readers.
+"""
+import os
+import time
+
+import backend
+
+TEXT = "## Returns\nItems can be returned within thirty days of delivery for a full refund.\n"
+
+
+def cache_entries(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith(".jsonl"))
+
+
+def test_rebuild_reads_parser_output_from_the_cache(make_backend, write_doc):
+    qa_backend = make_backend()
+    paths = [write_doc("a.md", TEXT + "a"), write_doc("b.md", TEXT + "b")]
+
+    first = qa_backend.ingest_documents(paths, "")
+    rebuilt = qa_backend.ingest_documents(paths, "", rebuild=True)
+
+    assert first["stats"]["parse_cache_hits"] == 0
+    assert rebuilt["stats"]["parse_cache_hits"] == 2
+    assert qa_backend.list_sources() == ["a.md", "b.md"]
+
+
+def test_least_recently_used_entries_are_evicted(tmp_path):
+    cache = backend.ParsedDocumentCache(str(tmp_path), max_bytes=250)
+    for i, file_hash in enumerate(["touched", "stale", "new"]):
+        spool = tmp_path / f"spool-{file_hash}"
+        spool.write_text("x" * 100)
+        cache.put(file_hash, str(spool))
+        entry = cache._entry_path(file_hash)
+        os.utime(entry, (time.time() - 100 + i, time.time() - 100 + i))
+    cache.get("touched")
+
+    assert cache.evict() == 1
+    assert cache.get("stale") is None
+    assert cache.get("touched") and cache.get("new")
+
+
+def test_eviction_waits_for_builds_reading_the_cache(tmp_path):
+    cache = backend.ParsedDocumentCache(str(tmp_path), max_bytes=1)
+    spool = tmp_path / "spool"
+    spool.write_text("x" * 100)
+    cache.put("hash", str(spool))
+
+    with cache.reading():
+        assert cache.get("hash")
+        assert cache.evict() == 0
+        assert cache_entries(tmp_path)
+
+    assert cache.evict() == 1
+    assert cache_entries(tmp_path) == []
+
+
+def test_document_is_parsed_again_if_its_cached_output_is_gone(make_backend, write_doc, tmp_path):
+    qa_backend = make_backend()
+    path = write_doc("a.md", TEXT)
+    missing = str(tmp_path / "evicted.jsonl")
+
+    segments = list(qa_backend._iter_parsed_segments(path, "hash", {path: missing}))
+
+    assert "".join(segment["text"] for segment in segments) == TEXT
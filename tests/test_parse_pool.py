@@ -0,0 +1,103 @@
+"""
+Parsing in the process pool: per-file timeouts and crash isolation.
+
+The misbehaving parsers are patched into this process and reach the pool
+workers by fork, so these tests need the fork start method.
+"""
+import multiprocessing
+import os
+import signal
+import time
+from pathlib import Path
+
+import pytest
+
+import backend
+
+pytestmark = pytest.mark.skipif(
+    multiprocessing.get_start_method() != "fork", reason="patched parsers reach the workers only by fork"
+)
+
+TEXT = "## Returns\nItems can be returned within thirty days of delivery for a full refund.\n"
+
+
+@pytest.fixture
+def misbehaving_parser(monkeypatch, workdir):
+    """Make files named hang-*, stuck-* and crash-* hang, ignore the alarm, or kill their worker."""
+    parse = backend._iter_segments_by_type
+
+    def patched(document):
+        name = Path(str(document)).name
+        if name.startswith(("hang-", "stuck-", "crash-")):
+            (workdir / f"{name}.pid").write_text(str(os.getpid()))
+        if name.startswith("hang-"):
+            time.sleep(60)
+        elif name.startswith("stuck-"):
+            # Like a parser stuck in native code: the timeout alarm cannot interrupt it
+            signal.pthread_sigmask(signal.SIG_BLOCK, {signal.SIGALRM})
+            time.sleep(60)
+        elif name.startswith("crash-"):
+            os._exit(1)
+        return parse(document)
+
+    monkeypatch.setattr(backend, "_iter_segments_by_type", patched)
+    monkeypatch.setenv("QA_VECTOR_STORE", "numpy")
+    monkeypatch.setenv("QA_PARSE_TIMEOUT", "1")
+
+
+def process_ended(pid: int) -> bool:
+    """Whether a process has exited (a zombie waiting to be reaped counts as ended)."""
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().rsplit(")", 1)[1].split()[0] == "Z"
+    except FileNotFoundError:
+        return True
+
+
+def parsed_events(events, source):
+    return [event for event in events if event["stage"] == "parsed" and event["source"] == source]
+
+
+def test_parser_over_its_time_budget_only_costs_its_file(misbehaving_parser, write_doc):
+    qa_backend = backend.QAAgentBackend()
+    events = []
+    started = time.perf_counter()
+
+    result = qa_backend.ingest_documents(
+        [write_doc("ok.md", TEXT), write_doc("hang-1.md", TEXT + "slow")], "", progress_callback=events.append
+    )
+
+    assert time.perf_counter() - started < 20
+    assert result["status"] == "success"
+    assert qa_backend.list_sources() == ["ok.md"]
+    assert [event["ok"] for event in parsed_events(events, "hang-1.md")] == [False]
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc"), reason="checks worker processes through /proc")
+def test_worker_stuck_past_the_deadline_is_killed(misbehaving_parser, write_doc, workdir):
+    qa_backend = backend.QAAgentBackend()
+    started = time.perf_counter()
+
+    result = qa_backend.ingest_documents([write_doc("ok.md", TEXT), write_doc("stuck-1.md", TEXT + "stuck")], "")
+
+    assert time.perf_counter() - started < 20
+    assert result["status"] == "success"
+    assert qa_backend.list_sources() == ["ok.md"]
+    pid = int((workdir / "stuck-1.md.pid").read_text())
+    deadline = time.monotonic() + 5
+    while not process_ended(pid) and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert process_ended(pid)
+
+
+def test_crashing_parser_does_not_take_other_files_down(misbehaving_parser, write_doc):
+    qa_backend = backend.QAAgentBackend()
+    events = []
+    paths = [write_doc("a.md", TEXT + "a"), write_doc("crash-1.md", TEXT + "crash"), write_doc("b.md", TEXT + "b")]
+
+    result = qa_backend.ingest_documents(paths, "", progress_callback=events.append)
+
+    assert result["status"] == "success"
+    assert qa_backend.list_sources() == ["a.md", "b.md"]
+    assert [event["ok"] for event in parsed_events(events, "crash-1.md")] == [False]
+    assert all(event["ok"] for source in ("a.md", "b.md") for event in parsed_events(events, source))
@@ -0,0 +1,51 @@
+"""
+Ingestion progress events.
+"""
+
+TEXT = "\n\n".join(
+    f"## Section {i}\nSection {i} explains how orders of type {i} are packed, labelled and handed "
+    f"to the carrier, and which of the {i * 2} warehouse checks apply before they ship."
+    for i in range(1, 8)
+)
+
+
+def test_every_event_counts_files(make_backend, write_doc):
+    qa_backend = make_backend()
+    paths = [write_doc("a.md", TEXT), write_doc("b.md", TEXT.replace("orders", "returns"))]
+
+    events = list(qa_backend.iter_ingest_documents(paths, ""))
+
+    assert all(event["files_total"] == 2 for event in events)
+    done = [event["files_done"] for event in events]
+    assert done == sorted(done) and done[-1] == 2
+    indexed = {event["source"]: event for event in events if event["stage"] == "indexed"}
+    assert [event["files_done"] for event in indexed.values()] == [1, 2]
+    # Unchanged sources are done once they are hashed
+    rerun = list(qa_backend.iter_ingest_documents(paths, ""))
+    assert next(event for event in rerun if event["stage"] == "hashed")["files_done"] == 2
+
+
+def test_chunked_event_reports_the_split_of_each_source(make_backend, write_doc):
+    qa_backend = make_backend()
+    paths = [write_doc("a.md", TEXT), write_doc("copy.md", TEXT)]
+
+    events = list(qa_backend.iter_ingest_documents(paths, ""))
+
+    stages = [(event["stage"], event.get("source")) for event in events]
+    for source in ("a.md", "copy.md"):
+        assert stages.index(("chunked", source)) < stages.index(("indexed", source))
+    chunked = {event["source"]: event for event in events if event["stage"] == "chunked"}
+    indexed = {event["source"]: event for event in events if event["stage"] == "indexed"}
+    assert chunked["a.md"]["chunks"] == indexed["a.md"]["chunks"] > 1
+    assert chunked["a.md"]["deduplicated"] == 0
+    assert chunked["copy.md"]["chunks"] == chunked["copy.md"]["deduplicated"] == chunked["a.md"]["chunks"]
+
+
+def test_stopping_early_releases_the_build(make_backend, write_doc):
+    qa_backend = make_backend()
+    events = qa_backend.iter_ingest_documents([write_doc("a.md", TEXT)], "")
+    next(events)
+    events.close()
+
+    assert not qa_backend.shared_knowledge_base.build_lock.locked()
+    assert qa_backend.ingest_documents([write_doc("a.md", TEXT)], "")["status"] == "success"
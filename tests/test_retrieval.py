@@ -0,0 +1,165 @@
+"""
+Retrieval over a built knowledge base: provenance, source-scoped search,
+keyword/vector fusion, redundancy-aware passage selection and batched search.
+"""
+import hashlib
+from pathlib import Path
+
+import numpy as np
+import pytest
+from langchain_core.documents import Document
+
+import backend
+
+SPECS = Path(__file__).resolve().parent.parent / "test_assets" / "product_specs.md"
+
+FAQ = "\n\n".join(
+    f"## Question {i}\nCustomers often ask about order {i}. Support replies within {i} hours "
+    f"and keeps the conversation in ticket queue {i} until the customer confirms."
+    for i in range(1, 10)
+)
+
+
+def test_keyword_terms_keep_compound_identifiers():
+    assert backend._keyword_terms("Fill the full-name field with SAVE15") == [
+        "fill", "full-name", "full", "name", "field", "save15"
+    ]
+
+
+def test_keyword_index_ranks_by_bm25_within_the_filter(tmp_path):
+    index = backend.KeywordIndex(str(tmp_path / "keywords.sqlite3"))
+    texts = {
+        "a-1": ("a.md", "The code SAVE15 takes fifteen percent off. SAVE15 stacks with free shipping."),
+        "a-2": ("a.md", "The code SAVE20 takes twenty percent off."),
+        "b-1": ("b.md", "Enter SAVE15 in the discount field."),
+    }
+    for chunk_id, (source, text) in texts.items():
+        index.add(source, [Document(id=chunk_id, page_content=text, metadata={"chunk_hash": chunk_id})])
+
+    assert [chunk_id for chunk_id, _ in index.search("save15", k=3)] == ["a-1", "b-1"]
+    assert [chunk_id for chunk_id, _ in index.search("SAVE15", k=3, where={"source": "b.md"})] == ["b-1"]
+    index.remove(["a-1"])
+    assert [chunk_id for chunk_id, _ in index.search("SAVE15", k=3)] == ["b-1"]
+
+
+def test_rrf_ranks_ids_found_by_both_retrievers_first():
+    fused = backend._reciprocal_rank_fusion([["a", "b", "c"], ["c", "d", "a"]])
+
+    assert [chunk_id for chunk_id, _ in fused] == ["a", "c", "b", "d"]
+    scores = dict(fused)
+    assert scores["a"] == pytest.approx(1 / (backend.RRF_K + 1) + 1 / (backend.RRF_K + 3))
+    assert scores["b"] == pytest.approx(1 / (backend.RRF_K + 2))
+
+
+def test_rrf_of_nothing_is_empty():
+    assert backend._reciprocal_rank_fusion([[], []]) == []
+
+
+def chunk(text, index, source="a.md", heading="Shipping"):
+    return Document(page_content=text, metadata={"source": source, "heading": heading, "chunk_index": index})
+
+
+def test_neighbouring_chunks_are_merged_without_their_overlap():
+    docs = [
+        chunk("Express shipping costs $10", 4),
+        chunk("Returns are free.", 0, heading="Returns"),
+        chunk("costs $10 and arrives in two days.", 5),
+        chunk("Gift wrapping is extra.", 7),
+    ]
+
+    passages, scores, members = backend._merge_adjacent_chunks(docs, [0.9, 0.5, 0.7, 0.4], max_overlap=20, max_chunks=3)
+
+    assert [doc.page_content for doc in passages] == [
+        "Express shipping costs $10 and arrives in two days.",
+        "Returns are free.",
+        "Gift wrapping is extra.",
+    ]
+    assert members == [[0, 2], [1], [3]]
+    assert scores == [0.9, 0.5, 0.4]
+    assert [doc.metadata["chunk_count"] for doc in passages] == [2, 1, 1]
+
+
+def test_mmr_skips_a_near_duplicate_of_a_selected_passage():
+    vectors = np.array([[1.0, 0.0], [0.999, 0.045], [0.0, 1.0]])
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+
+    assert backend._mmr_select([1.0, 0.95, 0.6], vectors, [1, 1, 1], 2) == [0, 2]
+    # Without the diversity term the two near-duplicates win
+    assert backend._mmr_select([1.0, 0.95, 0.6], vectors, [1, 1, 1], 2, lambda_mult=1.0) == [0, 1]
+
+
+def test_mmr_counts_passage_sizes_against_the_chunk_budget():
+    vectors = np.eye(3)
+
+    assert backend._mmr_select([1.0, 0.9, 0.8], vectors, [3, 1, 1], 2) == [1, 2]
+    assert backend._mmr_select([1.0, 0.9, 0.8], vectors, [3, 1, 1], 4) == [0, 1]
+    assert backend._mmr_select([], np.zeros((0, 3)), [], 4) == []
+
+
+@pytest.fixture
+def built_backend(make_backend, write_doc):
+    qa_backend = make_backend()
+    result = qa_backend.ingest_documents([str(SPECS), write_doc("faq.md", FAQ)], "")
+    assert result["status"] == "success"
+    return qa_backend
+
+
+def test_chunks_record_their_provenance(built_backend):
+    hits = built_backend._hybrid_search("express shipping cost", k=1)
+
+    metadata = hits[0].metadata
+    assert metadata["source"] == "product_specs.md"
+    assert metadata["file_hash"] == hashlib.sha256(SPECS.read_bytes()).hexdigest()
+    assert metadata["chunk_hash"] == backend._sha256_text(hits[0].page_content)
+    assert metadata["heading"].endswith("Shipping Options > Express Shipping")
+
+
+def test_source_filter_shapes():
+    assert backend._source_filter(["faq.md"]) == {"source": "faq.md"}
+    assert backend._source_filter(["a.md", "b.md"]) == {"source": {"$in": ["a.md", "b.md"]}}
+    assert backend._source_filter(None) == {"source": {"$ne": backend.HTML_SOURCE}}
+
+
+def test_search_filter_scopes_retrieval_to_sources(built_backend):
+    hits = built_backend._hybrid_search("discount code", k=4, search_filter=backend._source_filter(["faq.md"]))
+
+    assert hits and all(doc.metadata["source"] == "faq.md" for doc in hits)
+
+
+def test_exact_identifier_is_retrieved_first(built_backend):
+    hits = built_backend._hybrid_search("SAVE15", k=4)
+
+    assert "SAVE15" in hits[0].page_content
+    assert sum(doc.metadata.get("chunk_count", 1) for doc in hits) <= 4
+
+
+def test_selected_passages_are_distinct(built_backend):
+    hits = built_backend._hybrid_search("support ticket queue reply hours", k=6)
+
+    texts = [doc.page_content for doc in hits]
+    assert len(set(texts)) == len(texts)
+    assert all(doc.metadata["source"] == "faq.md" for doc in hits[:2])
+
+
+def test_batched_search_matches_single_queries(built_backend, monkeypatch):
+    # Compare real searches, not cached results
+    monkeypatch.setattr(backend, "RETRIEVAL_CACHE", backend.LRUCache(0))
+    queries = ["SAVE15 discount", "express shipping cost", "ticket queue"]
+
+    batched = built_backend._hybrid_search_many(queries, 4)
+
+    for query, hits in zip(queries, batched):
+        assert [doc.page_content for doc in hits] == [doc.page_content for doc in built_backend._hybrid_search(query, 4)]
+
+
+def test_vector_store_searches_many_vectors_in_one_query(built_backend):
+    store = built_backend.vector_store
+    vectors = built_backend.vector_store_embeddings.embed_queries(["express shipping cost", "ticket queue"])
+
+    batched = store.similarity_search_by_vectors(vectors, k=3, filter={"source": "faq.md"})
+
+    assert [[doc.page_content for doc in hits] for hits in batched] == [
+        [doc.page_content for doc in store.similarity_search_by_vector(vector, k=3, filter={"source": "faq.md"})]
+        for vector in vectors
+    ]
+    assert all(doc.id and doc.metadata["source"] == "faq.md" for hits in batched for doc in hits)
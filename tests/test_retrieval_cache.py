@@ -0,0 +1,73 @@
+"""
+Process-wide query embedding and retrieval caches tied to the knowledge base version.
+"""
+import pytest
+
+import backend
+
+OLD = "## Express Shipping\nExpress shipping costs $10 and arrives within two business days.\n"
+NEW = "## Express Shipping\nExpress shipping costs $25 and arrives the next business day.\n"
+
+
+@pytest.fixture
+def caches(monkeypatch):
+    """Fresh caches, so results cached by other tests are not reused."""
+    retrieval, queries = backend.LRUCache(16), backend.LRUCache(16)
+    monkeypatch.setattr(backend, "RETRIEVAL_CACHE", retrieval)
+    monkeypatch.setattr(backend, "QUERY_EMBEDDING_CACHE", queries)
+    return retrieval, queries
+
+
+def test_lru_cache_evicts_the_least_recently_used_entry():
+    cache = backend.LRUCache(2)
+    cache.put("a", 1)
+    cache.put("b", 2)
+    cache.get("a")
+    cache.put("c", 3)
+
+    assert (cache.get("a"), cache.get("b"), cache.get("c")) == (1, None, 3)
+    assert (cache.hits, cache.misses) == (3, 1)
+    disabled = backend.LRUCache(0)
+    disabled.put("a", 1)
+    assert disabled.get("a") is None
+
+
+def test_repeated_query_is_served_from_the_caches(make_backend, write_doc, caches):
+    retrieval, queries = caches
+    qa_backend = make_backend()
+    qa_backend.ingest_documents([write_doc("shipping.md", OLD)], "")
+
+    first = qa_backend._hybrid_search("express shipping cost", k=2)
+    second = qa_backend._hybrid_search("express shipping cost", k=2)
+
+    assert [doc.page_content for doc in second] == [doc.page_content for doc in first]
+    assert retrieval.hits == 1 and queries.hits == 0
+    # Another k is another result, for the same query vector
+    qa_backend._hybrid_search("express shipping cost", k=1)
+    assert retrieval.hits == 1 and queries.hits == 1
+
+
+def test_build_invalidates_cached_results(make_backend, write_doc, caches):
+    retrieval, _ = caches
+    qa_backend = make_backend()
+    path = write_doc("shipping.md", OLD)
+    qa_backend.ingest_documents([path], "")
+    assert "$10" in qa_backend._hybrid_search("express shipping cost", k=1)[0].page_content
+
+    write_doc("shipping.md", NEW)
+    qa_backend.ingest_documents([path], "")
+
+    assert "$25" in qa_backend._hybrid_search("express shipping cost", k=1)[0].page_content
+    assert retrieval.hits == 0
+
+
+def test_build_by_another_backend_invalidates_cached_results(make_backend, write_doc, caches):
+    reader, builder = make_backend(), make_backend()
+    path = write_doc("shipping.md", OLD)
+    builder.ingest_documents([path], "")
+    assert "$10" in reader._hybrid_search("express shipping cost", k=1)[0].page_content
+
+    write_doc("shipping.md", NEW)
+    builder.ingest_documents([path], "")
+
+    assert "$25" in reader._hybrid_search("express shipping cost", k=1)[0].page_content
@@ -0,0 +1,42 @@
+"""
+Ingesting in-memory uploads, inline and through the parser pool.
+"""
+import io
+import os
+
+import pytest
+
+import backend
+
+FAQ = "## Refunds\nRefunds for orders paid with the code SAVE15 are issued to the original card within 5 days.\n"
+SPEC = '{"checkout": {"express_shipping": {"cost": "$10", "delivery": "2-3 business days"}}}'
+
+
+@pytest.mark.parametrize("workers, spool_mb", [("1", "32"), ("2", "32"), ("2", "0")],
+                         ids=["inline", "pool-bytes", "pool-spooled"])
+def test_uploads_are_indexed_from_memory(make_backend, workdir, workers, spool_mb):
+    qa_backend = make_backend(QA_PARSE_WORKERS=workers, QA_UPLOAD_SPOOL_MB=spool_mb)
+    uploads = [
+        backend.DocumentSource("faq.md", io.BytesIO(FAQ.encode("utf-8"))),
+        backend.DocumentSource("spec.json", SPEC.encode("utf-8")),
+    ]
+
+    result = qa_backend.ingest_documents(uploads, "")
+
+    assert result["status"] == "success", result["message"]
+    assert qa_backend.list_sources() == ["faq.md", "spec.json"]
+    hits = qa_backend._hybrid_search("express shipping cost", k=2, search_filter=backend._source_filter(["spec.json"]))
+    assert hits and "$10" in hits[0].page_content
+    # Nothing is left on disk besides the stores and caches
+    assert not os.path.exists(workdir / "temp_uploads")
+    assert not [name for name in os.listdir(workdir / "parse_cache") if name.startswith(".spool-")]
+
+
+def test_unchanged_upload_is_not_parsed_again(make_backend):
+    qa_backend = make_backend()
+    qa_backend.ingest_documents([backend.DocumentSource("faq.md", FAQ.encode("utf-8"))], "")
+
+    result = qa_backend.ingest_documents([backend.DocumentSource("faq.md", io.BytesIO(FAQ.encode("utf-8")))], "")
+
+    assert result["stats"]["sources_unchanged"] == 1
+    assert result["stats"]["chunks_embedded"] == 0